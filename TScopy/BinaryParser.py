@@ -84,6 +84,30 @@ class Mmap(object):
         self._f.close()
 
 
+def is_mutable(buf):
+    """
+    Returns True if the buffer can be patched in place, that is, it is a
+      bytearray or a writable memoryview.
+    """
+    if isinstance(buf, bytearray):
+        return True
+    return isinstance(buf, memoryview) and not buf.readonly
+
+
+def to_string(buf):
+    """
+    Returns a str copy of the given buffer, which may be a str, bytearray,
+      memoryview, array or buffer object.
+    """
+    if isinstance(buf, str):
+        return buf
+    if isinstance(buf, memoryview):
+        return buf.tobytes()
+    if hasattr(buf, "tostring"):
+        return buf.tostring()
+    return str(buf)
+
+
 def hex_dump(src, start_addr=0):
     """
     see:
@@ -96,6 +120,7 @@ def hex_dump(src, start_addr=0):
       data is interpreted as starting at this offset, and
       the offset column is updated accordingly.
     """
+    src = to_string(src)
     FILTER = ''.join([(len(repr(chr(x))) == 3) and
                         chr(x) or
                         '.' for x in range(256)])
@@ -385,11 +410,219 @@ def read_dword(buf, offset):
         raise OverrunBufferException(offset, len(buf))
 
 
+BASIC_SIZES = {
+    "byte": 1,
+    "int8": 1,
+    "word": 2,
+    "word_be": 2,
+    "int16": 2,
+    "dword": 4,
+    "dword_be": 4,
+    "int32": 4,
+    "qword": 8,
+    "int64": 8,
+    "float": 4,
+    "double": 8,
+    "dosdate": 4,
+    "filetime": 8,
+    "systemtime": 8,
+    "guid": 16,
+}
+
+# little-endian struct codes for the basic types that can be packed
+#  into a single struct.Struct.  The rest are decoded one at a time.
+PACKED_FORMATS = {
+    "byte": "B",
+    "int8": "b",
+    "word": "H",
+    "int16": "h",
+    "dword": "I",
+    "int32": "i",
+    "qword": "Q",
+    "int64": "q",
+    "float": "f",
+    "double": "d",
+    "filetime": "Q",
+}
+
+
+class Layout(object):
+    """
+    A compiled, class-level description of the fields of a Block.
+
+    Fields with a constant offset and size are packed into one
+      struct.Struct, which is unpacked once per instance on first access.
+    Fields whose offset or length is only known once the buffer is
+      parsed (given as a callable taking the block) are resolved lazily
+      each time they are accessed.
+    """
+    def __init__(self, fields):
+        """
+        Constructor.
+        Arguments:
+        - `fields`: A sequence of (type, name, offset, length) tuples.
+            `offset` may be None for the implicit offset following the
+            previous field.  `offset` and `length` may be callables.
+        """
+        super(Layout, self).__init__()
+        self.fields = []
+        self.declared_fields = []
+        self.offsets = {}
+        self._packed = {}
+        self._dynamic = {}
+
+        implicit_offset = 0
+        for field in fields:
+            type_, name, offset, length = (tuple(field) + (None, None))[:4]
+            if offset is None:
+                if implicit_offset is None:
+                    raise ParseException("Implicit offset not supported after dynamic field: " + name)
+                offset = implicit_offset
+            self.fields = [f for f in self.fields if f[1] != name]
+            self.fields.append((type_, name, offset, length))
+            implicit_offset = Layout._field_end(type_, offset, length)
+
+        fmt = "<"
+        position = 0
+        for type_, name, offset, length in sorted(self.fields, key=Layout._sort_key):
+            code = None
+            if isinstance(offset, (int, long)) and offset >= position:
+                if type_ in PACKED_FORMATS and length is None:
+                    code = PACKED_FORMATS[type_]
+                elif type_ in ("binary", "string") and isinstance(length, (int, long)):
+                    code = "%ds" % length
+            if code is None:
+                self._dynamic[name] = (type_, offset, length)
+                continue
+            fmt += "%dx%s" % (offset - position, code)
+            self._packed[name] = (len(self._packed), type_, offset, length)
+            position = offset + struct.calcsize("<" + code)
+        self.struct = struct.Struct(fmt)
+
+        for type_, name, offset, length in self.fields:
+            if isinstance(offset, (int, long)):
+                self.offsets[name] = offset
+            if isinstance(type_, type):
+                type_ = type_.__name__
+            self.declared_fields.append({
+                "offset": offset,
+                "type": type_,
+                "name": name,
+                "length": length,
+                "count": 1,
+            })
+        self.implicit_offset = implicit_offset or 0
+
+    @staticmethod
+    def _sort_key(field):
+        if isinstance(field[2], (int, long)):
+            return field[2]
+        return sys.maxint
+
+    @staticmethod
+    def _field_end(type_, offset, length):
+        if not isinstance(offset, (int, long)):
+            return None
+        if isinstance(type_, basestring):
+            if length is None and type_ in BASIC_SIZES:
+                return offset + BASIC_SIZES[type_]
+            if isinstance(length, (int, long)):
+                if type_ == "wstring":
+                    return offset + 2 * length
+                return offset + length
+        return None
+
+    def names(self):
+        return [field[1] for field in self.fields]
+
+    def unpack(self, buf, offset):
+        """
+        Unpack all the packed fields of a block at once.
+        Returns an empty tuple if the buffer is too short, in which case
+          the fields are unpacked individually as they are accessed.
+        """
+        try:
+            if hasattr(buf, "__unpackable__"):
+                return self.struct.unpack_from(buf[offset:offset + self.struct.size], 0)
+            return self.struct.unpack_from(buf, offset)
+        except struct.error:
+            return ()
+
+    def value(self, block, name):
+        """
+        Returns the value of the named field of the given block.
+        """
+        try:
+            index, type_, offset, length = self._packed[name]
+        except KeyError:
+            return self._dynamic_value(block, name)
+
+        values = block._values
+        if values is None:
+            values = block._values = self.unpack(block._buf, block._offset)
+        if not values:
+            if length is None:
+                return getattr(block, "unpack_" + type_)(offset)
+            return getattr(block, "unpack_" + type_)(offset, length)
+        if type_ == "filetime":
+            return parse_filetime(values[index])
+        return values[index]
+
+    def _dynamic_value(self, block, name):
+        try:
+            type_, offset, length = self._dynamic[name]
+        except KeyError:
+            raise AttributeError(name)
+        if callable(offset):
+            offset = offset(block)
+        if callable(length):
+            length = length(block)
+        if isinstance(type_, type):
+            return type_(block._buf, block.absolute_offset(offset), block)
+        if length is None:
+            return getattr(block, "unpack_" + type_)(offset)
+        return getattr(block, "unpack_" + type_)(offset, length)
+
+
+def layout_field(name):
+    """
+    Build the class-level accessor method for a field declared in a Layout.
+    """
+    def field(self):
+        return self._layout.value(self, name)
+    field.__name__ = name
+    return field
+
+
+class BlockType(type):
+    """
+    Metaclass for Block.  Compiles the `FIELDS` declared in a class body,
+      together with those of its parent class, into a Layout and adds an
+      accessor method for each field to the class.
+    """
+    def __init__(cls, name, bases, dct):
+        super(BlockType, cls).__init__(name, bases, dct)
+        if "FIELDS" not in dct:
+            return
+        parent = getattr(super(cls, cls), "_layout", None)
+        inherited = parent.fields if parent is not None else []
+        cls._layout = cls.compile_layout(inherited + list(dct["FIELDS"]))
+        cls._implicit_offset = cls._layout.implicit_offset
+
+
 class Block(object):
     """
     Base class for structure blocks in binary parsing.
     A block is associated with a offset into a byte-string.
+
+    Subclasses describe their structure with a class-level `FIELDS`
+      sequence of (type, name, offset, length) tuples, which is compiled
+      once per class.  `declare_field` can still be used to add fields to
+      a single instance.
     """
+    __metaclass__ = BlockType
+    FIELDS = ()
+
     def __init__(self, buf, offset):
         """
         Constructor.
@@ -399,14 +632,31 @@ class Block(object):
         """
         self._buf = buf
         self._offset = offset
-        self._implicit_offset = 0
-        # list of dict(offset:number, type:string, name:string,
-        #              length:number, count:number)
-        self._declared_fields = []
+        # the unpacked values of the packed fields of self._layout
+        self._values = None
 
     def __repr__(self):
         return "Block(buf=%r, offset=%r)" % (self._buf, self._offset)
 
+    @classmethod
+    def compile_layout(cls, fields):
+        """
+        Compile a Layout for this class and add accessor methods for
+          its fields.  Used by the metaclass for `FIELDS`, and directly by
+          blocks whose structure has variants, such as resident and
+          non-resident attributes.
+        @type fields:  sequence of tuples
+        @param fields: The (type, name, offset, length) of each field.
+        @rtype: Layout
+        @return The compiled Layout.
+        """
+        layout = Layout(fields)
+        for name in layout.names():
+            setattr(cls, name, layout_field(name))
+            if name in layout.offsets:
+                setattr(cls, "_off_" + name, layout.offsets[name])
+        return layout
+
     def declare_field(self, type_, name, offset=None, length=None, count=None):
         """
         Declaratively add fields to this block.
@@ -440,24 +690,7 @@ class Block(object):
         if offset is None:
             offset = self._implicit_offset
 
-        basic_sizes = {
-            "byte": 1,
-            "int8": 1,
-            "word": 2,
-            "word_be": 2,
-            "int16": 2,
-            "dword": 4,
-            "dword_be": 4,
-            "int32": 4,
-            "qword": 8,
-            "int64": 8,
-            "float": 4,
-            "double": 8,
-            "dosdate": 4,
-            "filetime": 8,
-            "systemtime": 8,
-            "guid": 16,
-        }
+        basic_sizes = BASIC_SIZES
 
         handler = None
 
@@ -574,8 +807,11 @@ class Block(object):
         @rtype: None
         @return: None
         """
-        if type(typename) == type:
+        if isinstance(typename, type):
             typename = typename.__name__
+        if "_declared_fields" not in self.__dict__:
+            # the layout's list is shared by every instance
+            self._declared_fields = list(self._layout.declared_fields)
         self._declared_fields.append({
                 "offset": offset,
                 "type": typename,
@@ -596,8 +832,10 @@ class Block(object):
         @return A nicely formatted string that describes this structure.
         """
         ret = ""
-        for field in self._declared_fields:
+        for field in self.__dict__.get("_declared_fields", self._layout.declared_fields):
             v = getattr(self, field["name"])()
+            if callable(field["offset"]):
+                field = dict(field, offset=field["offset"](self))
             if isinstance(v, Block):
                 if hasattr(v, "string"):
                     ret += "%s%s (%s)%s\t%s\n" % \
@@ -619,6 +857,8 @@ class Block(object):
             else:
                 if isinstance(v, int):
                     v = hex(v)
+                elif isinstance(v, memoryview):
+                    v = v.tobytes()
                 ret += "%s%s (%s)%s\t%s\n" % \
                     ("  " * indent, hex(field["offset"]), field["type"], 
                      field["name"],  str(v))
@@ -819,6 +1059,27 @@ class Block(object):
         except struct.error:
             raise OverrunBufferException(o, len(self._buf))
 
+    def unpack_view(self, offset, length=False):
+        """
+        Returns a memoryview over the raw binary data at the relative offset
+          with the given length, without copying it out of the buffer.
+          Buffers that do not support memoryview are sliced instead.
+        Arguments:
+        - `offset`: The relative offset from the start of the block.
+        - `length`: The length of the binary blob.
+        Throws:
+        - `OverrunBufferException`
+        """
+        if not length:
+            return ""
+        o = self._offset + offset
+        if o + length > len(self._buf):
+            raise OverrunBufferException(o, len(self._buf))
+        try:
+            return memoryview(self._buf)[o:o + length]
+        except TypeError:
+            return self._buf[o:o + length]
+
     def unpack_string(self, offset, length):
         """
         Returns a string from the relative offset with the given length.
@@ -840,12 +1101,8 @@ class Block(object):
         Throws:
         - `UnicodeDecodeError`
         """
-        try:
-            return self._buf[self._offset + offset:self._offset + offset + \
-                             2 * length].tostring().decode("utf16")
-        except AttributeError: # already a 'str' ?
-            return self._buf[self._offset + offset:self._offset + offset + \
-                             2 * length].decode("utf16")
+        return to_string(self._buf[self._offset + offset:self._offset + offset + \
+                                   2 * length]).decode("utf16")
 
     def unpack_dosdate(self, offset):
         """
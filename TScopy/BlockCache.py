@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict  # python 2.7 only
+
+
+####################################################################################
+#  BlockCache: A bounded LRU cache of block aligned reads from a volume.
+#       read_fn:    function( offset, size ) that reads directly from the volume
+#       block_size: Size of a cached block, normally the cluster size of the volume
+#       cache_size: Maximum number of bytes held by the cache
+#
+#   Reads are widened to whole blocks. Runs of missing blocks are fetched with a
+#   single call to read_fn. Reads larger than a quarter of the cache (file data)
+#   bypass it, so they cannot flush the MFT and index blocks out of it.
+####################################################################################
+class BlockCache( object ):
+    def __init__( self, read_fn, block_size, cache_size ):
+        self.__read_fn = read_fn
+        self.block_size = block_size
+        self.max_blocks = max( cache_size / block_size, 1 )
+        self.__blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    ####################################################################################
+    # read: Returns a bytearray with size bytes from the volume starting at offset.
+    #       The result is always a new buffer, so callers may fix it up in place.
+    ####################################################################################
+    def read( self, offset, size ):
+        bs = self.block_size
+        first = offset / bs
+        last = ( offset + size + bs - 1 ) / bs
+        if size <= 0:
+            return bytearray()
+        if last - first > self.max_blocks / 4:
+            return self.__read_fn( offset, size )
+
+        blocks = self.__blocks
+        buf = bytearray()
+        block = first
+        while block < last:
+            data = blocks.pop( block, None )
+            if data is not None:
+                blocks[block] = data
+                self.hits += 1
+                buf += data
+                block += 1
+                continue
+
+            # Coalesce the run of missing blocks into one read
+            end = block + 1
+            while end < last and not end in blocks:
+                end += 1
+            self.misses += end - block
+            data = self.__read_fn( block * bs, ( end - block ) * bs )
+            for i in range( 0, len( data ) - bs + 1, bs ):
+                self.__insert( block + i / bs, str( data[i:i + bs] ) )
+            buf += data
+            if len( data ) < ( end - block ) * bs:
+                # Short read, either the end of the volume or an error already logged
+                break
+            block = end
+
+        start = offset - first * bs
+        del buf[:start]
+        del buf[size:]
+        return buf
+
+    def __insert( self, block, data ):
+        self.__blocks[block] = data
+        while len( self.__blocks ) > self.max_blocks:
+            self.__blocks.popitem( last=False )
+
+    ####################################################################################
+    # clear: Drops all cached blocks. The hit and miss counters are kept.
+    ####################################################################################
+    def clear( self ):
+        self.__blocks.clear()
+
+    def __len__( self ):
+        return len( self.__blocks )
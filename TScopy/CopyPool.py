@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import threading
+import traceback
+import logging
+from multiprocessing.pool import ThreadPool
+
+
+####################################################################################
+#  CopyPool: A pool of threads that copy files from one volume. Each thread reads the
+#       volume through its own handle, opened the first time the thread runs a copy,
+#       so no file pointer is shared between threads.
+#       open_fn:  function() that opens the volume, returning a handle
+#       close_fn: function( handle ) that closes a handle
+#       jobs:     Number of threads
+#   At most 2 * jobs copies are waiting at a time, submit() blocks until a thread
+#   is free, so the files found while walking a directory are not all queued at once.
+####################################################################################
+class CopyPool( object ):
+    def __init__( self, open_fn, close_fn, jobs ):
+        self.__open_fn = open_fn
+        self.__close_fn = close_fn
+        self.__local = threading.local()
+        self.__handles = []
+        self.__slots = threading.Semaphore( 2 * jobs )
+        self.__idle = threading.Condition()
+        self.__pending = 0
+        self.__pool = ThreadPool( jobs )
+
+    ####################################################################################
+    # submit: Runs copy_fn( handle, *args ) in one of the threads
+    ####################################################################################
+    def submit( self, copy_fn, *args ):
+        self.__slots.acquire()
+        with self.__idle:
+            self.__pending += 1
+        self.__pool.apply_async( self.__run, ( copy_fn, args ) )
+
+    def __run( self, copy_fn, args ):
+        try:
+            copy_fn( self.__handle(), *args )
+        except:
+            logging.getLogger("tscopy").error( traceback.format_exc() )
+        finally:
+            self.__slots.release()
+            with self.__idle:
+                self.__pending -= 1
+                if self.__pending == 0:
+                    self.__idle.notify_all()
+
+    def __handle( self ):
+        handle = getattr( self.__local, 'handle', None )
+        if handle == None:
+            handle = self.__open_fn()
+            self.__local.handle = handle
+            with self.__idle:
+                self.__handles.append( handle )
+        return handle
+
+    ####################################################################################
+    # wait: Returns once every copy submitted so far is done
+    ####################################################################################
+    def wait( self ):
+        with self.__idle:
+            while self.__pending > 0:
+                self.__idle.wait()
+
+    ####################################################################################
+    # close: Waits for the copies, stops the threads and closes their handles
+    ####################################################################################
+    def close( self ):
+        self.wait()
+        self.__pool.close()
+        self.__pool.join()
+        for handle in self.__handles:
+            self.__close_fn( handle )
+        self.__handles = []
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import sys
+import threading
+from collections import deque
+
+
+####################################################################################
+#  data_extents: Yields ( file offset, volume offset, size ) for the data of a non resident
+#       attribute, in pieces of at most chunk_size bytes rounded down to whole clusters.
+#       The volume offset is None for sparse runs and the data past the initialized
+#       size, which are zero
+#   runs:  Runlist of the attribute as ( cluster or None when sparse, length ) tuples
+#   bpc:   Bytes per cluster
+####################################################################################
+def data_extents( runs, bpc, data_size, initialized_size, chunk_size ):
+    chunk_size = max( chunk_size / bpc, 1 ) * bpc
+    initialized_size = min( initialized_size, data_size )
+    written = 0
+    for cluster_offset, length in runs:
+        if written >= initialized_size:
+            break
+        run_size = min( length * bpc, initialized_size - written )
+        if cluster_offset == None:
+            yield written, None, run_size
+        else:
+            for pos in xrange( 0, run_size, chunk_size ):
+                yield written + pos, cluster_offset * bpc + pos, min( chunk_size, run_size - pos )
+        written += run_size
+    if written < data_size:
+        yield written, None, data_size - written
+
+
+####################################################################################
+#  copy_extents: Copies the extents of a file in jobs threads. Each thread reads the
+#       volume through its own handle and writes what it read at its offset in the
+#       output file through its own file object, so the extents are copied in any order.
+#       The output file must already exist with its full size, ranges not in extents
+#       are left as they are.
+#   extents:  Iterable of ( file offset, volume offset, size )
+#   path:     Output file
+#   open_fn:  function() that opens the volume, returning a handle
+#   close_fn: function( handle ) that closes a handle
+#   read_fn:  function( handle, offset, size ) returning size bytes of the volume
+#   The threads take the next extent as they finish one, so a few slow extents do
+#   not hold up the rest. The first exception raised by a thread stops the others and
+#   is raised again once they are done.
+####################################################################################
+def copy_extents( extents, path, open_fn, close_fn, read_fn, jobs ):
+    pending = deque( extents )
+    errors = []
+
+    def worker():
+        fd = None
+        out = None
+        try:
+            fd = open_fn()
+            out = open( path, 'r+b' )
+            while not errors:
+                try:
+                    file_offset, offset, size = pending.popleft()
+                except IndexError:
+                    return
+                buf = read_fn( fd, offset, size )
+                out.seek( file_offset )
+                out.write( buf )
+        except:
+            errors.append( sys.exc_info() )
+        finally:
+            if not out == None:
+                out.close()
+            if not fd == None:
+                close_fn( fd )
+
+    threads = [ threading.Thread( target=worker, name="tscopy-extent-%d" % i ) for i in range( min( jobs, len( pending ) ) ) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
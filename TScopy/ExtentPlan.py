@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+
+#   Output files kept open while the extents are written
+MAX_OPEN_FILES = 64
+
+
+####################################################################################
+#  ExtentPlan: The extents of the files to copy from one volume, gathered before any
+#       of them is read so that they can be read in the order they are on the disk
+#       instead of file by file.
+#   Files are numbered as they are added and each extent is kept as
+#   ( volume offset, file number, file offset, size ), which sorts by volume offset.
+####################################################################################
+class ExtentPlan( object ):
+    def __init__( self ):
+        self.__paths = []
+        self.__extents = []
+        self.__first = 0
+
+    ####################################################################################
+    # add_file: Adds the output file path and returns its number. A path added again
+    #       right after itself replaces its extents, as the file was truncated again
+    ####################################################################################
+    def add_file( self, path ):
+        if self.__paths and self.__paths[-1] == path:
+            del self.__extents[self.__first:]
+        else:
+            self.__paths.append( path )
+            self.__first = len( self.__extents )
+        return len( self.__paths ) - 1
+
+    ####################################################################################
+    # add_extent: Adds size bytes at volume offset to be written at file offset of file
+    ####################################################################################
+    def add_extent( self, number, file_offset, offset, size ):
+        self.__extents.append( ( offset, number, file_offset, size ) )
+
+    ####################################################################################
+    # path: Returns the output file path of file number
+    ####################################################################################
+    def path( self, number ):
+        return self.__paths[number]
+
+    ####################################################################################
+    # extents: Returns the extents as ( volume offset, file number, file offset, size )
+    #       sorted by volume offset, so the volume is read in a single sweep
+    ####################################################################################
+    def extents( self ):
+        self.__extents.sort()
+        return self.__extents
+
+    def __len__( self ):
+        return len( self.__extents )
+
+
+####################################################################################
+#  OutputFiles: Output files open for writing at any offset. Extents in disk order
+#       jump between files, so the files last written are kept open, up to
+#       MAX_OPEN_FILES, and the least recently used one is closed first.
+#   The files must already exist, they are opened without truncating them.
+####################################################################################
+class OutputFiles( object ):
+    def __init__( self, max_open=MAX_OPEN_FILES ):
+        self.__files = OrderedDict()
+        self.__max_open = max_open
+
+    ####################################################################################
+    # write: Writes buf at offset of the file at path
+    ####################################################################################
+    def write( self, path, offset, buf ):
+        fd = self.__files.pop( path, None )
+        if fd == None:
+            if len( self.__files ) >= self.__max_open:
+                self.__files.popitem( last=False )[1].close()
+            fd = open( path, 'r+b' )
+        self.__files[path] = fd
+        fd.seek( offset )
+        fd.write( buf )
+
+    ####################################################################################
+    # close: Closes every open file
+    ####################################################################################
+    def close( self ):
+        while self.__files:
+            self.__files.popitem()[1].close()
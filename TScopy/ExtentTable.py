@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import array
+import struct
+from bisect import bisect_left
+
+
+####################################################################################
+#  ExtentTable: Maps MFT record numbers to the (offset, length) fragments the record
+#       is stored in, for the records that straddle two $MFT dataruns.
+#
+#   The table is kept in three flat arrays rather than per record objects:
+#       records:   Sorted record numbers
+#       index:     For record n, its fragments are index[n] up to index[n+1]
+#       fragments: Packed (offset, length) pairs, FRAGMENT.size bytes each
+#   Records must be added in ascending order. The table pickles as raw array data.
+####################################################################################
+class ExtentTable( object ):
+    FRAGMENT = struct.Struct("<QI")
+    # Fragments closer together than this are fetched with a single read
+    MAX_SPAN = 0x10000
+
+    def __init__( self ):
+        self.__records = array.array('I')
+        self.__index = array.array('I', [0])
+        self.__fragments = bytearray()
+
+    ####################################################################################
+    # add: Adds the fragments of a record. fragments is a list of (offset, length)
+    ####################################################################################
+    def add( self, record, fragments ):
+        if len( self.__records ) and record <= self.__records[-1]:
+            raise Exception( "TSCOPY", "Extent table records out of order (%d)" % record )
+        for offset, length in fragments:
+            self.__fragments += ExtentTable.FRAGMENT.pack( offset, length )
+        self.__records.append( record )
+        self.__index.append( len( self.__fragments ) / ExtentTable.FRAGMENT.size )
+
+    ####################################################################################
+    # get: Returns the list of (offset, length) fragments of record or None if the
+    #      record is not split
+    ####################################################################################
+    def get( self, record ):
+        i = bisect_left( self.__records, record )
+        if i == len( self.__records ) or not self.__records[i] == record:
+            return None
+        size = ExtentTable.FRAGMENT.size
+        return [ ExtentTable.FRAGMENT.unpack_from( self.__fragments, n * size )
+                 for n in range( self.__index[i], self.__index[i+1] ) ]
+
+    ####################################################################################
+    # read: Reads record with read_fn( offset, size ) and returns it as a bytearray.
+    #       When the fragments lie within MAX_SPAN of each other they are read with one
+    #       call and cut out of the result, otherwise each is read on its own.
+    ####################################################################################
+    def read( self, read_fn, record ):
+        fragments = self.get( record )
+        if fragments == None:
+            return None
+        start = min( offset for offset, length in fragments )
+        end = max( offset + length for offset, length in fragments )
+        buf = bytearray()
+        if end - start <= ExtentTable.MAX_SPAN:
+            data = memoryview( read_fn( start, end - start ) )
+            for offset, length in fragments:
+                buf += data[offset - start:offset - start + length]
+        else:
+            for offset, length in fragments:
+                buf += read_fn( offset, length )
+        return buf
+
+    def __contains__( self, record ):
+        return not self.get( record ) == None
+
+    def __iter__( self ):
+        return iter( self.__records )
+
+    def __len__( self ):
+        return len( self.__records )
+
+    def __getstate__( self ):
+        return ( self.__records.tostring(), self.__index.tostring(), str( self.__fragments ) )
+
+    def __setstate__( self, state ):
+        self.__records = array.array('I')
+        self.__records.fromstring( state[0] )
+        self.__index = array.array('I')
+        self.__index.fromstring( state[1] )
+        self.__fragments = bytearray( state[2] )
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+import array
+import struct
+
+from MFT import INDEX_ENTRY_FLAGS, apply_fixups
+from BinaryParser import OverrunBufferException, to_string
+
+#   attribute type, collation rule, index record size in bytes, clusters per index record
+ROOT_HEADER = struct.Struct("<IIIB3x")
+#   entries offset, index length, allocated size, flags. Offsets are relative to the header
+NODE_HEADER = struct.Struct("<IIIB3x")
+#   magic, update sequence offset, update sequence count, lsn, vcn
+INDX_HEADER = struct.Struct("<4sHHQQ")
+#   mft reference, entry length, key length, flags
+ENTRY_HEADER = struct.Struct("<QHHH2x")
+QWORD = struct.Struct("<Q")
+#   filename length, namespace
+FILENAME_HEADER = struct.Struct("<BB")
+DWORD = struct.Struct("<I")
+
+#   Bytes of an $INDEX_ALLOCATION read at a time
+CHUNK_SIZE = 1024*1024
+
+#   Offsets of the file attributes and the filename in the $FILE_NAME key of an $I30 entry
+FILENAME_FLAGS = 0x38
+FILENAME_LENGTH = 0x40
+FILENAME_NAMESPACE = 0x41
+FILENAME = 0x42
+
+#   Namespace of a DOS 8.3 name that has its own entry next to the Win32 name of the file
+FILENAME_NAMESPACE_DOS = 2
+#   File attribute of the $FILE_NAME of a directory, whose record has an $I30 index
+FILE_ATTR_HAS_INDX = 0x10000000
+
+
+####################################################################################
+#  UpCase: The $UpCase table of a volume, used to compare filenames the way NTFS
+#       collates them in a directory index
+#       table: The $DATA of $UpCase, one little endian upper case WORD per UTF-16 unit
+####################################################################################
+class UpCase( object ):
+    def __init__( self, table ):
+        self.__table = array.array('H')
+        self.__table.fromstring( str( table[:0x20000] ) )
+
+    ####################################################################################
+    # key: Returns the collation key of a filename encoded as UTF-16LE. Keys compare
+    #      like COLLATION_FILENAME, unit by unit and then by length
+    ####################################################################################
+    def key( self, name ):
+        units = array.array('H')
+        units.fromstring( name )
+        table = self.__table
+        return [ table[unit] for unit in units ]
+
+
+####################################################################################
+#  iter_entries: Yields ( mft reference, flags, key offset, subnode vcn or None ) for
+#       each entry of the index node in buf between offset and end. The end entry,
+#       which has no key, is the last one yielded. Stops at the first entry that does
+#       not fit the node.
+####################################################################################
+def iter_entries( buf, offset, end ):
+    while offset + ENTRY_HEADER.size <= end:
+        mft_reference, length, key_length, flags = ENTRY_HEADER.unpack_from( buf, offset )
+        if length < ENTRY_HEADER.size or offset + length > end:
+            return
+        subnode = None
+        if flags & INDEX_ENTRY_FLAGS.INDEX_ENTRY_NODE:
+            subnode = QWORD.unpack_from( buf, offset + length - 8 )[0]
+        yield mft_reference, flags, offset + ENTRY_HEADER.size, subnode
+        if flags & INDEX_ENTRY_FLAGS.INDEX_ENTRY_END:
+            return
+        offset += length
+
+
+####################################################################################
+#  entry_name: Returns ( namespace, UTF-16LE filename ) from the $FILE_NAME key at
+#       key_offset
+####################################################################################
+def entry_name( buf, key_offset ):
+    length, namespace = FILENAME_HEADER.unpack_from( buf, key_offset + FILENAME_LENGTH )
+    start = key_offset + FILENAME
+    return namespace, to_string( buf[start:start + 2 * length] )
+
+
+####################################################################################
+#  index_children: Yields ( mft reference, filename, file attributes ) for each entry of
+#       the index node in buf between offset and end.
+#   A file with a DOS 8.3 name that differs from its long name has an entry for each
+#   name. The DOS entries are skipped, so each name is yielded without keeping track of
+#   the entries already seen.
+####################################################################################
+def index_children( buf, offset, end ):
+    for mft_reference, flags, key_offset, subnode in iter_entries( buf, offset, end ):
+        if flags & INDEX_ENTRY_FLAGS.INDEX_ENTRY_END or key_offset + FILENAME > end:
+            return
+        namespace, name = entry_name( buf, key_offset )
+        if namespace == FILENAME_NAMESPACE_DOS:
+            continue
+        yield mft_reference, name.decode( "utf-16le" ), DWORD.unpack_from( buf, key_offset + FILENAME_FLAGS )[0]
+
+
+####################################################################################
+#  root_node: Returns ( index record size, entries offset, entries end ) of the value
+#       of an $INDEX_ROOT attribute
+####################################################################################
+def root_node( root ):
+    index_record_size = ROOT_HEADER.unpack_from( root, 0 )[2]
+    entries_offset, index_length, allocated, flags = NODE_HEADER.unpack_from( root, ROOT_HEADER.size )
+    return index_record_size, ROOT_HEADER.size + entries_offset, ROOT_HEADER.size + index_length
+
+
+####################################################################################
+#  block_node: Returns ( entries offset, entries end ) of a fixed up INDX block
+####################################################################################
+def block_node( block ):
+    entries_offset, index_length, allocated, flags = NODE_HEADER.unpack_from( block, INDX_HEADER.size )
+    return INDX_HEADER.size + entries_offset, min( INDX_HEADER.size + index_length, len( block ) )
+
+
+####################################################################################
+#  fixup_block: Checks the INDX magic of block and applies its fixups in place.
+#       Returns False when the block is not an index block
+####################################################################################
+def fixup_block( block ):
+    magic, usa_offset, usa_count, lsn, block_vcn = INDX_HEADER.unpack_from( block, 0 )
+    if not magic == "INDX":
+        return False
+    try:
+        apply_fixups( block, 0, usa_count, usa_offset )
+    except OverrunBufferException:
+        return False
+    return True
+
+
+####################################################################################
+#  read_stream: Reads size bytes from byte pos of a non resident attribute. The result 
+#       is short when the runs end first
+#       read_fn:    function( offset, size ) that reads from the volume
+#       runs:       Runlist of the attribute as ( cluster, length ) tuples
+#       bpc:        Bytes per cluster
+####################################################################################
+def read_stream( read_fn, runs, bpc, pos, size ):
+    buf = bytearray()
+    run_start = 0
+    for cluster, length in runs:
+        run_end = run_start + length * bpc
+        if pos < run_end and size > 0:
+            read_sz = min( run_end - pos, size )
+            buf += read_fn( cluster * bpc + pos - run_start, read_sz )
+            pos += read_sz
+            size -= read_sz
+        run_start = run_end
+    return buf
+
+
+####################################################################################
+#  read_index_block: Reads and fixes up the index block at vcn of an $INDEX_ALLOCATION
+#       attribute. Returns None when the block is outside the runs or is not an INDX block
+#       read_fn:    function( offset, size ) that reads from the volume
+#       runs:       Runlist of the attribute as ( cluster, length ) tuples
+#       bpc:        Bytes per cluster
+#       block_size: Index record size from the $INDEX_ROOT
+#   VCNs count clusters, or 512 byte blocks when the index record is smaller than a
+#   cluster.
+####################################################################################
+def read_index_block( read_fn, runs, bpc, block_size, vcn ):
+    if block_size >= bpc:
+        pos = vcn * bpc
+    else:
+        pos = vcn * 512
+    block = read_stream( read_fn, runs, bpc, pos, block_size )
+    if len( block ) < block_size or not fixup_block( block ):
+        return None
+    return block
+
+
+####################################################################################
+#  iter_index_blocks: Yields each index block of an $INDEX_ALLOCATION attribute that is
+#       in use, fixed up, as a memoryview
+#       read_fn:    function( offset, size ) that reads from the volume
+#       runs:       Runlist of the attribute as ( cluster, length ) tuples
+#       bpc:        Bytes per cluster
+#       block_size: Index record size of the volume
+#       data_size:  Data size of the attribute
+#       bitmap:     The $I30 $BITMAP of the directory, or None to read every block
+#   The allocation is read chunk_size bytes at a time, trimmed to the blocks in use.
+#   Chunks without any block in use are not read.
+####################################################################################
+def iter_index_blocks( read_fn, runs, bpc, block_size, data_size, bitmap=None, chunk_size=CHUNK_SIZE ):
+    count = data_size / block_size
+    per_chunk = max( chunk_size / block_size, 1 )
+    in_use = lambda n: bitmap == None or ( n >> 3 < len( bitmap ) and bitmap[n >> 3] & ( 1 << ( n & 7 ) ) )
+    for first in range( 0, count, per_chunk ):
+        blocks = [ n for n in range( first, min( first + per_chunk, count ) ) if in_use( n ) ]
+        if blocks == []:
+            continue
+        start = blocks[0]
+        buf = read_stream( read_fn, runs, bpc, start * block_size, ( blocks[-1] + 1 - start ) * block_size )
+        view = memoryview( buf )
+        for n in blocks:
+            offset = ( n - start ) * block_size
+            if offset + block_size > len( buf ):
+                return
+            block = view[offset:offset + block_size]
+            if fixup_block( block ):
+                yield block
+
+
+####################################################################################
+#  find_entry: Searches the $I30 B-tree for name and returns the mft reference of its
+#       entry, or None when the directory has no such entry. Only the index blocks on
+#       the path from the root to the entry are read.
+#       root:       Value of the $INDEX_ROOT attribute
+#       upcase:     UpCase table of the volume
+#       name:       Filename to look for
+#       read_block: function( vcn ) returning the fixed up index block or None
+####################################################################################
+def find_entry( root, upcase, name, read_block ):
+    key = upcase.key( name.encode( "utf-16le" ) )
+    index_record_size, offset, end = root_node( root )
+    buf = root
+    visited = set()
+    while True:
+        subnode = None
+        for mft_reference, flags, key_offset, next_vcn in iter_entries( buf, offset, end ):
+            if not flags & INDEX_ENTRY_FLAGS.INDEX_ENTRY_END:
+                if key_offset + FILENAME > end:
+                    return None
+                order = cmp( key, upcase.key( entry_name( buf, key_offset )[1] ) )
+                if order == 0:
+                    return mft_reference
+                if order > 0:
+                    continue
+            subnode = next_vcn
+            break
+        if subnode == None or subnode in visited:
+            return None
+        visited.add( subnode )
+        buf = read_block( subnode )
+        if buf == None:
+            return None
+        offset, end = block_node( buf )
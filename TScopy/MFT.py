@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import array
 import os
 import sys
 import struct
@@ -32,48 +31,74 @@ class INDXException(Exception):
         return "INDX Exception: %s" % (self._value)
 
 
+WORD = struct.Struct("<H")
+
+
+def apply_fixups(buf, offset, num_fixups, fixup_value_offset):
+    """
+    Patch the update sequence array of the structure at `offset` back into
+      the last word of each of its sectors, in place.
+    Arguments:
+    - `buf`: A mutable buffer (bytearray or writable memoryview).
+    - `offset`: The absolute offset of the structure in the buffer.
+    - `num_fixups`: The number of entries in the update sequence array,
+        including the update sequence number itself.
+    - `fixup_value_offset`: The relative offset of the update sequence array.
+    Throws:
+    - `OverrunBufferException`
+    """
+    if num_fixups < 2 or offset + (num_fixups - 1) * 512 > len(buf):
+        raise BinaryParser.OverrunBufferException(offset, len(buf))
+    fixup_value = WORD.unpack_from(buf, offset + fixup_value_offset)[0]
+
+    for i in range(0, num_fixups - 1):
+        fixup_offset = offset + 512 * (i + 1) - 2
+        check_value = WORD.unpack_from(buf, fixup_offset)[0]
+
+        if check_value != fixup_value:
+            logging.warning("Bad fixup at %s", hex(fixup_offset))
+            continue
+
+        new_value = WORD.unpack_from(buf, offset + fixup_value_offset + 2 + 2 * i)[0]
+        WORD.pack_into(buf, fixup_offset, new_value)
+
+
 class FixupBlock(Block):
     """
     a fixup block requires modification to the underlying buffer.
-      - we don't want to do it to the underlying buffer
+      - if the buffer is mutable (a bytearray, or a writable memoryview
+        of one) it is private to the parser, so we patch it in place
+        - this is how records read from the disk arrive, and means
+          a record is never copied after it leaves the disk
+      - otherwise we can't modify it
         - if its mmapped, we'd change the source file
         - if its a string, then this would raise an exception
-      - we can keep a shadow file/buffer for writes to the underlying storage
-        - this is most complete
-        - also most complex to implement
-      - we can make a copy of the buffer, and work with that
-    we take the third option for ease of implementation
+        - so we copy the block once into a bytearray, and patch that
 
     some notes:
-      - we change the buffer for this object from whats passed to the constructor
-      - we change the offset for this object from whats passed to the constructor
+      - a mutable buffer passed to the constructor is modified!
+      - for other buffers, we change the buffer and offset for this
+        object from whats passed to the constructor
       - we assume the total object size is no greater than the size of the fixups!
     """
     def __init__(self, buf, offset, parent):
         super(FixupBlock, self).__init__(buf, offset)
 
     def fixup(self, num_fixups, fixup_value_offset):
-        fixup_buffer = array.array("b", self.unpack_binary(0, length=(num_fixups - 1) * 512))
-        self._buf = fixup_buffer
-        self._offset = 0
-
-        fixup_value = self.unpack_word(fixup_value_offset)
-
-        for i in range(0, num_fixups - 1):
-            fixup_offset = 512 * (i + 1) - 2
-            check_value = self.unpack_word(fixup_offset)
-
-            if check_value != fixup_value:
-                logging.warning("Bad fixup at %s", hex(self.offset() + fixup_offset))
-                continue
-
-            new_value = self.unpack_word(fixup_value_offset + 2 + 2 * i)
-            self.pack_word(fixup_offset, new_value)
-
-            check_value = self.unpack_word(fixup_offset)
-#            g_logger.debug("Fixup verified at %s and patched from %s to %s.",
-#                          hex(self.offset() + fixup_offset),
-#                          hex(fixup_value), hex(check_value))
+        if not BinaryParser.is_mutable(self._buf):
+            size = (num_fixups - 1) * 512
+            if size <= 0 or self._offset + size > len(self._buf):
+                raise BinaryParser.OverrunBufferException(self._offset, len(self._buf))
+            if isinstance(self._buf, memoryview):
+                data = self._buf[self._offset:self._offset + size]
+            else:
+                data = buffer(self._buf, self._offset, size)
+            # the already unpacked header fields all lie before the first
+            #  fixup, so they remain valid against the new buffer
+            self._buf = bytearray(data)
+            self._offset = 0
+
+        apply_fixups(self._buf, self._offset, num_fixups, fixup_value_offset)
 
 
 class INDEX_ENTRY_FLAGS:
@@ -86,12 +111,15 @@ class INDEX_ENTRY_FLAGS:
 
 
 class INDEX_ENTRY_HEADER(Block, Nestable):
+    FIELDS = (
+        ("word", "length", 0x8),
+        ("word", "key_length"),
+        ("word", "index_entry_flags"),  # see INDEX_ENTRY_FLAGS
+        ("word", "reserved"),
+    )
+
     def __init__(self, buf, offset, parent):
         super(INDEX_ENTRY_HEADER, self).__init__(buf, offset)
-        self.declare_field("word", "length", 0x8)
-        self.declare_field("word", "key_length")
-        self.declare_field("word", "index_entry_flags")  # see INDEX_ENTRY_FLAGS
-        self.declare_field("word", "reserved")
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -114,20 +142,26 @@ class MFT_INDEX_ENTRY_HEADER(INDEX_ENTRY_HEADER):
     """
     Index used by the MFT for INDX attributes.
     """
+    FIELDS = (
+        ("qword", "mft_reference", 0x0),
+    )
+
     def __init__(self, buf, offset, parent):
         super(MFT_INDEX_ENTRY_HEADER, self).__init__(buf, offset, parent)
-        self.declare_field("qword", "mft_reference", 0x0)
 
 
 class SECURE_INDEX_ENTRY_HEADER(INDEX_ENTRY_HEADER):
     """
     Index used by the $SECURE file indices SII and SDH
     """
+    FIELDS = (
+        ("word", "data_offset", 0x0),
+        ("word", "data_length"),
+        ("dword", "reserved"),
+    )
+
     def __init__(self, buf, offset, parent):
         super(SECURE_INDEX_ENTRY_HEADER, self).__init__(buf, offset, parent)
-        self.declare_field("word", "data_offset", 0x0)
-        self.declare_field("word", "data_length")
-        self.declare_field("dword", "reserved")
 
 
 class INDEX_ENTRY(Block, Nestable):
@@ -135,9 +169,12 @@ class INDEX_ENTRY(Block, Nestable):
     NOTE: example structure. See the more specific classes below.
       Probably do not instantiate.
     """
+    FIELDS = (
+        (INDEX_ENTRY_HEADER, "header", 0x0),
+    )
+
     def __init__(self, buf, offset, parent):
         super(INDEX_ENTRY, self).__init__(buf, offset)
-        self.declare_field(INDEX_ENTRY_HEADER, "header", 0x0)
         self.add_explicit_field(0x10, "string", "data")
 
     def data(self):
@@ -160,10 +197,15 @@ class MFT_INDEX_ENTRY(Block, Nestable):
     """
     Index entry for the MFT directory index $I30, attribute type 0x90.
     """
+    FIELDS = (
+        (MFT_INDEX_ENTRY_HEADER, "header", 0x0),
+    )
+
     def __init__(self, buf, offset, parent):
         super(MFT_INDEX_ENTRY, self).__init__(buf, offset)
-        self.declare_field(MFT_INDEX_ENTRY_HEADER, "header", 0x0)
-        self.declare_field(FilenameAttribute, "filename_information")
+
+    def filename_information(self):
+        return FilenameAttribute(self._buf, self.offset() + 0x10, self)
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -199,10 +241,13 @@ class SII_INDEX_ENTRY(Block, Nestable):
     """
     Index entry for the $SECURE:$SII index.
     """
+    FIELDS = (
+        (SECURE_INDEX_ENTRY_HEADER, "header", 0x0),
+        ("dword", "security_id", 0x10),
+    )
+
     def __init__(self, buf, offset, parent):
         super(SII_INDEX_ENTRY, self).__init__(buf, offset)
-        self.declare_field(SECURE_INDEX_ENTRY_HEADER, "header", 0x0)
-        self.declare_field("dword", "security_id")
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -221,11 +266,14 @@ class SDH_INDEX_ENTRY(Block, Nestable):
     """
     Index entry for the $SECURE:$SDH index.
     """
+    FIELDS = (
+        (SECURE_INDEX_ENTRY_HEADER, "header", 0x0),
+        ("dword", "hash", 0x10),
+        ("dword", "security_id"),
+    )
+
     def __init__(self, buf, offset, parent):
         super(SDH_INDEX_ENTRY, self).__init__(buf, offset)
-        self.declare_field(SECURE_INDEX_ENTRY_HEADER, "header", 0x0)
-        self.declare_field("dword", "hash")
-        self.declare_field("dword", "security_id")
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -249,13 +297,16 @@ class INDEX_HEADER_FLAGS:
 
 
 class INDEX_HEADER(Block, Nestable):
+    FIELDS = (
+        ("dword", "entries_offset", 0x0),
+        ("dword", "index_length"),
+        ("dword", "allocated_size"),
+        ("byte", "index_header_flags"),  # see INDEX_HEADER_FLAGS
+        # then 3 bytes padding/reserved
+    )
+
     def __init__(self, buf, offset, parent):
         super(INDEX_HEADER, self).__init__(buf, offset)
-        self.declare_field("dword", "entries_offset", 0x0)
-        self.declare_field("dword", "index_length")
-        self.declare_field("dword", "allocated_size")
-        self.declare_field("byte", "index_header_flags")  # see INDEX_HEADER_FLAGS
-        # then 3 bytes padding/reserved
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -281,10 +332,13 @@ class INDEX_HEADER(Block, Nestable):
 
 
 class INDEX(Block, Nestable):
+    FIELDS = (
+        (INDEX_HEADER, "header", 0x0),
+    )
+
     def __init__(self, buf, offset, parent, index_entry_class):
         self._INDEX_ENTRY = index_entry_class
         super(INDEX, self).__init__(buf, offset)
-        self.declare_field(INDEX_HEADER, "header", 0x0)
         self.add_explicit_field(self.header().entries_offset(),
                                 INDEX_ENTRY, "entries")
         slack_start = self.header().entries_offset() + self.header().index_length()
@@ -338,15 +392,18 @@ class INDEX(Block, Nestable):
 
 
 class INDEX_ROOT(Block, Nestable):
+    FIELDS = (
+        ("dword", "type", 0x0),
+        ("dword", "collation_rule"),
+        ("dword", "index_record_size_bytes"),
+        ("byte",  "index_record_size_clusters"),
+        ("byte", "unused1"),
+        ("byte", "unused2"),
+        ("byte", "unused3"),
+    )
+
     def __init__(self, buf, offset, parent=None):
         super(INDEX_ROOT, self).__init__(buf, offset)
-        self.declare_field("dword", "type", 0x0)
-        self.declare_field("dword", "collation_rule")
-        self.declare_field("dword", "index_record_size_bytes")
-        self.declare_field("byte",  "index_record_size_clusters")
-        self.declare_field("byte", "unused1")
-        self.declare_field("byte", "unused2")
-        self.declare_field("byte", "unused3")
         self._index_offset = self.current_field_offset()
         self.add_explicit_field(self._index_offset, INDEX, "index")
 
@@ -363,15 +420,18 @@ class INDEX_ROOT(Block, Nestable):
 
 
 class NTATTR_STANDARD_INDEX_HEADER(Block):
+    FIELDS = (
+        ("dword", "entry_list_start", 0x0),
+        ("dword", "entry_list_end"),
+        ("dword", "entry_list_allocation_end"),
+        ("dword", "flags"),
+        ("binary", "list_buffer",
+         lambda self: self.entry_list_start(),
+         lambda self: self.entry_list_allocation_end() - self.entry_list_start()),
+    )
+
     def __init__(self, buf, offset, parent):
         super(NTATTR_STANDARD_INDEX_HEADER, self).__init__(buf, offset)
-        self.declare_field("dword", "entry_list_start", 0x0)
-        self.declare_field("dword", "entry_list_end")
-        self.declare_field("dword", "entry_list_allocation_end")
-        self.declare_field("dword", "flags")
-        self.declare_field("binary", "list_buffer", \
-                           self.entry_list_start(),
-                           self.entry_list_allocation_end() - self.entry_list_start())
 
     def entries(self):
         """
@@ -412,15 +472,18 @@ class NTATTR_STANDARD_INDEX_HEADER(Block):
 
 
 class IndexRootHeader(Block):
+    FIELDS = (
+        ("dword", "type", 0x0),
+        ("dword", "collation_rule"),
+        ("dword", "index_record_size_bytes"),
+        ("byte",  "index_record_size_clusters"),
+        ("byte", "unused1"),
+        ("byte", "unused2"),
+        ("byte", "unused3"),
+    )
+
     def __init__(self, buf, offset, parent):
         super(IndexRootHeader, self).__init__(buf, offset)
-        self.declare_field("dword", "type", 0x0)
-        self.declare_field("dword", "collation_rule")
-        self.declare_field("dword", "index_record_size_bytes")
-        self.declare_field("byte",  "index_record_size_clusters")
-        self.declare_field("byte", "unused1")
-        self.declare_field("byte", "unused2")
-        self.declare_field("byte", "unused3")
         self._node_header_offset = self.current_field_offset()
 
     def node_header(self):
@@ -430,13 +493,16 @@ class IndexRootHeader(Block):
 
 
 class IndexRecordHeader(FixupBlock):
+    FIELDS = (
+        ("dword", "magic", 0x0),
+        ("word",  "usa_offset"),
+        ("word",  "usa_count"),
+        ("qword", "lsn"),
+        ("qword", "vcn"),
+    )
+
     def __init__(self, buf, offset, parent):
         super(IndexRecordHeader, self).__init__(buf, offset, parent)
-        self.declare_field("dword", "magic", 0x0)
-        self.declare_field("word",  "usa_offset")
-        self.declare_field("word",  "usa_count")
-        self.declare_field("qword", "lsn")
-        self.declare_field("qword", "vcn")
         self._node_header_offset = self.current_field_offset()
         self.fixup(self.usa_count(), self.usa_offset())
 
@@ -447,13 +513,16 @@ class IndexRecordHeader(FixupBlock):
 
 
 class INDEX_BLOCK(FixupBlock):
+    FIELDS = (
+        ("dword", "magic", 0x0),
+        ("word",  "usa_offset"),
+        ("word",  "usa_count"),
+        ("qword", "lsn"),
+        ("qword", "vcn"),
+    )
+
     def __init__(self, buf, offset, parent=None):
         super(INDEX_BLOCK, self).__init__(buf, offset, parent)
-        self.declare_field("dword", "magic", 0x0)
-        self.declare_field("word",  "usa_offset")
-        self.declare_field("word",  "usa_count")
-        self.declare_field("qword", "lsn")
-        self.declare_field("qword", "vcn")
         self._index_offset = self.current_field_offset()
         self.add_explicit_field(self._index_offset, INDEX, "index")
         self.fixup(self.usa_count(), self.usa_offset())
@@ -504,17 +573,19 @@ class INDEX_ALLOCATION(FixupBlock):
 
 
 class IndexEntry(Block):
+    FIELDS = (
+        ("qword", "mft_reference", 0x0),
+        ("word", "length"),
+        ("word", "filename_information_length"),
+        ("dword", "flags"),
+        ("binary", "filename_information_buffer", 0x10,
+         lambda self: self.filename_information_length()),
+        ("qword", "child_vcn",
+         lambda self: BinaryParser.align(0x10 + self.filename_information_length(), 0x8)),
+    )
+
     def __init__(self, buf, offset, parent):
         super(IndexEntry, self).__init__(buf, offset)
-        self.declare_field("qword", "mft_reference", 0x0)
-        self.declare_field("word", "length")
-        self.declare_field("word", "filename_information_length")
-        self.declare_field("dword", "flags")
-        self.declare_field("binary", "filename_information_buffer", \
-                           self.current_field_offset(),
-                           self.filename_information_length())
-        self.declare_field("qword", "child_vcn",
-                           BinaryParser.align(self.current_field_offset(), 0x8))
 
     def filename_information(self):
         return FilenameAttribute(self._buf,
@@ -532,18 +603,21 @@ class StandardInformationFieldDoesNotExist(Exception):
 
 class StandardInformation(Block):
     # TODO(wb): implement sizing so we can make this nestable
+    FIELDS = (
+        ("filetime", "created_time", 0x0),
+        ("filetime", "modified_time"),
+        ("filetime", "changed_time"),
+        ("filetime", "accessed_time"),
+        ("dword", "attributes"),
+        ("binary", "reserved", 0x24, 0xC),
+        # ("dword", "owner_id", 0x30),  # Win2k+, NTFS 3.x
+        # ("dword", "security_id"),  # Win2k+, NTFS 3.x
+        # ("qword", "quota_charged"),  # Win2k+, NTFS 3.x
+        # ("qword", "usn"),  # Win2k+, NTFS 3.x
+    )
+
     def __init__(self, buf, offset, parent):
         super(StandardInformation, self).__init__(buf, offset)
-        self.declare_field("filetime", "created_time", 0x0)
-        self.declare_field("filetime", "modified_time")
-        self.declare_field("filetime", "changed_time")
-        self.declare_field("filetime", "accessed_time")
-        self.declare_field("dword", "attributes")
-        self.declare_field("binary", "reserved", self.current_field_offset(), 0xC)
-        # self.declare_field("dword", "owner_id", 0x30)  # Win2k+, NTFS 3.x
-        # self.declare_field("dword", "security_id")  # Win2k+, NTFS 3.x
-        # self.declare_field("qword", "quota_charged")  # Win2k+, NTFS 3.x
-        # self.declare_field("qword", "usn")  # Win2k+, NTFS 3.x
 
     # Can't implement this unless we know the NTFS version in use
     #@staticmethod
@@ -603,7 +677,9 @@ class Attribute_List(Block, Nestable):
         self.__list = []
         csize = 0
         while csize < size:
-            lEntry =  Attribute_List_Entry( buf[csize:], 0, logger ) 
+            lEntry =  Attribute_List_Entry( buf, offset + csize, logger ) 
+            if lEntry.record_length() == 0:
+                break
             self.__list.append( lEntry )
             csize += lEntry.record_length()
 
@@ -611,35 +687,41 @@ class Attribute_List(Block, Nestable):
         return self.__list
 
 class Attribute_List_Entry(Block, Nestable):
+    FIELDS = (
+        ("dword", "type", 0x0),
+        ("word", "record_length", 0x4),
+        ("byte", "nameLength", 0x6),
+        ("byte", "offsetToName", 0x7),
+        ("qword", "startVCN", 0x8),
+        ("qword", "baseFileReference", 0x10),
+        ("word", "attributeID", 0x18),
+        ("wstring", "name", 0x1a, lambda self: 2*self.nameLength()),
+    )
+
     def __init__(self, buf, offset, logger):
         super(Attribute_List_Entry, self).__init__(buf, offset)
-        self.declare_field("dword", "type", 0x0)
-        self.declare_field("word", "record_length", 0x4)
-        self.declare_field("byte", "nameLength", 0x6)
-        self.declare_field("byte", "offsetToName", 0x7)
-        self.declare_field("qword", "startVCN", 0x8)
-        self.declare_field("qword", "baseFileReference", 0x10)
-        self.declare_field("word", "attributeID", 0x18)
-        self.declare_field("wstring", "name", 0x1a, 2*self.nameLength())
 
     def __len__(self):
         return self.size()
 
 class FilenameAttribute(Block, Nestable):
+    FIELDS = (
+        ("qword", "mft_parent_reference", 0x0),
+        ("filetime", "created_time"),
+        ("filetime", "modified_time"),
+        ("filetime", "changed_time"),
+        ("filetime", "accessed_time"),
+        ("qword", "physical_size"),
+        ("qword", "logical_size"),
+        ("dword", "flags"),
+        ("dword", "reparse_value"),
+        ("byte", "filename_length"),
+        ("byte", "filename_type"),
+        ("wstring", "filename", 0x42, lambda self: self.filename_length()),
+    )
+
     def __init__(self, buf, offset, parent):
         super(FilenameAttribute, self).__init__(buf, offset)
-        self.declare_field("qword", "mft_parent_reference", 0x0)
-        self.declare_field("filetime", "created_time")
-        self.declare_field("filetime", "modified_time")
-        self.declare_field("filetime", "changed_time")
-        self.declare_field("filetime", "accessed_time")
-        self.declare_field("qword", "physical_size")
-        self.declare_field("qword", "logical_size")
-        self.declare_field("dword", "flags")
-        self.declare_field("dword", "reparse_value")
-        self.declare_field("byte", "filename_length")
-        self.declare_field("byte", "filename_type")
-        self.declare_field("wstring", "filename", 0x42, self.filename_length())
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -685,17 +767,19 @@ class SlackIndexEntry(IndexEntry):
 
 
 class Runentry(Block, Nestable):
+    FIELDS = (
+        ("byte", "header", 0x0),
+        ("binary", "length_binary", 0x1,
+         lambda self: self._length_length),
+        ("binary", "offset_binary",
+         lambda self: 0x1 + self._length_length,
+         lambda self: self._offset_length),
+    )
+
     def __init__(self, buf, offset, parent):
         super(Runentry, self).__init__(buf, offset)
-        self.declare_field("byte", "header")
         self._offset_length = self.header() >> 4
         self._length_length = self.header() & 0x0F
-        self.declare_field("binary",
-                           "length_binary",
-                           self.current_field_offset(), self._length_length)
-        self.declare_field("binary",
-                           "offset_binary",
-                           self.current_field_offset(), self._offset_length)
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -785,6 +869,23 @@ class Runlist(Block):
             last_offset = current_offset
             yield (current_offset, current_length)
 
+    def extents(self):
+        """
+        Yields tuples (volume offset, length) like runs(), including sparse
+          runs, which have no volume offset and are yielded as (None, length).
+        """
+        last_offset = 0
+        offset = self.offset()
+        entry = Runentry(self._buf, offset, self)
+        while entry.header() != 0 and entry._length_length > 0:
+            if entry._offset_length == 0:
+                yield (None, entry.length())
+            else:
+                last_offset += entry.offset()
+                yield (last_offset, entry.length())
+            offset += len(entry)
+            entry = Runentry(self._buf, offset, self)
+
 
 class ATTR_TYPE:
     STANDARD_INFORMATION = 0x10
@@ -793,6 +894,7 @@ class ATTR_TYPE:
     DATA = 0x80
     INDEX_ROOT = 0x90
     INDEX_ALLOCATION = 0xA0
+    BITMAP = 0xB0
     UTILITY_STREAM = 0x100
 
 
@@ -835,36 +937,47 @@ class Attribute(Block, Nestable):
         0x20000000: "has-view-index",
         }
 
+    FIELDS = (
+        ("dword", "type", 0x0),
+        ("dword", "size"),  # this value must rounded up to 0x8 byte alignment
+        ("byte", "non_resident"),
+        ("byte", "name_length"),
+        ("word", "name_offset"),
+        ("word", "flags"),
+        ("word", "instance"),
+    )
+
+    NONRESIDENT_FIELDS = (
+        ("qword", "lowest_vcn", 0x10),
+        ("qword", "highest_vcn"),
+        ("word", "runlist_offset"),
+        ("byte", "compression_unit"),
+        ("byte", "reserved1"),
+        ("byte", "reserved2"),
+        ("byte", "reserved3"),
+        ("byte", "reserved4"),
+        ("byte", "reserved5"),
+        ("qword", "allocated_size"),
+        ("qword", "data_size"),
+        ("qword", "initialized_size"),
+        ("qword", "compressed_size"),
+    )
+
+    RESIDENT_FIELDS = (
+        ("dword", "value_length", 0x10),
+        ("word", "value_offset"),
+        ("byte", "value_flags"),
+        ("byte", "reserved"),
+        ("view", "value",
+         lambda self: self.value_offset(), lambda self: self.value_length()),
+    )
+
     def __init__(self, buf, offset, parent):
         super(Attribute, self).__init__(buf, offset)
-        self.declare_field("dword", "type")
-        self.declare_field("dword", "size")  # this value must rounded up to 0x8 byte alignment
-        self.declare_field("byte", "non_resident")
-        self.declare_field("byte", "name_length")
-        self.declare_field("word", "name_offset")
-        self.declare_field("word", "flags")
-        self.declare_field("word", "instance")
-        if self.non_resident() > 0:
-            self.declare_field("qword", "lowest_vcn", 0x10)
-            self.declare_field("qword", "highest_vcn")
-            self.declare_field("word", "runlist_offset")
-            self.declare_field("byte", "compression_unit")
-            self.declare_field("byte", "reserved1")
-            self.declare_field("byte", "reserved2")
-            self.declare_field("byte", "reserved3")
-            self.declare_field("byte", "reserved4")
-            self.declare_field("byte", "reserved5")
-            self.declare_field("qword", "allocated_size")
-            self.declare_field("qword", "data_size")
-            self.declare_field("qword", "initialized_size")
-            self.declare_field("qword", "compressed_size")
+        if BinaryParser.read_byte(buf, offset + 0x8) > 0:
+            self._layout = Attribute._nonresident_layout
         else:
-            self.declare_field("dword", "value_length", 0x10)
-            self.declare_field("word", "value_offset")
-            self.declare_field("byte", "value_flags")
-            self.declare_field("byte", "reserved")
-            self.declare_field("binary", "value",
-                               self.value_offset(), self.value_length())
+            self._layout = Attribute._resident_layout
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -880,14 +993,14 @@ class Attribute(Block, Nestable):
     def runlist(self):
         return Runlist(self._buf, self.offset() + self.runlist_offset(), self)
 
-    def size(self):
-        s = self.unpack_dword(self._off_size)
-        return s + (8 - (s % 8))
-
     def name(self):
         return self.unpack_wstring(self.name_offset(), self.name_length())
 
 
+Attribute._nonresident_layout = Attribute.compile_layout(Attribute.FIELDS + Attribute.NONRESIDENT_FIELDS)
+Attribute._resident_layout = Attribute.compile_layout(Attribute.FIELDS + Attribute.RESIDENT_FIELDS)
+
+
 class MFT_RECORD_FLAGS:
     MFT_RECORD_IN_USE = 0x1
     MFT_RECORD_IS_DIRECTORY = 0x2
@@ -912,44 +1025,46 @@ class AttributeNotFoundError(Exception):
 
 
 class MFTRecord(FixupBlock):
-    def __init__(self, buf, offset, parent, inode=None):
-        super(MFTRecord, self).__init__(buf, offset, parent)
-
+    FIELDS = (
         # 0x0 File or BAAD
-        self.declare_field("dword", "magic")
+        ("dword", "magic", 0x0),
         # 0x04 Offset to fixup array
-        self.declare_field("word",  "usa_offset")
+        ("word",  "usa_offset"),
         # 0x06 Number of entries in fixup array
-        self.declare_field("word",  "usa_count")
+        ("word",  "usa_count"),
         # 0x08 $LogFile sequence number
-        self.declare_field("qword", "lsn")
+        ("qword", "lsn"),
         # 0x10 Sequence value
-        self.declare_field("word",  "sequence_number")
+        ("word",  "sequence_number"),
         # 0x12 Link Count
-        self.declare_field("word",  "link_count")
+        ("word",  "link_count"),
         # 0x14 Offset of first attribute
-        self.declare_field("word",  "attrs_offset")
+        ("word",  "attrs_offset"),
         # 0x16 Flags:
         #   0x00 - not in use
         #   0x01 - in use
         #   0x02 - directory
         #   0x03 - directory in use
-        self.declare_field("word",  "flags")
+        ("word",  "flags"),
 
         # 0x18 Used size of MFT entry
-        self.declare_field("dword", "bytes_in_use")
+        ("dword", "bytes_in_use"),
         # 0x1c Allocated size of MFT entry
-        self.declare_field("dword", "bytes_allocated")
+        ("dword", "bytes_allocated"),
         # 0x20 File reference to base record
-        self.declare_field("qword", "base_mft_record")
+        ("qword", "base_mft_record"),
         # 0x28 Nex attribute identifier
-        self.declare_field("word",  "next_attr_instance")
+        ("word",  "next_attr_instance"),
 
         # Attributes and fixup values
         # 0x2a
-        self.declare_field("word",  "reserved")
+        ("word",  "reserved"),
         # 0x2c
-        self.declare_field("dword", "mft_record_number")
+        ("dword", "mft_record_number"),
+    )
+
+    def __init__(self, buf, offset, parent, inode=None):
+        super(MFTRecord, self).__init__(buf, offset, parent)
 
         self.inode = inode or self.mft_record_number()
 #        print self.sequence_number()
@@ -958,12 +1073,12 @@ class MFTRecord(FixupBlock):
 
     def attributes(self):
         offset = self.attrs_offset()
-        right_border = self.offset() + self.bytes_in_use()
+        right_border = self.bytes_in_use()
 
         while (self.unpack_dword(offset) != 0 and
                self.unpack_dword(offset) != 0xFFFFFFFF and
                offset + self.unpack_dword(offset + 4) <= right_border):
-            a = Attribute(self._buf, offset, self)
+            a = Attribute(self._buf, self.offset() + offset, self)
             offset += len(a)
             yield a
 
@@ -1038,13 +1153,191 @@ class MFTRecord(FixupBlock):
         """
         Returns A binary string containing the MFT record slack.
         """
-        return self._buf[self.offset()+self.bytes_in_use():self.offset() + 1024].tostring()
+        return BinaryParser.to_string(self._buf[self.offset()+self.bytes_in_use():self.offset() + 1024])
 
     def active_data(self):
         """
         Returns A binary string containing the MFT record slack.
         """
-        return self._buf[self.offset():self.offset() + self.bytes_in_use()].tostring()
+        return BinaryParser.to_string(self._buf[self.offset():self.offset() + self.bytes_in_use()])
+
+
+class AttributeView(object):
+    """
+    A compact, read-only view of an attribute within an MFTRecordView.
+    Holds only the record buffer and the offset of the attribute, and
+      decodes each field from the buffer when it is accessed.
+    """
+    __slots__ = ("_buf", "_offset")
+
+    HEADER = struct.Struct("<IIBBHHH")
+    RESIDENT = struct.Struct("<IH")
+    NONRESIDENT = struct.Struct("<QQQ")
+    VCN = struct.Struct("<QQ")
+    RUNLIST_OFFSET = struct.Struct("<H")
+
+    def __init__(self, buf, offset):
+        self._buf = buf
+        self._offset = offset
+
+    def _unpack(self, fmt, offset):
+        o = self._offset + offset
+        try:
+            return fmt.unpack_from(self._buf, o)
+        except struct.error:
+            raise BinaryParser.OverrunBufferException(o, len(self._buf))
+
+    def type(self):
+        return self._unpack(AttributeView.HEADER, 0x0)[0]
+
+    def size(self):
+        return self._unpack(AttributeView.HEADER, 0x0)[1]
+
+    def non_resident(self):
+        return self._unpack(AttributeView.HEADER, 0x0)[2]
+
+    def name_length(self):
+        return self._unpack(AttributeView.HEADER, 0x0)[3]
+
+    def name_offset(self):
+        return self._unpack(AttributeView.HEADER, 0x0)[4]
+
+    def flags(self):
+        return self._unpack(AttributeView.HEADER, 0x0)[5]
+
+    def name(self):
+        _, _, _, length, offset, _, _ = self._unpack(AttributeView.HEADER, 0x0)
+        start = self._offset + offset
+        return BinaryParser.to_string(self._buf[start:start + 2 * length]).decode("utf16")
+
+    def value_length(self):
+        return self._unpack(AttributeView.RESIDENT, 0x10)[0]
+
+    def value_offset(self):
+        return self._unpack(AttributeView.RESIDENT, 0x10)[1]
+
+    def value(self):
+        length, offset = self._unpack(AttributeView.RESIDENT, 0x10)
+        start = self._offset + offset
+        return memoryview(self._buf)[start:start + length]
+
+    def lowest_vcn(self):
+        return self._unpack(AttributeView.VCN, 0x10)[0]
+
+    def highest_vcn(self):
+        return self._unpack(AttributeView.VCN, 0x10)[1]
+
+    def runlist_offset(self):
+        return self._unpack(AttributeView.RUNLIST_OFFSET, 0x20)[0]
+
+    def runlist(self):
+        return Runlist(self._buf, self._offset + self.runlist_offset(), self)
+
+    def allocated_size(self):
+        return self._unpack(AttributeView.NONRESIDENT, 0x28)[0]
+
+    def data_size(self):
+        return self._unpack(AttributeView.NONRESIDENT, 0x28)[1]
+
+    def initialized_size(self):
+        return self._unpack(AttributeView.NONRESIDENT, 0x28)[2]
+
+    def __len__(self):
+        return self.size()
+
+    def __str__(self):
+        return "%s" % (Attribute.TYPES[self.type()])
+
+
+class MFTRecordView(object):
+    """
+    A compact, read-only view of an MFT record, for callers that only
+      need the flags, the attribute types, resident values and runlists.
+    Unlike MFTRecord it carries no per-field state: the only instance data
+      is the fixed up record buffer, and fields are decoded on access.
+    As with FixupBlock, a mutable buffer is fixed up in place.
+    """
+    __slots__ = ("_buf",)
+
+    USA = struct.Struct("<HH")
+    HEADER = struct.Struct("<IHHQHHHHIIQHHI")
+    DWORD = struct.Struct("<I")
+
+    def __init__(self, buf, offset=0):
+        usa_offset, usa_count = MFTRecordView.USA.unpack_from(buf, offset + 0x4)
+        size = (usa_count - 1) * 512
+        if not BinaryParser.is_mutable(buf):
+            buf = bytearray(memoryview(buf)[offset:offset + size])
+        elif offset != 0 or len(buf) != size:
+            buf = memoryview(buf)[offset:offset + size]
+        self._buf = buf
+        apply_fixups(buf, 0, usa_count, usa_offset)
+
+    def _header(self):
+        try:
+            return MFTRecordView.HEADER.unpack_from(self._buf, 0)
+        except struct.error:
+            raise BinaryParser.OverrunBufferException(0, len(self._buf))
+
+    def magic(self):
+        return self._header()[0]
+
+    def lsn(self):
+        return self._header()[3]
+
+    def sequence_number(self):
+        return self._header()[4]
+
+    def attrs_offset(self):
+        return self._header()[6]
+
+    def flags(self):
+        return self._header()[7]
+
+    def bytes_in_use(self):
+        return self._header()[8]
+
+    def base_mft_record(self):
+        return self._header()[10]
+
+    def mft_record_number(self):
+        return self._header()[13]
+
+    def is_directory(self):
+        return (self.flags() & MFT_RECORD_FLAGS.MFT_RECORD_IS_DIRECTORY) == 2
+
+    def is_active(self):
+        return self.flags() & MFT_RECORD_FLAGS.MFT_RECORD_IN_USE
+
+    def attributes(self):
+        buf = self._buf
+        header = self._header()
+        offset = header[6]
+        right_border = header[8]
+        dword = MFTRecordView.DWORD
+
+        while offset + 8 <= len(buf):
+            attr_type = dword.unpack_from(buf, offset)[0]
+            attr_size = dword.unpack_from(buf, offset + 4)[0]
+            if attr_type == 0 or attr_type == 0xFFFFFFFF or attr_size == 0 or \
+               offset + attr_size > right_border:
+                break
+            yield AttributeView(buf, offset)
+            offset += attr_size
+
+    def attribute(self, attr_type):
+        for a in self.attributes():
+            if a.type() == attr_type:
+                return a
+        raise AttributeNotFoundError()
+
+    def data_attribute(self):
+        """
+        Returns None if the default $DATA attribute does not exist
+        """
+        for attr in self.attributes():
+            if attr.type() == ATTR_TYPE.DATA and attr.name_length() == 0:
+                return attr
 
 
 class InvalidAttributeException(INDXException):
@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+
+import re
+import array
+import struct
+import logging
+import multiprocessing
+from bisect import bisect_left, bisect_right
+
+from BinaryParser import to_string
+from MFT import MFTRecordView, MFT_RECORD_FLAGS, ATTR_TYPE, MREF, MSEQNO
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bytes of the $MFT read at a time by scan_mft
+CHUNK_SIZE = 4 * 1024 * 1024
+# Free records between two allocated ranges that are read through rather than skipped
+BITMAP_GAP = 64
+
+RECORD_MAGIC = "FILE"
+RECORD_FLAGS = struct.Struct("<H")
+# usa_offset, usa_count of a record header
+RECORD_USA = struct.Struct("<HH")
+# type, size, non_resident of an attribute header and value_length, value_offset
+ATTRIBUTE_HEADER = struct.Struct("<IIB")
+RESIDENT_HEADER = struct.Struct("<IH")
+# mft_parent_reference, filename_length and filename_type of a $FILE_NAME value
+FILENAME = struct.Struct("<Q56xBB")
+
+# $FILE_NAME namespaces, the lower the rank the more complete the name
+#   0 POSIX, 1 Win32, 2 DOS (8.3), 3 Win32 and DOS
+FILENAME_RANK = { 0x0: 1, 0x1: 0, 0x2: 2, 0x3: 0 }
+
+
+####################################################################################
+#  read_mft: Reads size bytes of the $MFT starting at byte offset start, following the
+#       dataruns. Returns a bytearray, which is shorter than size at the end of the $MFT
+#       or if a read fails.
+#   read_fn:     function( offset, size ) that reads from the volume
+#   run_starts:  Byte offset into the $MFT at which each datarun starts
+#   run_offsets: Byte offset on the volume of each datarun
+#   mft_size:    Total size of the $MFT in bytes
+####################################################################################
+def read_mft( read_fn, run_starts, run_offsets, mft_size, start, size ):
+    buf = bytearray()
+    pos = start
+    end = min( start + size, mft_size )
+    while pos < end:
+        r = bisect_right( run_starts, pos ) - 1
+        run_end = run_starts[r+1] if r + 1 < len( run_starts ) else mft_size
+        read_sz = min( run_end, end ) - pos
+        data = read_fn( run_offsets[r] + pos - run_starts[r], read_sz )
+        buf += data
+        if len( data ) < read_sz:
+            break
+        pos += read_sz
+    return buf
+
+
+####################################################################################
+#  parse_records: Parses the in use records of a buffer holding consecutive MFT records.
+#       Slots that are not in use, are not FILE records or whose update sequence array
+#       does not fit the first sector are skipped before any fixups are applied. Fixups
+#       are applied to buf in place.
+#   Yields ( record number, sequence number, [( parent reference, name ), ...] ) with the
+#   most complete name of the record for each parent directory. Names found in an
+#   extension record are reported against its base record, with a sequence number of None.
+####################################################################################
+def parse_records( buf, first_record, record_size ):
+    for i in xrange( len( buf ) / record_size ):
+        offset = i * record_size
+        if not buf[offset:offset+4] == RECORD_MAGIC:
+            continue
+        flags = RECORD_FLAGS.unpack_from( buf, offset + 0x16 )[0]
+        if not flags & MFT_RECORD_FLAGS.MFT_RECORD_IN_USE:
+            continue
+        usa_offset, usa_count = RECORD_USA.unpack_from( buf, offset + 0x4 )
+        if not usa_count == record_size / 512 + 1 or usa_offset % 2 or usa_offset + 2 * usa_count > 0x1fe:
+            continue
+        try:
+            record = MFTRecordView( buf, offset )
+            names = {}
+            for attribute in record.attributes():
+                if not attribute.type() == ATTR_TYPE.FILENAME_INFORMATION:
+                    continue
+                add_filename( names, attribute.value(), 0 )
+        except Exception:
+            continue
+        names = [ ( p, names[p][1] ) for p in names ]
+        if not record.base_mft_record() == 0:
+            yield MREF( record.base_mft_record() ), None, names
+        else:
+            yield first_record + i, record.sequence_number(), names
+
+
+####################################################################################
+#  add_filename: Adds the name of the $FILE_NAME value at offset in buf to names,
+#       { parent reference: ( rank, name ) }, unless a more complete name is known
+####################################################################################
+def add_filename( names, buf, offset ):
+    parent, length, namespace = FILENAME.unpack_from( buf, offset )
+    rank = FILENAME_RANK.get( namespace, 3 )
+    if parent in names and names[parent][0] <= rank:
+        return
+    start = offset + 0x42
+    names[parent] = ( rank, to_string( buf[start:start + 2*length] ).decode("utf16") )
+
+
+####################################################################################
+#  decode_records: Decodes a bytearray of consecutive MFT records with numpy, all the
+#       records at once. Fixups are applied to buf in place for every in use FILE record.
+#   Returns a dict of arrays with one entry per in use record:
+#       row:             Index of the record in buf
+#       sequence_number, flags, base_mft_record, attrs_offset, bytes_in_use
+#       filename_offset: Offset in the record of the first $FILE_NAME attribute or 0
+#       data_offset:     Offset in the record of the first $DATA attribute or 0
+####################################################################################
+def decode_records( buf, record_size ):
+    count = len( buf ) / record_size
+    header = numpy.frombuffer( buf, dtype=numpy.dtype( {
+        'names':   [ 'magic', 'usa_offset', 'usa_count', 'sequence_number', 'attrs_offset',
+                     'flags', 'bytes_in_use', 'base_mft_record' ],
+        'formats': [ '<u4', '<u2', '<u2', '<u2', '<u2', '<u2', '<u4', '<u8' ],
+        'offsets': [ 0x0, 0x4, 0x6, 0x10, 0x14, 0x16, 0x18, 0x20 ],
+        'itemsize': record_size } ), count=count )
+    words = numpy.frombuffer( buf, dtype='<u2', count=count * record_size / 2 ).reshape( count, record_size / 2 )
+    dwords = numpy.frombuffer( buf, dtype='<u4', count=count * record_size / 4 ).reshape( count, record_size / 4 )
+
+    sectors = record_size / 512
+    usa_offset = header['usa_offset'].astype( numpy.int64 )
+    valid = ( header['magic'] == 0x454c4946 ) & \
+            ( header['flags'] & MFT_RECORD_FLAGS.MFT_RECORD_IN_USE > 0 ) & \
+            ( header['usa_count'] == sectors + 1 ) & \
+            ( usa_offset % 2 == 0 ) & ( usa_offset + 2 * ( sectors + 1 ) <= 0x1fe )
+    rows = numpy.nonzero( valid )[0]
+
+    # Fixups, one sector of every record at a time
+    usa = usa_offset[rows] / 2
+    usn = words[rows, usa]
+    for sector in range( 1, sectors + 1 ):
+        tail = sector * 256 - 1
+        ok = words[rows, tail] == usn
+        for row in rows[~ok]:
+            logging.warning("Bad fixup at %s", hex( int( row ) * record_size + tail * 2 ))
+        words[rows[ok], tail] = words[rows[ok], usa[ok] + sector]
+
+    # Walk the attribute lists of every record in step
+    bytes_in_use = numpy.minimum( header['bytes_in_use'][rows], record_size ).astype( numpy.int64 )
+    pos = header['attrs_offset'][rows].astype( numpy.int64 )
+    filename_offset = numpy.zeros( len( rows ), dtype=numpy.int64 )
+    data_offset = numpy.zeros( len( rows ), dtype=numpy.int64 )
+    active = ( pos % 8 == 0 ) & ( pos + 8 <= bytes_in_use )
+    while active.any():
+        idx = numpy.nonzero( active )[0]
+        p = pos[idx]
+        attr_type = dwords[rows[idx], p / 4]
+        attr_size = dwords[rows[idx], p / 4 + 1].astype( numpy.int64 )
+        go = ( attr_type != 0 ) & ( attr_type != 0xFFFFFFFF ) & ( attr_size > 0 ) & \
+             ( attr_size % 8 == 0 ) & ( p + attr_size <= bytes_in_use[idx] )
+        hit = go & ( attr_type == ATTR_TYPE.FILENAME_INFORMATION ) & ( filename_offset[idx] == 0 )
+        filename_offset[idx[hit]] = p[hit]
+        hit = go & ( attr_type == ATTR_TYPE.DATA ) & ( data_offset[idx] == 0 )
+        data_offset[idx[hit]] = p[hit]
+        pos[idx] = p + attr_size
+        active[idx] = go & ( pos[idx] + 8 <= bytes_in_use[idx] )
+
+    return { 'row': rows,
+             'sequence_number': header['sequence_number'][rows],
+             'flags': header['flags'][rows],
+             'base_mft_record': header['base_mft_record'][rows],
+             'attrs_offset': header['attrs_offset'][rows],
+             'bytes_in_use': bytes_in_use,
+             'filename_offset': filename_offset,
+             'data_offset': data_offset }
+
+
+####################################################################################
+#  parse_records_batch: parse_records on top of decode_records. Only the names are
+#       decoded per record, starting from the first $FILE_NAME attribute. buf must be
+#       a bytearray.
+####################################################################################
+def parse_records_batch( buf, first_record, record_size ):
+    decoded = decode_records( buf, record_size )
+    for row, seq_num, base, end, pos in zip( decoded['row'].tolist(),
+                                             decoded['sequence_number'].tolist(),
+                                             decoded['base_mft_record'].tolist(),
+                                             decoded['bytes_in_use'].tolist(),
+                                             decoded['filename_offset'].tolist() ):
+        offset = row * record_size
+        names = {}
+        try:
+            # $FILE_NAME attributes are stored one after another
+            while pos and pos + 0x18 <= end:
+                attr_type, attr_size, non_resident = ATTRIBUTE_HEADER.unpack_from( buf, offset + pos )
+                if not attr_type == ATTR_TYPE.FILENAME_INFORMATION or attr_size == 0 or pos + attr_size > end:
+                    break
+                if non_resident == 0:
+                    value_offset = RESIDENT_HEADER.unpack_from( buf, offset + pos + 0x10 )[1]
+                    add_filename( names, buf, offset + pos + value_offset )
+                pos += attr_size
+        except Exception:
+            continue
+        names = [ ( p, names[p][1] ) for p in names ]
+        if not base == 0:
+            yield MREF( base ), None, names
+        else:
+            yield first_record + row, seq_num, names
+
+
+####################################################################################
+#  MFTBitmap: The $BITMAP attribute of the $MFT, one bit per record which is set when
+#       the record is in use.
+#   bitmap:       The attribute data as a string
+#   record_count: Number of records in the $MFT, later bits are ignored
+####################################################################################
+class MFTBitmap( object ):
+    def __init__( self, bitmap, record_count ):
+        self.__bitmap = bitmap[:( record_count + 7 ) / 8]
+        self.record_count = record_count
+
+    def is_allocated( self, record ):
+        if record >= self.record_count:
+            return False
+        return ( ord( self.__bitmap[record / 8] ) >> ( record % 8 ) ) & 1 == 1
+
+    ####################################################################################
+    # ranges: Yields ( first, last ) ranges of records to read so that every allocated
+    #       record is covered. Ranges less than gap records apart are joined, and ranges
+    #       are split to at most max_records. Free records inside a partly used byte of
+    #       the bitmap may be included, readers still need to check the record flags.
+    ####################################################################################
+    def ranges( self, max_records=None, gap=BITMAP_GAP ):
+        current = None
+        for m in re.finditer( '[^\x00]+', self.__bitmap ):
+            first_byte = ord( m.group()[0] )
+            last_byte = ord( m.group()[-1] )
+            first = m.start() * 8
+            while not ( first_byte >> ( first % 8 ) ) & 1:
+                first += 1
+            last = m.end() * 8
+            while not ( last_byte >> ( ( last - 1 ) % 8 ) ) & 1:
+                last -= 1
+            last = min( last, self.record_count )
+            if first >= last:
+                continue
+            if not current == None and first - current[1] < gap:
+                current = ( current[0], last )
+                continue
+            if not current == None:
+                for r in self.__split( current, max_records ):
+                    yield r
+            current = ( first, last )
+        if not current == None:
+            for r in self.__split( current, max_records ):
+                yield r
+
+    def __split( self, records, max_records ):
+        first, last = records
+        if max_records == None:
+            yield first, last
+            return
+        for start in xrange( first, last, max_records ):
+            yield start, min( start + max_records, last )
+
+    def __len__( self ):
+        return self.record_count
+
+
+####################################################################################
+#  scan_mft: Reads the $MFT sequentially in chunk_size pieces and parses every record
+#       from first up to last (default: the end of the $MFT). See parse_records.
+#       When ranges, a list of ( first, last ) record ranges such as MFTBitmap.ranges(),
+#       is given only those records are read, one range at a time.
+#       The records are decoded in batches with numpy when it is installed.
+####################################################################################
+def scan_mft( read_fn, run_starts, run_offsets, mft_size, record_size, first=0, last=None, chunk_size=CHUNK_SIZE, ranges=None ):
+    if last == None:
+        last = mft_size / record_size
+    parse = parse_records
+    if not numpy == None:
+        parse = parse_records_batch
+    if ranges == None:
+        per_chunk = max( chunk_size / record_size, 1 )
+        ranges = [ ( start, min( start + per_chunk, last ) ) for start in xrange( first, last, per_chunk ) ]
+    for range_first, range_last in ranges:
+        count = range_last - range_first
+        buf = read_mft( read_fn, run_starts, run_offsets, mft_size,
+                        range_first * record_size, count * record_size )
+        for entry in parse( buf, range_first, record_size ):
+            yield entry
+
+
+####################################################################################
+#  Worker process state for scan_mft_parallel, set up once per process by _init_worker
+####################################################################################
+_worker = {}
+
+
+def _init_worker( open_fn, read_fn, volume, run_starts, run_offsets, mft_size, record_size ):
+    _worker['fd'] = open_fn( volume )
+    _worker['read'] = read_fn
+    _worker['mft'] = ( run_starts, run_offsets, mft_size, record_size )
+
+
+def _scan_range( records ):
+    fd = _worker['fd']
+    read_fn = _worker['read']
+    run_starts, run_offsets, mft_size, record_size = _worker['mft']
+    return list( scan_mft( lambda offset, size: read_fn( fd, offset, size ),
+                           run_starts, run_offsets, mft_size, record_size, ranges=[ records ] ) )
+
+
+####################################################################################
+#  scan_mft_parallel: scan_mft split into ranges of chunk_size bytes of records, each
+#       parsed in a pool of worker processes. Yields the same entries in the same order.
+#       ranges may be given as for scan_mft, each range is then one piece of work.
+#   Python 2 has no shared memory between processes, so rather than the $MFT being read
+#   once and handed out, every worker opens the volume itself and reads its own ranges.
+#   Only the parsed entries are sent back.
+#   open_fn:   function( volume ) that opens the volume, returning a handle
+#   read_fn:   function( handle, offset, size ) that reads from the volume
+#   Both must be module level functions so they can be sent to the workers.
+####################################################################################
+def scan_mft_parallel( open_fn, read_fn, volume, run_starts, run_offsets, mft_size, record_size, processes, chunk_size=CHUNK_SIZE, ranges=None ):
+    if ranges == None:
+        count = mft_size / record_size
+        per_chunk = max( chunk_size / record_size, 1 )
+        ranges = [ ( first, min( first + per_chunk, count ) ) for first in xrange( 0, count, per_chunk ) ]
+    pool = multiprocessing.Pool( processes, _init_worker,
+                                 ( open_fn, read_fn, volume, run_starts, run_offsets, mft_size, record_size ) )
+    try:
+        for entries in pool.imap( _scan_range, ranges ):
+            for entry in entries:
+                yield entry
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+####################################################################################
+#  MFTIndex: The record number -> ( parent, name ) map of every in use record of a
+#       volume, and the reverse parent -> children map used to resolve paths.
+#   Call add() for every record and finish() once all have been added. finish() drops
+#   names whose parent reference is stale, that is the parent record has been reused.
+#
+#   The index is kept in flat arrays instead of dicts per record. Each distinct name is
+#   stored once in a name table, the sequence numbers are an array by record number
+#   and each name of a record is one row of the parallel parent, record and name id
+#   arrays. finish() sorts the rows by parent and lowercased name, so the children of
+#   a directory are a run of rows found by bisect and a child is found by a binary
+#   search of that run.
+####################################################################################
+class MFTIndex( object ):
+    def __init__( self ):
+        self.__strings = []
+        self.__string_ids = {}
+        # sequence number by record number, -1 for records not in use
+        self.__sequence = array.array( 'i' )
+        self.__count = 0
+        self.__parents = array.array( 'I' )
+        self.__parent_sequence = array.array( 'H' )
+        self.__records = array.array( 'I' )
+        self.__names = array.array( 'I' )
+        self.__first = array.array( 'i' )
+
+    ####################################################################################
+    # add: Adds a record. names is a list of ( parent reference, name ). The sequence
+    #       number is None for the names of an extension record
+    ####################################################################################
+    def add( self, record, sequence_number, names ):
+        if not sequence_number == None:
+            sequence = self.__sequence
+            if record >= len( sequence ):
+                sequence.extend( [-1] * max( record + 1 - len( sequence ), len( sequence ) ) )
+            if sequence[record] == -1:
+                self.__count += 1
+            sequence[record] = sequence_number
+        for parent_ref, name in names:
+            self.__parents.append( MREF( parent_ref ) )
+            self.__parent_sequence.append( MSEQNO( parent_ref ) )
+            self.__records.append( record )
+            self.__names.append( self.__intern( name ) )
+
+    def __intern( self, name ):
+        string_id = self.__string_ids.get( name )
+        if string_id == None:
+            string_id = len( self.__strings )
+            self.__strings.append( name )
+            self.__string_ids[name] = string_id
+        return string_id
+
+    def finish( self ):
+        parents = self.__parents
+        records = self.__records
+        names = self.__names
+        strings = self.__strings
+        seen = set()
+        rows = []
+        for row in xrange( len( records ) ):
+            parent = parents[row]
+            seq_num = self.__parent_sequence[row]
+            if not parent in self or ( seq_num and not self.__sequence[parent] == seq_num ):
+                continue
+            # One name per record in a directory, the first one added
+            key = parent << 32 | records[row]
+            if key in seen:
+                continue
+            seen.add( key )
+            rows.append( row )
+        seen = None
+        # Rows are sorted on the rank of their lowercased name in the name table
+        order = sorted( xrange( len( strings ) ), key=lambda string_id: strings[string_id].lower() )
+        rank = array.array( 'I', [0] ) * len( strings )
+        for position, string_id in enumerate( order ):
+            rank[string_id] = position
+        order = None
+        rows.sort( key=lambda row: parents[row] << 32 | rank[names[row]] )
+
+        self.__parents = array.array( 'I', ( parents[row] for row in rows ) )
+        self.__records = array.array( 'I', ( records[row] for row in rows ) )
+        self.__names = array.array( 'I', ( names[row] for row in rows ) )
+        self.__parent_sequence = None
+        self.__string_ids = None
+        self.__first = array.array( 'i', [-1] ) * len( self.__sequence )
+        for row in xrange( len( rows ) - 1, -1, -1 ):
+            record = self.__records[row]
+            if record < len( self.__first ):
+                self.__first[record] = row
+
+    ####################################################################################
+    # children: Returns { mft reference: name } of the entries of the directory record, 
+    #       in the same form as the $I30 entries read by TScopy.__iterChildIndex
+    ####################################################################################
+    def children( self, record ):
+        first = bisect_left( self.__parents, record )
+        last = bisect_right( self.__parents, record, first )
+        return dict( ( self.__reference( row ), self.__strings[self.__names[row]] ) for row in xrange( first, last ) )
+
+    ####################################################################################
+    # find: Returns the mft reference of the child of the directory record whose 
+    #       lowercased name is name, or None
+    ####################################################################################
+    def find( self, record, name ):
+        first = bisect_left( self.__parents, record )
+        last = bisect_right( self.__parents, record, first )
+        while first < last:
+            middle = ( first + last ) / 2
+            if self.__strings[self.__names[middle]].lower() < name:
+                first = middle + 1
+            else:
+                last = middle
+        if first < len( self.__parents ) and self.__parents[first] == record and \
+           self.__strings[self.__names[first]].lower() == name:
+            return self.__reference( first )
+        return None
+
+    def __reference( self, row ):
+        record = int( self.__records[row] )
+        if not record in self:
+            return record
+        return record | ( self.__sequence[record] << 48 )
+
+    ####################################################################################
+    # lookup: Returns the ( parent, name ) of record or None. For hard linked records
+    #       the first name is returned
+    ####################################################################################
+    def lookup( self, record ):
+        if record >= len( self.__first ) or self.__first[record] == -1:
+            return None
+        row = self.__first[record]
+        return int( self.__parents[row] ), self.__strings[self.__names[row]]
+
+    def __contains__( self, record ):
+        return record < len( self.__sequence ) and not self.__sequence[record] == -1
+
+    def __len__( self ):
+        return self.__count
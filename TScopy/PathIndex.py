@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+import pickle
+
+
+####################################################################################
+#  PathIndex: The persistent lookup table of directory entries of one volume found while
+#       walking the MFT, stored in an SQLite database so that only the entries a copy
+#       needs are read and only the entries it finds are written.
+#       filename: Path of the database file, or ':memory:' for a table that is not saved
+#
+#   Tables:
+#       entries:     ( parent, name ) -> record, its sequence number and the file
+#                    attributes of its $FILE_NAME, or NULL when they are not known.
+#                    name is the lowercased filename
+#       directories: Directories with entries, with the LSN of the directory record
+#                    when they were read and whether all their children were listed
+#       missing:     ( parent, name ) of lookups that found no such child. They are
+#                    valid as long as the entries of the directory are
+#       meta:        Pickled values such as the $MFT extent table
+#   A database written with a different VERSION is emptied when opened.
+#   The database is not opened until the first query. Changes are written with SQLite's
+#   write-ahead log, so a commit appends only the pages changed since the last one to
+#   the -wal file. The log is folded back into the database once it grows past
+#   COMPACT_SIZE.
+####################################################################################
+class PathIndex( object ):
+    VERSION = 4
+    TABLES = [ "entries", "directories", "missing", "meta" ]
+    SCHEMA = [ "CREATE TABLE IF NOT EXISTS entries ( parent INTEGER, name TEXT, record INTEGER, seq INTEGER, flags INTEGER, "
+                    "PRIMARY KEY ( parent, name ) )",
+               "CREATE TABLE IF NOT EXISTS directories ( record INTEGER PRIMARY KEY, lsn INTEGER, complete INTEGER )",
+               "CREATE TABLE IF NOT EXISTS missing ( parent INTEGER, name TEXT, PRIMARY KEY ( parent, name ) )",
+               "CREATE TABLE IF NOT EXISTS meta ( key TEXT PRIMARY KEY, value BLOB )" ]
+    COMPACT_SIZE = 4*1024*1024
+    PAGE_SIZE = 1024
+
+    def __init__( self, filename ):
+        self.filename = filename
+        self.__db = None
+
+    def __connect( self ):
+        if self.__db == None:
+            try:
+                db = sqlite3.connect( self.filename )
+                db.text_factory = str
+                if not self.filename == ':memory:':
+                    db.execute( "PRAGMA journal_mode=WAL" )
+                    db.execute( "PRAGMA synchronous=NORMAL" )
+                    db.execute( "PRAGMA wal_autocheckpoint=0" )
+                if not db.execute( "PRAGMA user_version" ).fetchone()[0] == PathIndex.VERSION:
+                    for table in PathIndex.TABLES:
+                        db.execute( "DROP TABLE IF EXISTS %s" % table )
+                    db.execute( "PRAGMA user_version=%d" % PathIndex.VERSION )
+                for statement in PathIndex.SCHEMA:
+                    db.execute( statement )
+                db.commit()
+            except sqlite3.Error, e:
+                raise Exception( "TSCOPY", "FAILED to open path index %s (%s)" % ( self.filename, e ) )
+            self.__db = db
+        return self.__db
+
+    ####################################################################################
+    # lookup: Returns ( record, sequence number ) of the child name of the directory 
+    #       parent or None
+    ####################################################################################
+    def lookup( self, parent, name ):
+        return self.__connect().execute( "SELECT record, seq FROM entries WHERE parent=? AND name=?",
+                                         ( parent, name.lower() ) ).fetchone()
+
+    ####################################################################################
+    # isMissing: Returns True when the directory parent is known to have no child name,
+    #       either from an earlier lookup or because all its children were listed
+    ####################################################################################
+    def isMissing( self, parent, name ):
+        db = self.__connect()
+        if not db.execute( "SELECT 1 FROM missing WHERE parent=? AND name=?", ( parent, name.lower() ) ).fetchone() == None:
+            return True
+        if db.execute( "SELECT 1 FROM directories WHERE record=? AND complete=1", ( parent, ) ).fetchone() == None:
+            return False
+        return self.lookup( parent, name ) == None
+
+    ####################################################################################
+    # listed: Returns the LSN of the directory parent when its entries were read, or
+    #       None when there are none
+    ####################################################################################
+    def listed( self, parent ):
+        row = self.__connect().execute( "SELECT lsn FROM directories WHERE record=?", ( parent, ) ).fetchone()
+        if row == None:
+            return None
+        return row[0]
+
+    ####################################################################################
+    # children: Returns an iterator of ( name, record, file attributes ) over the children
+    #       of the directory parent, or None when its children have not been listed yet.
+    #       The file attributes are None when they are not known
+    ####################################################################################
+    def children( self, parent ):
+        db = self.__connect()
+        if db.execute( "SELECT 1 FROM directories WHERE record=? AND complete=1", ( parent, ) ).fetchone() == None:
+            return None
+        return self.__iterChildren( parent )
+
+    ####################################################################################
+    # __iterChildren: Yields the children of parent in name order, PAGE_SIZE rows per 
+    #       query so that no cursor is left open while the caller works on a child
+    ####################################################################################
+    def __iterChildren( self, parent ):
+        name = ""
+        while True:
+            rows = self.__connect().execute( "SELECT name, record, flags FROM entries WHERE parent=? AND name>? "
+                                             "ORDER BY name LIMIT ?", ( parent, name, PathIndex.PAGE_SIZE ) ).fetchall()
+            for row in rows:
+                yield row
+            if len( rows ) < PathIndex.PAGE_SIZE:
+                return
+            name = rows[-1][0]
+
+    ####################################################################################
+    # saveChildren: Replaces the children of the directory parent, yielding each child 
+    #       once it is saved. The directory is marked as listed when children is exhausted,
+    #       a listing that is not read to the end is not used by children()
+    #       children: Iterable of tuples starting with ( name, record, sequence number )
+    #                 and optionally the file attributes, which are yielded unchanged
+    #       lsn: LSN of the directory record the children were read from
+    ####################################################################################
+    def saveChildren( self, parent, children, lsn ):
+        db = self.__connect()
+        self.invalidate( parent )
+        for child in children:
+            name, record, seq = child[:3]
+            flags = child[3] if len( child ) > 3 else None
+            db.execute( "INSERT OR REPLACE INTO entries VALUES ( ?, ?, ?, ?, ? )", ( parent, name.lower(), record, seq, flags ) )
+            yield child
+        db.execute( "INSERT OR REPLACE INTO directories VALUES ( ?, ?, 1 )", ( parent, lsn ) )
+
+    ####################################################################################
+    # addLookup: Adds the child name found by a lookup in the directory parent without
+    #       listing the other children. Entries read at another LSN are removed first.
+    #       lsn: LSN of the directory record the child was read from
+    ####################################################################################
+    def addLookup( self, parent, name, record, seq, lsn ):
+        self.__setLSN( parent, lsn )
+        self.__connect().execute( "INSERT OR REPLACE INTO entries VALUES ( ?, ?, ?, ?, NULL )",
+                                  ( parent, name.lower(), record, seq ) )
+
+    ####################################################################################
+    # addMissing: Records that a lookup found no child name in the directory parent
+    #       lsn: LSN of the directory record the lookup read
+    ####################################################################################
+    def addMissing( self, parent, name, lsn ):
+        self.__setLSN( parent, lsn )
+        self.__connect().execute( "INSERT OR REPLACE INTO missing VALUES ( ?, ? )", ( parent, name.lower() ) )
+
+    ####################################################################################
+    # __setLSN: Removes the entries of the directory parent read at another LSN than lsn
+    #       and starts a partial listing at lsn
+    ####################################################################################
+    def __setLSN( self, parent, lsn ):
+        if not self.listed( parent ) == lsn:
+            self.invalidate( parent )
+            self.__connect().execute( "INSERT INTO directories VALUES ( ?, ?, 0 )", ( parent, lsn ) )
+
+    ####################################################################################
+    # addEntry: Adds the child name to the directory parent when parent has entries
+    #       flags: File attributes of the child, or None when they are not known
+    ####################################################################################
+    def addEntry( self, parent, name, record, seq, flags=None ):
+        if self.listed( parent ) == None:
+            return
+        db = self.__connect()
+        db.execute( "INSERT OR REPLACE INTO entries VALUES ( ?, ?, ?, ?, ? )", ( parent, name.lower(), record, seq, flags ) )
+        db.execute( "DELETE FROM missing WHERE parent=? AND name=?", ( parent, name.lower() ) )
+
+    ####################################################################################
+    # removeEntry: Removes the child name of the directory parent if it is record
+    ####################################################################################
+    def removeEntry( self, parent, name, record ):
+        self.__connect().execute( "DELETE FROM entries WHERE parent=? AND name=? AND record=?",
+                                  ( parent, name.lower(), record ) )
+
+    ####################################################################################
+    # setListed: Updates the LSN of the directory parent if it has entries
+    ####################################################################################
+    def setListed( self, parent, lsn ):
+        self.__connect().execute( "UPDATE directories SET lsn=? WHERE record=?", ( lsn, parent ) )
+
+    ####################################################################################
+    # invalidate: Removes the children of the directory parent and the names it is known
+    #       not to have
+    ####################################################################################
+    def invalidate( self, parent ):
+        db = self.__connect()
+        db.execute( "DELETE FROM entries WHERE parent=?", ( parent, ) )
+        db.execute( "DELETE FROM missing WHERE parent=?", ( parent, ) )
+        db.execute( "DELETE FROM directories WHERE record=?", ( parent, ) )
+
+    ####################################################################################
+    # get: Returns the value saved under key, or default
+    ####################################################################################
+    def get( self, key, default=None ):
+        row = self.__connect().execute( "SELECT value FROM meta WHERE key=?", ( key, ) ).fetchone()
+        if row == None:
+            return default
+        return pickle.loads( str( row[0] ) )
+
+    ####################################################################################
+    # set: Saves value under key
+    ####################################################################################
+    def set( self, key, value ):
+        self.__connect().execute( "INSERT OR REPLACE INTO meta VALUES ( ?, ? )",
+                                  ( key, sqlite3.Binary( pickle.dumps( value, pickle.HIGHEST_PROTOCOL ) ) ) )
+
+    ####################################################################################
+    # commit: Appends the changes made since the last commit to the log, compacting the
+    #       log into the database when it is larger than COMPACT_SIZE
+    ####################################################################################
+    def commit( self ):
+        if self.__db == None:
+            return
+        self.__db.commit()
+        wal = self.filename + '-wal'
+        if os.path.isfile( wal ) and os.path.getsize( wal ) > PathIndex.COMPACT_SIZE:
+            self.compact()
+
+    ####################################################################################
+    # compact: Copies the log into the database and truncates it
+    ####################################################################################
+    def compact( self ):
+        if self.__db == None or self.filename == ':memory:':
+            return
+        self.__db.commit()
+        self.__db.execute( "PRAGMA wal_checkpoint(TRUNCATE)" )
+
+    def close( self ):
+        if not self.__db == None:
+            self.compact()
+            self.__db.close()
+            self.__db = None
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import sys
+import threading
+import Queue
+
+#   Seconds a blocked reader waits before checking whether the writer stopped
+POLL_INTERVAL = 0.1
+
+_END = object()
+
+
+####################################################################################
+#  read_ahead: Yields the items of iterable, which are produced in a reader thread
+#       while the caller works on the previous ones. At most depth items are queued
+#       between the two threads, so with chunks of file data the memory used is
+#       bounded by ( depth + 2 ) chunks.
+#   An exception raised by iterable is raised again in the caller. When the caller
+#   stops early (the generator is closed) the reader thread stops after its current
+#   item.
+#   File reads and writes release the GIL, so reading the volume overlaps writing
+#   the copy.
+####################################################################################
+def read_ahead( iterable, depth ):
+    queue = Queue.Queue( depth )
+    stop = threading.Event()
+
+    def put( item ):
+        while not stop.is_set():
+            try:
+                queue.put( item, True, POLL_INTERVAL )
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for item in iterable:
+                if not put( ( item, None ) ):
+                    return
+            put( ( _END, None ) )
+        except:
+            put( ( _END, sys.exc_info() ) )
+
+    thread = threading.Thread( target=reader, name="tscopy-read-ahead" )
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if not error == None:
+                raise error[0], error[1], error[2]
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import struct
+import logging
+
+from MFT import MREF, MSEQNO
+from IndexTree import FILE_ATTR_HAS_INDX
+
+
+#   Bytes of the $J stream read at a time
+CHUNK_SIZE = 1024*1024
+#   Records do not cross a page of the journal, the end of a page is zero filled
+PAGE_SIZE = 0x1000
+#   Times the journal is read again when it has grown while it was being applied
+REFRESH_PASSES = 4
+
+DWORD = struct.Struct("<I")
+WORD = struct.Struct("<H")
+#   MaximumSize, AllocationDelta, UsnJournalID, LowestValidUsn
+USN_MAX = struct.Struct("<QQQQ")
+#   FileReferenceNumber, ParentFileReferenceNumber, Usn, TimeStamp, Reason, SourceInfo,
+#   SecurityId, FileAttributes, FileNameLength, FileNameOffset
+USN_RECORD_V2 = struct.Struct("<QQQQIIIIHH")
+#   The 128 bit references of a version 3 record. Only the low 64 bits are used by NTFS
+USN_RECORD_V3 = struct.Struct("<QQQQQQIIIIHH")
+
+FILE_ATTRIBUTE_DIRECTORY = 0x10
+
+
+class USN_REASON:
+    FILE_CREATE = 0x00000100
+    FILE_DELETE = 0x00000200
+    RENAME_OLD_NAME = 0x00001000
+    RENAME_NEW_NAME = 0x00002000
+    HARD_LINK_CHANGE = 0x00010000
+
+
+####################################################################################
+#  parse_usn_max: Returns ( journal id, lowest valid usn ) from the $Max stream
+####################################################################################
+def parse_usn_max( buf ):
+    maximum_size, allocation_delta, journal_id, lowest_valid_usn = USN_MAX.unpack_from( buf, 0 )
+    return journal_id, lowest_valid_usn
+
+
+####################################################################################
+#  parse_usn_records: Parses the USN_RECORD_V2 and V3 records in buf, which starts at
+#       byte usn of the $J stream.
+#   Returns ( records, consumed ). Each record is the tuple
+#       ( usn, file reference, parent reference, reason, file attributes, name )
+#   consumed is the number of bytes parsed. A record cut off by the end of buf is
+#   left unparsed.
+####################################################################################
+def parse_usn_records( buf, usn ):
+    records = []
+    offset = 0
+    size = len( buf )
+    while offset + 8 <= size:
+        length = DWORD.unpack_from( buf, offset )[0]
+        if length == 0:
+            offset = ( ( usn + offset ) / PAGE_SIZE + 1 ) * PAGE_SIZE - usn
+            continue
+        if length < 8 or length % 8:
+            logging.getLogger("tscopy").warning( "Invalid USN record at usn(%x)" % ( usn + offset ) )
+            return records, size
+        if offset + length > size:
+            break
+        major = WORD.unpack_from( buf, offset + 4 )[0]
+        if major == 2:
+            ( file_ref, parent_ref, record_usn, timestamp, reason, source, security, attributes,
+              name_length, name_offset ) = USN_RECORD_V2.unpack_from( buf, offset + 8 )
+        elif major == 3:
+            ( file_ref, file_ref_high, parent_ref, parent_ref_high, record_usn, timestamp, reason,
+              source, security, attributes, name_length, name_offset ) = USN_RECORD_V3.unpack_from( buf, offset + 8 )
+        else:
+            offset += length
+            continue
+        start = offset + name_offset
+        name = str( buf[start:start + name_length] ).decode( "utf-16le" )
+        records.append( ( usn + offset, file_ref, parent_ref, reason, attributes, name ) )
+        offset += length
+    return records, min( offset, size )
+
+
+####################################################################################
+#  UsnReader: Parses the $J stream as it is read in chunks. Records that straddle two
+#       chunks are kept until the rest of the record is fed.
+####################################################################################
+class UsnReader( object ):
+    def __init__( self ):
+        self.__pending = bytearray()
+        self.__start = None
+        self.next_usn = None
+
+    ####################################################################################
+    # feed: Returns the records of buf, which holds the $J stream from byte usn. When usn
+    #       does not follow the previous chunk (a sparse run) the pending bytes are dropped
+    ####################################################################################
+    def feed( self, buf, usn ):
+        if not usn == self.next_usn:
+            self.__pending = bytearray()
+            self.__start = usn
+        self.__pending += buf
+        self.next_usn = usn + len( buf )
+        records, consumed = parse_usn_records( self.__pending, self.__start )
+        del self.__pending[:consumed]
+        self.__start += consumed
+        return records
+
+
+####################################################################################
+#  read_usn_journal: Reads the $J stream from USN start to end and yields the lists of
+#       records parsed from each chunk. Sparse runs are skipped.
+#       read_fn:    function( offset, size ) returning a bytearray of the volume
+#       extents:    Runlist of $J as ( cluster or None when sparse, length ) tuples
+#       bpc:        Bytes per cluster
+#   Reads are whole clusters of at most chunk_size bytes, trimmed to start and end.
+####################################################################################
+def read_usn_journal( read_fn, extents, bpc, start, end, chunk_size=CHUNK_SIZE ):
+    reader = UsnReader()
+    vcn = 0
+    for lcn, length in extents:
+        run_start = vcn * bpc
+        run_end = run_start + length * bpc
+        vcn += length
+        if lcn == None or run_end <= start or run_start >= end:
+            continue
+        pos = max( run_start, start - start % bpc )
+        run_stop = min( run_end, end )
+        while pos < run_stop:
+            read_sz = min( chunk_size, run_stop - pos )
+            read_sz += ( bpc - read_sz % bpc ) % bpc
+            buf = read_fn( lcn * bpc + pos - run_start, read_sz )
+            usn = pos
+            if usn < start:
+                del buf[:start - usn]
+                usn = start
+            del buf[min( pos + read_sz, end ) - usn:]
+            yield reader.feed( buf, usn )
+            pos += read_sz
+
+
+####################################################################################
+#  usn_resume: Returns the USN to read the journal from, or None when the changes since
+#       the saved position are lost because the journal was deleted, recreated or has
+#       wrapped past it
+#       saved:  ( journal id, next usn ) saved by the previous run
+####################################################################################
+def usn_resume( saved, journal_id, lowest_valid_usn, next_usn ):
+    if not saved[0] == journal_id or not lowest_valid_usn <= saved[1] <= next_usn:
+        return None
+    return saved[1]
+
+
+####################################################################################
+#  apply_usn_records: Applies the creates, deletes and renames of the records to the
+#       PathIndex. Only directories already listed in the index are changed.
+#   The file attributes of the records mark directories with FILE_ATTRIBUTE_DIRECTORY,
+#   they are saved with FILE_ATTR_HAS_INDX instead like the attributes of $FILE_NAME.
+#   Returns the set of records that were changed, whose LSN in the index has to be
+#   updated to the one of the volume.
+####################################################################################
+def apply_usn_records( path_index, records ):
+    touched = set()
+    for usn, file_ref, parent_ref, reason, attributes, name in records:
+        record = MREF( file_ref )
+        parent = MREF( parent_ref )
+        touched.add( record )
+        touched.add( parent )
+        if reason & USN_REASON.HARD_LINK_CHANGE:
+            # The record does not say which link changed, list the directory again
+            path_index.invalidate( parent )
+            continue
+        # Reasons accumulate until the file is closed, so a rename of a new file also
+        # carries FILE_CREATE and the old name record of a second rename also carries
+        # RENAME_NEW_NAME. RENAME_OLD_NAME is never added to the new name record, so
+        # it is checked first and its name is always removed
+        if reason & USN_REASON.FILE_DELETE:
+            path_index.removeEntry( parent, name, record )
+            if attributes & FILE_ATTRIBUTE_DIRECTORY:
+                path_index.invalidate( record )
+        elif reason & USN_REASON.RENAME_OLD_NAME:
+            path_index.removeEntry( parent, name, record )
+        elif reason & ( USN_REASON.RENAME_NEW_NAME | USN_REASON.FILE_CREATE ):
+            flags = attributes & ~FILE_ATTRIBUTE_DIRECTORY
+            if attributes & FILE_ATTRIBUTE_DIRECTORY:
+                flags |= FILE_ATTR_HAS_INDX
+            path_index.addEntry( parent, name, record, MSEQNO( file_ref ), flags )
+    return touched
@@ -9,16 +9,27 @@ import logging
 import sys
 import os
 import re
-import pickle
 import argparse
 import time
 import traceback
 import struct
+import multiprocessing
 
 from math import ceil
-from BinaryParser import Mmap, hex_dump, Block
-from MFT import INDXException, MFTRecord, Attribute, ATTR_TYPE, Attribute_List
-from MFT import StandardInformation,FilenameAttribute, INDEX_ROOT
+from bisect import bisect_right
+from BinaryParser import Mmap, hex_dump, Block, OverrunBufferException
+from BlockCache import BlockCache
+from ExtentTable import ExtentTable
+from PathIndex import PathIndex
+from IndexTree import UpCase, find_entry, read_index_block, root_node, block_node, index_children, iter_index_blocks, FILE_ATTR_HAS_INDX
+from ReadAhead import read_ahead
+from CopyPool import CopyPool
+from ExtentCopy import copy_extents, data_extents
+from ExtentPlan import ExtentPlan, OutputFiles
+from UsnJournal import read_usn_journal, usn_resume, apply_usn_records, parse_usn_max, REFRESH_PASSES
+from MFTScan import MFTIndex, MFTBitmap, scan_mft, scan_mft_parallel, CHUNK_SIZE
+from MFT import MFTRecord, MFTRecordView, Attribute, ATTR_TYPE, Attribute_List, MREF, MSEQNO
+from MFT import StandardInformation,FilenameAttribute
 
 if os.name == "nt":
     try:
@@ -32,22 +43,25 @@ if os.name == "nt":
 #   https://flatcap.org/linux-ntfs/ntfs/files/boot.html
 ####################################################################################
 class BootSector(Block):
+    FIELDS = (
+        ("qword", "system_id", 0x3),
+        ("word", "bytes_per_sector", 0x0b),
+        ("byte", "sectors_per_cluster", 0xd),
+        ("word", "reserved_sectors", 0xe),
+        ("byte", "media_desc", 0x15),
+        ("word", "sectors_per_track", 0x18),
+        ("word", "heads", 0x1a),
+        ("dword", "hidden_sectors", 0x1c),
+        ("qword", "total_sectors", 0x28),
+        ("qword", "start_c_mft", 0x30),
+        ("qword", "start_c_mftmir", 0x38),
+        ("byte", "file_rec_indicator", 0x40),
+        ("byte", "idx_buf_size_indicator", 0x44),
+        ("qword", "serial_number", 0x48),
+    )
+
     def __init__(self, buf, offset, logger):
         super(BootSector, self).__init__(buf, offset)
-        self.declare_field("qword", "system_id", 0x3)
-        self.declare_field("word", "bytes_per_sector", 0x0b)
-        self.declare_field("byte", "sectors_per_cluster", 0xd)
-        self.declare_field("word", "reserved_sectors", 0xe)
-        self.declare_field("byte", "media_desc", 0x15)
-        self.declare_field("word", "sectors_per_track", 0x18)
-        self.declare_field("word", "heads", 0x1a)
-        self.declare_field("dword", "hidden_sectors", 0x1c)
-        self.declare_field("qword", "total_sectors", 0x28)
-        self.declare_field("qword", "start_c_mft", 0x30)
-        self.declare_field("qword", "start_c_mftmir", 0x38)
-        self.declare_field("byte", "file_rec_indicator", 0x40)
-        self.declare_field("byte", "idx_buf_size_indicator", 0x44)
-        self.declare_field("qword", "serial_number", 0x48)
         self.bytes_per_cluster = self.bytes_per_sector() * self.sectors_per_cluster()
         #COPIED FROM  RAWCOPY:: A really lame fix for a rare bug seen in certain Windows 7 x64 vm's
         if self.file_rec_indicator() > 127:
@@ -58,67 +72,31 @@ class BootSector(Block):
         else:
             self.mft_record_size = self.bytes_per_cluster * self.file_rec_indicator()
             
+        if self.idx_buf_size_indicator() > 127:
+            self.index_record_size = 2 ** ( 256 - self.idx_buf_size_indicator() )
+        else:
+            self.index_record_size = self.bytes_per_cluster * self.idx_buf_size_indicator()
+
         self.sectors_per_mft_record = self.mft_record_size / self.bytes_per_sector()
         self.cluster_per_file_record_segment = int(ceil(float(self.mft_record_size) / self.bytes_per_cluster))
         
 
 ####################################################################################
-#  NTFS INDX Record structure
-#     https://flatcap.org/linux-ntfs/ntfs/concepts/index_record.html 
-####################################################################################
-class INDX( Block ):
-    def __init__(self, buf, offset ):
-        super(INDX, self).__init__(buf, offset)
-        self.declare_field("dword", "magic", 0x0)
-        self.declare_field("word", "update_seq_offset", 0x4)
-        self.declare_field("word", "update_seq_sz", 0x6)
-        self.declare_field("qword", "logfile_seq_num", 0x8)
-        self.declare_field("qword", "VCN_INDX", 0x10)
-        self.declare_field("dword", "index_entries_offset", 0x18)
-        self.declare_field("dword", "index_entries_sz", 0x1c)
-        self.declare_field("dword", "alloc_sz", 0x20)
-        self.declare_field("byte", "leaf_node", 0x24)
-        self.declare_field("word", "update_seq", 0x28)
-        s = self.update_seq_sz()
-
-    def update_seq_arr( self, idx_buf ):
-        # TODO: Clean this up into a for loop
-        seq_arr = idx_buf[self.update_seq_offset()+2:self.update_seq_offset()+2+self.update_seq_sz()*2]
-        ret  = idx_buf[0x0000:0x01fe] + seq_arr[0x00:0x2]
-        ret += idx_buf[0x0200:0x03fe] + seq_arr[0x02:0x4]
-        ret += idx_buf[0x0400:0x05fe] + seq_arr[0x04:0x6]
-        ret += idx_buf[0x0600:0x07fe] + seq_arr[0x06:0x8]
-        ret += idx_buf[0x0800:0x09fe] + seq_arr[0x08:0xa]
-        ret += idx_buf[0x0a00:0x0bfe] + seq_arr[0x0a:0xc]
-        ret += idx_buf[0x0c00:0x0dfe] + seq_arr[0x0c:0xe]
-        ret += idx_buf[0x0e00:0x0ffe] + seq_arr[0x0e:0x10]
-        ret += idx_buf[0x1000:      ] 
-        return ret
-
-####################################################################################
-#  NTFS INDX Entry Structure
-#     https://flatcap.org/linux-ntfs/ntfs/concepts/index_entry.html
+#  open_volume, read_volume: TScopy.__open and TScopy.__readDisk for the worker processes
+#       of the parallel MFT scan, which have no TScopy instance.
 ####################################################################################
-class INDX_ENTRY( Block ):
-    def __init__(self, buf, offset):
-        super(INDX_ENTRY, self).__init__(buf, offset)
-        self.declare_field("qword", "mft_recordnum", 0)
-        self.declare_field("word", "entry_sz", 0x08 )
-        if self.entry_sz() == 0x18 and self.mft_recordnum() == 0:
-            raise INDXException("End of INDX File found")
-        if self.entry_sz() == 0x10 and self.mft_recordnum() == 0:
-            raise INDXException("End of INDX File found")
-        if self.entry_sz() == 0x00 and self.mft_recordnum() == 0:
-            raise INDXException("NULLS INDX File found")
-        self.declare_field("word", "filename_offset", 0x0a )
-        self.declare_field("word", "index_flags", 0x0c )
-        self.declare_field("qword", "mft_parent_recordnum", 0x10 )
-        self.declare_field("qword", "alloc_sz", 0x38 )
-        self.declare_field("qword", "file_sz", 0x40 )
-        self.declare_field("qword", "file_flags", 0x48 )
-        self.declare_field("byte", "filename_sz", 0x50 )
-        self.declare_field("binary", "filename", 0x52, self.filename_sz()*2 )
+def open_volume( filename ):
+    return win32file.CreateFile( filename,
+                    win32file.GENERIC_READ,
+                    win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE,
+                    None, 
+                    win32con.OPEN_EXISTING, 
+                    win32file.FILE_ATTRIBUTE_NORMAL,
+                    None)
 
+def read_volume( fd, offset, read_sz ):
+    win32file.SetFilePointer( fd, offset, win32file.FILE_BEGIN)
+    return bytearray( win32file.ReadFile( fd, read_sz)[1] )
 
 ####################################################################################
 #  The main class of TScopy.
@@ -128,15 +106,37 @@ class INDX_ENTRY( Block ):
 #       tscopy = TScopy()
 #       tscopy.setConfiguration( config )
 #       tscopy.copy( src, dst )
+#       tscopy.close()
 #
 #     * Config key descriptions
 #       - outputbasedir : The FULL PATH of directory where the files will be copied too.
-#       - pickledir : The FULL PATH of directory where the pickle file will be created or used.
+#       - pickledir : The FULL PATH of directory where the mft_<serial>.db path indexes will be created or used.
 #       - logger : A preconfigured instance of the python Logger class. 
 #       - debug : Not used
 #       - ignore_table: 
 #           * True  = Rebuilds the MFT table from the root node and does not save the table at the end of the run
-#           * False = Uses a previous mft.pickle file if found. Saves the file after every copy.
+#           * False = Uses the previous mft_<serial>.db file of the volume if found. Saves the entries found after every copy.
+#       - cache_size: Optional. Bytes of raw volume reads to keep in memory. 0 disables the cache.
+#       - mft_scan: Optional.
+#           * True  = Reads the entire $MFT once per volume to resolve paths and list directories
+#           * False = Walks the directory indexes of each path (default)
+#       - mft_scan_processes: Optional. Number of processes used by mft_scan. 0 uses every CPU. Default 1
+#       - usn_journal: Optional.
+#           * True  = Applies the changes in the $UsnJrnl journal since the last run to the saved path index (default)
+#           * False = Saved directories are listed again when their MFT record has changed
+#       - chunk_size: Optional. Bytes of file data read and written at a time. Default 4MB
+#       - jobs: Optional. Number of threads that copy the files of a directory, each reading
+#           the volume through its own handle. 0 uses one per CPU. Default 1
+#       - extent_jobs: Optional. Number of threads that copy the extents of a file larger than
+#           chunk_size, writing each at its offset in the copy. Default 1
+#       - disk_order: Optional.
+#           * True  = Gathers the extents of every file copied from a volume and reads them in
+#                     the order they are on the disk when flush() or close() is called. copy()
+#                     only creates the files with their full size, their data is written by
+#                     flush() or close()
+#           * False = Reads each file as it is found (default)
+#       - queue_depth: Optional. Chunks of file data read ahead of the writes by a reader
+#           thread. 0 reads and writes in turn. Default 2
 ####################################################################################
 class TScopy( object ):
     _instance = None
@@ -144,12 +144,30 @@ class TScopy( object ):
         if cls._instance == None:
             cls._instance = super(TScopy, cls).__new__(cls)
             cls.__isConfigured = False
-            cls.__pickle_filename = "mft.pickle"
+            cls.__index_filename = "mft_%016X.db"
+            cls.__path_indexes = {}
+            cls.__usn_refreshed = set()
+            cls.__copy_pools = {}
+            cls.__plans = {}
             cls.config = { 'files': None,
                             'pickledir': None,
                             'logger': None,
                             'debug': True,
                             'ignore_table':False,
+                            'cache_size': 16*1024*1024,
+                            'cache': None,
+                            'mft_scan': False,
+                            'mft_scan_processes': 1,
+                            'mft_index': None,
+                            'mft_indexes': {},
+                            'usn_journal': True,
+                            'upcase': None,
+                            'upcase_tables': {},
+                            'chunk_size': 4*1024*1024,
+                            'queue_depth': 2,
+                            'jobs': 1,
+                            'extent_jobs': 1,
+                            'disk_order': False,
                           }
             cls.__useWin32 = False
         return cls._instance
@@ -167,12 +185,21 @@ class TScopy( object ):
     def setConfiguration( self, config ):
         if self.__isConfigured == True:
             return
-        self.__MFT_lookup_table = None
+        self.__path_index = None
         self.__isConfigured = True
         self.setDebug( config['debug'] )
         self.setLogger( config['logger'] )
         self.setLookupTable( config['ignore_table'] )
         self.setPickleDir( config['pickledir'] )
+        self.setCacheSize( config.get('cache_size', self.config['cache_size']) )
+        self.setMFTScan( config.get('mft_scan', self.config['mft_scan']) )
+        self.setMFTScanProcesses( config.get('mft_scan_processes', self.config['mft_scan_processes']) )
+        self.setUsnJournal( config.get('usn_journal', self.config['usn_journal']) )
+        self.setChunkSize( config.get('chunk_size', self.config['chunk_size']) )
+        self.setQueueDepth( config.get('queue_depth', self.config['queue_depth']) )
+        self.setJobs( config.get('jobs', self.config['jobs']) )
+        self.setExtentJobs( config.get('extent_jobs', self.config['extent_jobs']) )
+        self.setDiskOrder( config.get('disk_order', self.config['disk_order']) )
 
 
     ####################################################################################
@@ -197,38 +224,106 @@ class TScopy( object ):
         self.config['ignore_table'] = tf
 
     ####################################################################################
-    #  setPickleDir: Sets the output directory to save the mft.pickle file too
+    # setCacheSize: Sets the number of bytes of raw volume reads kept in memory. 0 disables
+    ####################################################################################
+    def setCacheSize( self, size ):
+        if size < 0:
+            raise Exception( "TSCOPY", "Invalid cache size (%r)" % size )
+        self.config['cache_size'] = size
+
+    ####################################################################################
+    # setMFTScan: Sets whether paths are resolved from a full scan of the $MFT
+    ####################################################################################
+    def setMFTScan( self, tf ):
+        self.config['mft_scan'] = tf
+
+    ####################################################################################
+    # setMFTScanProcesses: Sets the number of processes that parse the $MFT when mft_scan 
+    #       is set. 0 uses one per CPU
+    ####################################################################################
+    def setMFTScanProcesses( self, processes ):
+        if processes < 0:
+            raise Exception( "TSCOPY", "Invalid number of processes (%r)" % processes )
+        if processes == 0:
+            processes = multiprocessing.cpu_count()
+        self.config['mft_scan_processes'] = processes
+
+    ####################################################################################
+    # setUsnJournal: Sets whether the saved path index is refreshed from the $UsnJrnl 
+    ####################################################################################
+    def setUsnJournal( self, tf ):
+        self.config['usn_journal'] = tf
+
+    ####################################################################################
+    # setChunkSize: Sets the number of bytes of file data read and written at a time, 
+    #       which bounds the memory used to copy a file
+    ####################################################################################
+    def setChunkSize( self, size ):
+        if size <= 0:
+            raise Exception( "TSCOPY", "Invalid chunk size (%r)" % size )
+        self.config['chunk_size'] = size
+
+    ####################################################################################
+    # setQueueDepth: Sets the number of chunks of file data read ahead of the writes. 
+    #       0 disables the reader thread
+    ####################################################################################
+    def setQueueDepth( self, depth ):
+        if depth < 0:
+            raise Exception( "TSCOPY", "Invalid queue depth (%r)" % depth )
+        self.config['queue_depth'] = depth
+
+    ####################################################################################
+    # setJobs: Sets the number of threads that copy files. 0 uses one per CPU
+    ####################################################################################
+    def setJobs( self, jobs ):
+        if jobs < 0:
+            raise Exception( "TSCOPY", "Invalid number of jobs (%r)" % jobs )
+        if jobs == 0:
+            jobs = multiprocessing.cpu_count()
+        self.config['jobs'] = jobs
+
+    ####################################################################################
+    # setExtentJobs: Sets the number of threads that copy the extents of one large file. 
+    #       0 uses one per CPU
+    ####################################################################################
+    def setExtentJobs( self, jobs ):
+        if jobs < 0:
+            raise Exception( "TSCOPY", "Invalid number of extent jobs (%r)" % jobs )
+        if jobs == 0:
+            jobs = multiprocessing.cpu_count()
+        self.config['extent_jobs'] = jobs
+
+    ####################################################################################
+    # setDiskOrder: Sets whether the file data is read in disk order once all the files 
+    #       are found
+    ####################################################################################
+    def setDiskOrder( self, tf ):
+        self.config['disk_order'] = tf
+
+    ####################################################################################
+    #  setPickleDir: Sets the output directory to save the mft_<serial>.db path indexes too
     ####################################################################################
     def setPickleDir( self, directory ):
         if not directory == None and not os.path.isdir( directory ):
             self.config['logger'].error("Error pickle destination (%s) not found" % directory)
             parser.print_help()
             raise Exception( "TSCOPY", "Error pickle destination (%s) not found" % directory)
-        self.__pickle_fullpath = '%s%s%s' % ( directory, os.sep, self.__pickle_filename )
-        self.__MFT_lookup_table = self.__getLookupTableFromDisk( "c" )
+        self.__pickledir = directory
         
     ####################################################################################
-    #  __getLookupTableFromDisk: Checks the mft.pickle file. 
-    #       If it exists then it loads into memory.
-    #       If it does not exists then it creates a new basic structure
+    #  __getPathIndex: Returns the path index of the volume with the serial number. Each 
+    #       volume is saved to its own file, which is only opened by the first query.
+    #       When ignore_table is set a new index is kept in memory instead, so every copy
+    #       starts from the root node.
     ####################################################################################
-    def __getLookupTableFromDisk( self, drive_letter ):
-        if not os.path.isfile( self.__pickle_fullpath):
-            return {drive_letter:{5:{'seq_num': 5, 'name':'','children':{}}}}
-        try:
-            self.config['logger'].debug("Using Pickle file: %s " % self.__pickle_fullpath)
-            with open( self.__pickle_fullpath, 'rb') as fd:
-                return pickle.loads( fd.read() )
-        except:
-            raise Exception( "TSCOPY", "FAILED to parse pickle file %s" % self.__pickle_fullpath )
-        
-    ####################################################################################
-    #  __saveLookuptable: Write the lookup table from memory to disk. 
-    #       Overwrites previous copy if it exists.
-    ####################################################################################
-    def __saveLookuptable( self, lookup_table ):
-        with open(self.__pickle_fullpath, 'wb') as fd:
-            fd.write( pickle.dumps( lookup_table ))
+    def __getPathIndex( self, serial_number ):
+        if self.config['ignore_table'] == True:
+            return PathIndex( ':memory:' )
+        if not serial_number in self.__path_indexes:
+            filename = '%s%s%s' % ( self.__pickledir, os.sep, self.__index_filename % serial_number )
+            self.config['logger'].debug("Using path index: %s " % filename)
+            self.__path_indexes[serial_number] = PathIndex( filename )
+        return self.__path_indexes[serial_number]
 
     ####################################################################################
     # __getMFT: Gets the root record of the MFT 
@@ -267,40 +362,216 @@ class TScopy( object ):
         return ret
 
     ####################################################################################
-    #  __GenRefArray: Iterates through the seq_num 5 datadruns 
+    # __getMFTBitmap: Reads the $BITMAP attribute of the $MFT record, which has a bit set for
+    #       every record in use. Returns an MFTBitmap or None if there is none
+    ####################################################################################
+    def __getMFTBitmap( self ):
+        fd = self.config['fd']
+        bpc = self.config['bss'].bytes_per_cluster
+        record_count = self.config['mft_size'] / self.config['bss'].mft_record_size
+        try:
+            record = MFTRecordView( self.__calcOffset( 0 ) )
+            for attribute in record.attributes():
+                if not attribute.type() == ATTR_TYPE.BITMAP or not attribute.name_length() == 0:
+                    continue
+                if attribute.non_resident() == 0:
+                    return MFTBitmap( attribute.value().tobytes(), record_count )
+                bitmap = bytearray()
+                for cluster_offset, length in attribute.runlist().runs():
+                    bitmap += self.__read( fd, cluster_offset * bpc, length * bpc )
+                return MFTBitmap( str( bitmap[:attribute.data_size()] ), record_count )
+        except:
+            self.config['logger'].error( "Failed to read the $MFT bitmap\n%s" % traceback.format_exc())
+        return None
+
+    ####################################################################################
+    #  __GenRefArray: Iterates through the $MFT dataruns once and builds the lookup table
+    #       used by __calcOffset.
+    #       mft_run_starts:  Byte offset into the $MFT at which each datarun starts (sorted)
+    #       mft_run_offsets: Byte offset on the volume of each datarun
+    #       split_mft_rec:   ExtentTable of the records that straddle two dataruns
+    #   The ExtentTable is saved in the path index of the drive together with the
+    #   dataruns it was built from, and reused while the dataruns are unchanged.
     ####################################################################################
     def __GenRefArray( self ):
-        MFTClustersToKeep = 0
-        ref = -1
         dataruns = self.config['mft_dataruns']
         bytes_per_cluster = self.config['bss'].bytes_per_cluster 
-        ClustersPerFileRecordSegment = self.config['bss'].cluster_per_file_record_segment 
-        split_mft_rec = {} 
-        cnt = 0
-        for x in dataruns:
-            r = dataruns[x]
-            doKeepCluster = MFTClustersToKeep
-            MFTClustersToKeep = (r[1]+ClustersPerFileRecordSegment - MFTClustersToKeep) % ClustersPerFileRecordSegment
-            if not MFTClustersToKeep == 0:
-                MFTClustersToKeep = ClustersPerFileRecordSegment - MFTClustersToKeep
-            pos = r[0] * bytes_per_cluster 
-            subtr = self.config['bss'].mft_record_size 
-            if  MFTClustersToKeep or doKeepCluster:
-                subtr = 0
-            end_of_run = r[1] * bytes_per_cluster - subtr
-            for i in range(0, end_of_run, self.config['bss'].mft_record_size):
-                if MFTClustersToKeep:
-                    if i >= end_of_run - ((ClustersPerFileRecordSegment - MFTClustersToKeep) * bytes_per_cluster):
-                        bytesToGet = (ClustersPerFileRecordSegment - MFTClustersToKeep) * bytes_per_cluster
-                        split_mft_rec[cnt] = '%d?%d,%d' % (ref+1, pos+i, bytesToGet )
-                ref += 1
-                if i == 0 and doKeepCluster:
-                    bytesToGet = doKeepCluster * bytes_per_cluster
-                    if bytesToGet > self.config['bss'].mft_record_size:
-                        bytesToGet = self.config['bss'].mft_record_size 
-                    split_mft_rec[cnt] += '|%d&%d' % ( pos+i, bytesToGet )
-                cnt += 1
+        record_size = self.config['bss'].mft_record_size
+        run_starts = []
+        run_offsets = []
+        start = 0
+        for x in sorted( dataruns ):
+            lcn, length = dataruns[x]
+            if length == 0:
+                continue
+            run_starts.append( start )
+            run_offsets.append( lcn * bytes_per_cluster )
+            start += length * bytes_per_cluster
+        self.config['mft_run_starts'] = run_starts
+        self.config['mft_run_offsets'] = run_offsets
+        self.config['mft_size'] = start
+
+        saved = self.__path_index.get( '$MFT' )
+        if not saved == None and saved[0] == ( record_size, dataruns ):
+            self.config['split_mft_rec'] = saved[1]
+            return
+
+        # Any run that does not end on a record boundary splits the record across it
+        split_mft_rec = ExtentTable()
+        for x in range( 1, len( run_starts ) ):
+            if run_starts[x] % record_size == 0:
+                continue
+            ref = run_starts[x] / record_size
+            fragments = []
+            pos = ref * record_size
+            while pos < ( ref + 1 ) * record_size and pos < start:
+                r = bisect_right( run_starts, pos ) - 1
+                run_end = run_starts[r+1] if r + 1 < len( run_starts ) else start
+                size = min( run_end, ( ref + 1 ) * record_size ) - pos
+                fragments.append( ( run_offsets[r] + pos - run_starts[r], size ) )
+                pos += size
+            split_mft_rec.add( ref, fragments )
         self.config['split_mft_rec'] = split_mft_rec
+        self.__path_index.set( '$MFT', ( ( record_size, dataruns ), split_mft_rec ) )
+
+    ####################################################################################
+    #  __refreshPathIndex: Applies the creates, deletes and renames recorded in the $UsnJrnl
+    #       change journal since the last run to the path index. The LSNs of the changed
+    #       directories are updated, so their listings stay valid without reading them 
+    #       again. The journal id and the next USN to read are saved in the path index.
+    #   When the journal was deleted, recreated or has wrapped past the saved USN the 
+    #   changes are lost, and __isListingValid decides which directories to list again.
+    #   The LSN of a directory is read after the journal, so a change made in between would
+    #   be taken as applied. The journal is read again until its next USN stops moving,
+    #   up to REFRESH_PASSES times. When it still moves, the directories updated last are
+    #   invalidated instead.
+    ####################################################################################
+    def __refreshPathIndex( self ):
+        journal = self.__getUsnJournal()
+        if journal == None:
+            self.config['logger'].debug( "No USN journal found" )
+            return
+        journal_id, lowest_valid_usn, next_usn, extents = journal
+        saved = self.__path_index.get( '$UsnJrnl' )
+        if saved == None:
+            pass
+        elif usn_resume( saved, journal_id, lowest_valid_usn, next_usn ) == None:
+            self.config['logger'].info( "USN journal has been reset, saved directories will be validated" )
+        else:
+            start = time.time()
+            count = 0
+            fd = self.config['fd']
+            read_fn = lambda offset, read_sz: self.__read( fd, offset, read_sz )
+            bpc = self.config['bss'].bytes_per_cluster
+            usn = saved[1]
+            for attempt in range( REFRESH_PASSES ):
+                touched = set()
+                for records in read_usn_journal( read_fn, extents, bpc, usn, next_usn ):
+                    count += len( records )
+                    touched.update( apply_usn_records( self.__path_index, records ) )
+                for index in touched:
+                    if self.__path_index.listed( index ) == None:
+                        continue
+                    record = self.__getRecord( index )
+                    if record == None:
+                        self.__path_index.invalidate( index )
+                    else:
+                        self.__path_index.setListed( index, record.lsn() )
+                usn = next_usn
+                # The volume is read again past the cache to see whether the journal moved
+                if not self.config['cache'] == None:
+                    self.config['cache'].clear()
+                journal = self.__getUsnJournal()
+                if not journal == None and journal[0] == journal_id and journal[2] == next_usn:
+                    break
+                if journal == None or usn_resume( ( journal_id, usn ), *journal[:3] ) == None or attempt + 1 == REFRESH_PASSES:
+                    self.config['logger'].debug( "USN journal is still changing, %d directories will be listed again" % len( touched ) )
+                    for index in touched:
+                        self.__path_index.invalidate( index )
+                    break
+                lowest_valid_usn, next_usn, extents = journal[1:]
+            self.config['logger'].info( "Applied %d USN journal records in %.2f seconds" % ( count, time.time() - start ))
+        self.__path_index.set( '$UsnJrnl', ( journal_id, next_usn ) )
+
+    ####################################################################################
+    #  __getUsnJournal: Locates $Extend\$UsnJrnl and returns 
+    #       ( journal id, lowest valid usn, next usn, extents of $J ) or None when the
+    #       journal is not active. extents are ( cluster or None when sparse, length )
+    ####################################################################################
+    def __getUsnJournal( self ):
+        index = self.__lookupChild( 11, '$usnjrnl' ) # $Extend
+        if index == None:
+            return None
+        record = self.__getRecord( index )
+        if record == None:
+            return None
+        records = [ record ]
+        for attribute in record.attributes():
+            if attribute.type() == ATTR_TYPE.ATTRIBUTE_LIST and attribute.non_resident() == 0:
+                attr_list = Attribute_List( attribute.value(), 0, attribute.value_length(), self.config['logger'] )
+                extension = set()
+                for entry in attr_list.get():
+                    if entry.type() == ATTR_TYPE.DATA and not MREF( entry.baseFileReference() ) == index:
+                        extension.add( MREF( entry.baseFileReference() ) )
+                for next_index in sorted( extension ):
+                    next_record = self.__getRecord( next_index )
+                    if not next_record == None:
+                        records.append( next_record )
+
+        usn_max = None
+        parts = []
+        for next_record in records:
+            for attribute in next_record.attributes():
+                if not attribute.type() == ATTR_TYPE.DATA:
+                    continue
+                name = attribute.name()
+                if name == u'$Max' and attribute.non_resident() == 0:
+                    usn_max = parse_usn_max( attribute.value().tobytes() )
+                elif name == u'$J' and not attribute.non_resident() == 0:
+                    parts.append( ( attribute.lowest_vcn(), next_record, attribute ) )
+        if usn_max == None or parts == []:
+            return None
+        parts.sort( key=lambda part: part[0] )
+        if not parts[0][0] == 0:
+            return None
+        extents = []
+        for vcn, next_record, attribute in parts:
+            extents.extend( attribute.runlist().extents() )
+        return usn_max[0], usn_max[1], parts[0][2].data_size(), extents
+
+    ####################################################################################
+    #  __scanMFT: Reads the entire $MFT sequentially, bypassing the block cache, and returns
+    #       the MFTIndex of every record in use. With more than one mft_scan_process and
+    #       an $MFT of more than one chunk, ranges of records are parsed in worker processes.
+    #       Only the ranges of records marked in use by the $MFT bitmap are read.
+    ####################################################################################
+    def __scanMFT( self ):
+        fd = self.config['fd']
+        start = time.time()
+        mft = ( self.config['mft_run_starts'],
+                self.config['mft_run_offsets'],
+                self.config['mft_size'],
+                self.config['bss'].mft_record_size )
+        processes = self.config['mft_scan_processes']
+        ranges = None
+        if not self.config['mft_bitmap'] == None:
+            ranges = list( self.config['mft_bitmap'].ranges( max( CHUNK_SIZE / mft[3], 1 ) ) )
+        mft_index = None
+        if processes > 1 and self.__useWin32 == True and self.config['mft_size'] > CHUNK_SIZE:
+            try:
+                mft_index = MFTIndex()
+                for record, seq_num, names in scan_mft_parallel( open_volume, read_volume, self.config['volume'], *(mft + (processes,)), ranges=ranges ):
+                    mft_index.add( record, seq_num, names )
+            except:
+                self.config['logger'].error( "Parallel MFT scan failed, scanning in one process\n%s" % traceback.format_exc())
+                mft_index = None
+        if mft_index == None:
+            mft_index = MFTIndex()
+            for record, seq_num, names in scan_mft( lambda offset, size: self.__readDisk( fd, offset, size ), *mft, ranges=ranges ):
+                mft_index.add( record, seq_num, names )
+        mft_index.finish()
+        self.config['logger'].info("Indexed %d MFT records in %.2f seconds" % ( len(mft_index), time.time() - start ))
+        return mft_index
 
     ####################################################################################
     #  __process_image: TODO 
@@ -309,102 +580,230 @@ class TScopy( object ):
         pass
 
     ####################################################################################
-    # __search_mft: Iterates through the target files path, populating the table and seq_path
-    #           with each branch of the path as it parses the MFT records. The search ends when 
-    #           it fails to find the next item in the target path or the target is identified.
-    #       table: The pointer to the current location into the mft metadata table stored in memory
+    # __search_mft: Iterates through the target files path, adding each branch of the path
+    #           to the path index and seq_path as it parses the MFT records. The search ends
+    #           when it fails to find the next item in the target path or the target is 
+    #           identified.
+    #       index: MFT record of the last known directory of the path
     #       tmp_path: The target directory path as a list
     #       seq_path: A list of the found target dirctory path with mft sequesnce numbers   
     ####################################################################################
-    def __search_mft( self, table, tmp_path, seq_path ):
+    def __search_mft( self, index, tmp_path, seq_path ):
         for name in tmp_path:
-            index = table['seq_num']
             self.config['logger'].debug('Looking for (%s) MFT_INDEX(%016X)' % (name, index))
-            ret = self.__getChildIndex( index )
-            self.config['logger'].debug("childindex = %r" % len(ret) )
-            tmp_index = index
-            for seq_num in ret:
-                c_index = seq_num & 0xffffffff
-                c_name = ret[seq_num].lower()
-                table['children'][c_name] = { 'name':c_name, 'seq_num':c_index, 'children':{}}
-                if c_name == name.lower():
-                    index = c_index
-                    seq_path.append( (index, c_name ) )
-                    table = table['children'][c_name]
-                    break
-            if tmp_index == index:
+            c_name = name.lower()
+            c_index = self.__lookupChild( index, c_name )
+            if c_index == None:
 #                self.config['logger'].info("%s NOT FOUND" % name)
                 return None, None, None
-        return table, tmp_path, seq_path
+            index = c_index
+            seq_path.append( (index, c_name ) )
+        return index, tmp_path, seq_path
+
     ####################################################################################
     #  __find_last_known_path: Iterates through the target files path and matches with the 
-    #           currently known indexes in the table. Returns as soon as the next path item 
-    #           is not found or the end target has been located.
-    #       table: The pointer to the current location into the mft metadata table stored in memory
+    #           entries in the path index. Returns as soon as the next path item 
+    #           is not found, fails validation or the end target has been located.
+    #           Returns None, None, None when the path index records that the next path
+    #           item does not exist.
+    #       index: MFT record of the directory the path starts from
     #       tmp_path: The target directory path as a list
     #       seq_path: A list of the found target dirctory path with mft sequesnce numbers   
+    #
+    #   A directory whose record LSN changed since it was listed, or that holds an entry 
+    #   whose record has been reused (the sequence number no longer matches), is removed 
+    #   from the index so that __search_mft lists it again. Only that directory is read
+    #   again, the listings of the directories under it are validated as they are reached.
     ####################################################################################
-
-    def __find_last_known_path( self, table, tmp_path, seq_path  ):
+    def __find_last_known_path( self, index, tmp_path, seq_path  ):
         l_path = tmp_path[:]
         for name in l_path:
             name = name.lower()
-            if not name in table['children']:
+            if not self.__isListingValid( index ):
+                break
+            entry = self.__path_index.lookup( index, name )
+            if entry == None:
+                if self.__path_index.isMissing( index, name ):
+                    self.config['logger'].debug("%s is known not to exist in (%d)" % ( name, index ))
+                    return None, None, None
                 break
-            table = table['children'][name]
+            c_index, c_seq = entry
+            record = self.__getRecord( c_index )
+            if record == None or not record.sequence_number() == c_seq:
+                self.config['logger'].debug("Record (%d) of %s has been reused" % ( c_index, name ))
+                self.__path_index.invalidate( index )
+                break
+            index = c_index
             tmp_path = tmp_path[1:]
-            seq_path.append( ( table['seq_num'], name ))
-        return table, tmp_path, seq_path
+            seq_path.append( ( index, name ))
+        return index, tmp_path, seq_path
+
+    ####################################################################################
+    #  __isListingValid: Returns True when the children of the directory index are in
+    #           the path index and the directory record has not changed since they were
+    #           listed. A changed listing is removed from the path index.
+    ####################################################################################
+    def __isListingValid( self, index ):
+        lsn = self.__path_index.listed( index )
+        if lsn == None:
+            return False
+        record = self.__getRecord( index )
+        if record == None or not record.lsn() == lsn:
+            self.config['logger'].debug("Directory (%d) changed since it was listed" % index )
+            self.__path_index.invalidate( index )
+            return False
+        return True
+
+    ####################################################################################
+    #  __getRecord: Returns the MFTRecordView of the MFT record index or None
+    ####################################################################################
+    def __getRecord( self, index ):
+        buf = self.__calcOffset( index )
+        if buf == None or len(buf) == 0:
+            return None
+        try:
+            return MFTRecordView(buf)
+        except OverrunBufferException:
+            return None
+
+    ####################################################################################
+    #  __getChildren: Returns {lowercased name: MFT record} of the directory index
+    ####################################################################################
+    def __getChildren( self, index ):
+        return dict( ( name, record ) for record, name, flags in self.__iterChildren( index ) )
+
+    ####################################################################################
+    #  __iterChildren: Yields ( MFT record, lowercased name, file attributes ) for each 
+    #           child of the directory index from the path index. When the children have
+    #           not been listed or the listing is no longer valid they are yielded as the
+    #           MFT is parsed and saved to the index on the way. The file attributes are
+    #           None for children read from the mft_scan index, which does not keep them.
+    ####################################################################################
+    def __iterChildren( self, index ):
+        if self.__isListingValid( index ):
+            children = self.__path_index.children( index )
+            if not children == None:
+                for name, record, flags in children:
+                    yield record, name, flags
+                return
+        record = self.__getRecord( index )
+        if record == None:
+            raise Exception("Failed to process mft_offset")
+        children = ( ( name.lower(), MREF( mft_reference ), MSEQNO( mft_reference ), flags )
+                     for mft_reference, name, flags in self.__iterChildIndex( index ) )
+        for name, record, seq, flags in self.__path_index.saveChildren( index, children, record.lsn() ):
+            yield record, name, flags
+
+    ####################################################################################
+    #  __lookupChild: Returns the MFT record of the child name of the directory index or
+    #           None. The $I30 index is searched from the root down to the entry, reading
+    #           only the index blocks on the way, and the entry is saved to the path index.
+    #           When mft_scan is set the child is found in the MFTIndex instead. Directories 
+    #           with an attribute list are looked up in the full list of children.
+    ####################################################################################
+    def __lookupChild( self, index, name ):
+        record = self.__getRecord( index )
+        if record == None:
+            raise Exception("Failed to process mft_offset")
+        if not self.config['mft_index'] == None:
+            mft_reference = self.config['mft_index'].find( index, name.decode('utf8') )
+        else:
+            if not record.is_directory():
+                return None
+            root = None
+            runs = []
+            for attribute in record.attributes():
+                if attribute.type() == ATTR_TYPE.ATTRIBUTE_LIST:
+                    return self.__getChildren( index ).get( name )
+                if not attribute.name() == u'$I30':
+                    continue
+                if attribute.type() == ATTR_TYPE.INDEX_ROOT:
+                    root = bytearray( attribute.value().tobytes() )
+                elif attribute.type() == ATTR_TYPE.INDEX_ALLOCATION:
+                    runs = list( attribute.runlist().runs() )
+            if root == None:
+                return self.__getChildren( index ).get( name )
+
+            fd = self.config['fd']
+            bpc = self.config['bss'].bytes_per_cluster
+            block_size = root_node( root )[0]
+            read_fn = lambda offset, size: self.__read( fd, offset, size )
+            mft_reference = find_entry( root, self.__getUpCase(), name.decode('utf8'),
+                                        lambda vcn: read_index_block( read_fn, runs, bpc, block_size, vcn ) )
+        if mft_reference == None:
+            self.__path_index.addMissing( index, name, record.lsn() )
+            return None
+        self.__path_index.addLookup( index, name, MREF( mft_reference ), MSEQNO( mft_reference ), record.lsn() )
+        return MREF( mft_reference )
+
+    ####################################################################################
+    #  __getUpCase: Returns the UpCase table of the volume, reading $UpCase on first use
+    ####################################################################################
+    def __getUpCase( self ):
+        if self.config['upcase'] == None:
+            fd = self.config['fd']
+            bpc = self.config['bss'].bytes_per_cluster
+            record = self.__getRecord( 10 ) # $UpCase
+            if record == None:
+                raise Exception( "TSCOPY", "Failed to read $UpCase" )
+            table = bytearray()
+            for attribute in record.attributes():
+                if attribute.type() == ATTR_TYPE.DATA and attribute.name() == u'':
+                    if attribute.non_resident() == 0:
+                        table = bytearray( attribute.value().tobytes() )
+                        break
+                    for cluster_offset, length in attribute.runlist().runs():
+                        table += self.__read( fd, cluster_offset * bpc, length * bpc )
+                    del table[attribute.data_size():]
+                    break
+            if len( table ) < 0x20000:
+                raise Exception( "TSCOPY", "Failed to read $UpCase" )
+            self.config['upcase'] = UpCase( table )
+            self.config['upcase_tables'][self.config['serial_number']] = self.config['upcase']
+        return self.config['upcase']
 
     ####################################################################################
     #  __copydir: Copies the entire directory. If bRecursive this function calls itself with 
     #           any child drictories
     #       fname: fullpath of the dirctory to copy
     #       index: Sequence number of the MFT record of the parent:
-    #       table: Pointer to the current index in the MFT metadata table
     #       bRecursive:  
     #           True: When the parents child is a directory __copydir is called recursivly
     #           False: Does not copy child directories
     ####################################################################################
-    def __copydir( self, fname, index, table, bRecursive=False):
+    def __copydir( self, fname, index, bRecursive=False):
         self.config['logger'].debug('fname(%r) index(%r)' % (fname, index) )
-        table = self.__copydirfiles( fname, index, table )
+        directories = self.__copydirfiles( fname, index )
 
         if bRecursive == True:
-            for dirs in table['children']:
-                l_table = table['children'][dirs]
-                c_index = l_table['seq_num']
-                buf = self.__calcOffset( c_index )
-                if buf == None or len(buf) == 0:
-                    raise Exception("Failed to process mft_offset")
-                record = MFTRecord(buf, 0, None)
-                if record.is_directory():
-                    self.config['logger'].debug( "Next Directory %r  %r %r" % (c_index, dirs, fname))
-                    self.config['current_file'] = fname[2:]
-                    self.__copydir( os.path.join(fname,dirs), c_index, l_table, bRecursive=True )
+            for dirs, c_index, flags in directories:
+                if flags == None:
+                    buf = self.__calcOffset( c_index )
+                    if buf == None or len(buf) == 0:
+                        raise Exception("Failed to process mft_offset")
+                    if not MFTRecordView(buf).is_directory():
+                        continue
+                self.config['logger'].debug( "Next Directory %r  %r %r" % (c_index, dirs, fname))
+                self.config['current_file'] = fname[2:]
+                self.__copydir( os.path.join(fname,dirs), c_index, bRecursive=True )
         
     ####################################################################################
     # __copydirfiles: Wraps __getFile and copies all the files under the current directory
+    #       as the children are read. Returns ( name, MFT record, file attributes ) of the
+    #       children that may be directories
     #       fname: fullpath of the dirctory to copy
     #       index: Sequence number of the MFT record of the parent:
-    #       table: Pointer to the current index in the MFT metadata table
-    ####################################################################################
-    def __copydirfiles( self, fname, index, table ):
-        self.config['logger'].debug( "copydirfiles \n\tfname:\t%r\n\tindex:\t%r\n\ttable %r" % (fname,index,table))
-        if table['children'] == {}:
-            ret = self.__getChildIndex( index )
-            self.config['logger'].debug( "\tchildren: %r" % len(ret))
-            for seq_num in ret: 
-                c_index = seq_num & 0xffffffff
-                c_name = ret[seq_num].lower()
-                table['children'][c_name] = { 'name':c_name, 'seq_num':c_index, 'children':{}}
-
-                if ret[seq_num].strip() == '' or seq_num == 0:
-                    continue
+    ####################################################################################
+    def __copydirfiles( self, fname, index ):
+        self.config['logger'].debug( "copydirfiles \n\tfname:\t%r\n\tindex:\t%r" % (fname,index))
+        directories = []
+        count = 0
 
         tmp_filename = self.config['current_file']
-        for name in table['children']:
-            seq_num = table['children'][name]['seq_num']
+        for seq_num, name, flags in self.__iterChildren( index ):
+            count += 1
+            if flags == None or flags & FILE_ATTR_HAS_INDX:
+                directories.append( ( name, seq_num, flags ) )
             self.config['logger'].debug("\tCopying %s to %s" % (fname+os.sep+name, self.config['outputbasedir']+tmp_filename+os.sep+name))
 
             self.config['current_file'] = fname[2:]+os.sep+name # strip the drive letter off the front
@@ -412,7 +811,8 @@ class TScopy( object ):
                 self.config['current_file'] = tmp_filename+os.sep+name # strip the drive letter off the front
                 
             self.__getFile( [seq_num&0xffffffff, name] )
-        return table
+        self.config['logger'].debug( "\tchildren: %r" % count)
+        return directories
 
     ####################################################################################
     #  __copyfile: Internal copy function. Used to setup and parse target filename, locate
@@ -437,13 +837,8 @@ class TScopy( object ):
 
             self.__process_image( targetDrive ) # TODO process this to determin correct offsets
 
-            if self.config['ignore_table'] == True:
-                self.__MFT_lookup_table = {driveLetter:{5:{'seq_num':5,'name':'','children':{}}}}
-            elif not driveLetter in self.__MFT_lookup_table.keys():
-                self.__MFT_lookup_table = self.__MFT_lookup_table[driveLetter] = {5:{'seq_num':5,'name':'','children':{}}}
 #            self.config['logger'].debug( 'Target Drive %s' % driveLetter)
         else:
-            self.__MFT_lookup_table = {"c":{5:{'seq_num':5,'name':'','children':{}}}}
             targetDrive = mft_filename
             driveLetter = "c"
             self.config['logger'].debug( 'Processing the %s MFT file' % targetDrive )
@@ -451,21 +846,46 @@ class TScopy( object ):
         self.config['driveLetter'] = driveLetter
         fd = self.__open( targetDrive )
         self.config['fd'] = fd
+        self.config['volume'] = targetDrive
+        self.config['cache'] = None
         buf = self.__read( fd, 0, 0x200 ) #        buf = win32file.ReadFile( fd, 0x200)[1]
         self.config['bss'] = BootSector( buf, 0, self.config['logger'] ) 
+        serial_number = self.config['bss'].serial_number()
+        self.config['serial_number'] = serial_number
+        self.config['upcase'] = self.config['upcase_tables'].get( serial_number )
+        if self.__useWin32 == True:
+            self.__path_index = self.__getPathIndex( serial_number )
+        else:
+            self.__path_index = PathIndex( ':memory:' )
+        if self.config['cache_size'] > 0:
+            self.config['cache'] = BlockCache( lambda offset, read_sz: self.__readDisk( fd, offset, read_sz ),
+                                               self.config['bss'].bytes_per_cluster,
+                                               self.config['cache_size'] )
         self.config['mft_dataruns'] = self.__getMFT( 0)
         self.__GenRefArray()
+        self.config['mft_bitmap'] = self.__getMFTBitmap()
+        self.config['mft_index'] = None
+        if self.__useWin32 == True and self.config['ignore_table'] == False and \
+           self.config['usn_journal'] == True and not serial_number in self.__usn_refreshed:
+            self.__usn_refreshed.add( serial_number )
+            try:
+                self.__refreshPathIndex()
+            except:
+                self.config['logger'].error( "Failed to read the USN journal\n%s" % traceback.format_exc())
+        if self.config['mft_scan'] == True:
+            if not serial_number in self.config['mft_indexes']:
+                self.config['mft_indexes'][serial_number] = self.__scanMFT()
+            self.config['mft_index'] = self.config['mft_indexes'][serial_number]
 
         fname = filename 
         index = 5
         
         try:
-            # Find the last known directory in the MFT_lookup_table
+            # Find the last known directory in the path index
             seq_path = [(index,None)]
             tmp_path = fname[3:].split(os.sep)
-            table = self.__MFT_lookup_table[driveLetter][5]
 
-            expandedWildCards = self.__process_wildcards( filename, table )
+            expandedWildCards = self.__process_wildcards( filename )
             if expandedWildCards == False:
                 cp_files = [ tmp_path ]
             else:
@@ -476,10 +896,10 @@ class TScopy( object ):
                 self.config['current_file'] = os.sep.join(cp_file) # strip the drive letter off the front
                 l_fname = fname[:3] + self.config['current_file']
                 self.config['logger'].info("Copying %s to %s" % (l_fname, self.config['outputbasedir']+self.config['current_file']))
-                table, tmp_path, seq_path = self.__get_file_mft_seqid( cp_file )
+                index, tmp_path, seq_path = self.__get_file_mft_seqid( cp_file )
                 
                 # Index was not located exit (error message already logged)
-                if table == None:
+                if index == None:
                     return
 
                 # Check the mft structure if this is a directory
@@ -487,36 +907,33 @@ class TScopy( object ):
                 buf = self.__calcOffset( index )
                 if buf == None or len(buf) == 0:
                     raise Exception("Failed to process mft_offset")
-                record = MFTRecord(buf, 0, None)
+                record = MFTRecordView(buf)
                 if record.is_directory():
-                    self.__copydir( l_fname, index, table, bRecursive=bRecursive )
+                    self.__copydir( l_fname, index, bRecursive=bRecursive )
                 else:
                     self.__getFile( seq_path[-1] )
         except:
             self.config['logger'].error(traceback.format_exc())
         finally:
+            pool = self.__copy_pools.get( self.config['volume'] )
+            if not pool == None:
+                pool.wait()
+            cache = self.config['cache']
+            if not cache == None:
+                self.config['logger'].debug("Read cache: hits(%d) misses(%d) blocks(%d)" % ( cache.hits, cache.misses, len(cache)))
             if self.config['ignore_table'] == False:
-                self.__saveLookuptable( self.__MFT_lookup_table)                
+                self.__path_index.commit()
 
     ####################################################################################
-    # __isSplitMFT: Determines if the MFT record is split
-    ####################################################################################
-    def __isSplitMFT( self, array, target_seq_num ):
-        for ind in array:
-            i = array[ind]
-            if not '?' in i:
-                continue
-            ind = i.index('?')
-            testRef = i[0:ind]   
-            if int(testRef) == target_seq_num:
-                return ind 
-        return None
-
-    ####################################################################################
-    #  __GetChildIndex: Parses the MFT records to find all children of the current sequence ID
+    #  __iterChildIndex: Parses the MFT records to find all children of the current sequence ID.
+    #       Yields ( mft reference, filename, file attributes ) as each index block is read
     #       index: Sequence ID or seq_num of the current MFT record to extract and parse
     ####################################################################################
-    def __getChildIndex( self, index  ):
+    def __iterChildIndex( self, index  ):
+        if not self.config['mft_index'] == None:
+            for mft_reference, name in self.config['mft_index'].children( index ).iteritems():
+                yield mft_reference, name, None
+            return
         fd = self.config['fd']
         bss = self.config['bss']
         bpc = bss.bytes_per_cluster
@@ -524,19 +941,18 @@ class TScopy( object ):
         buf = self.__calcOffset( index )
         if buf == None or len(buf) == 0:
             raise Exception("Failed to process mft_offset")
-        record = MFTRecord(buf, 0, None)
+        record = MFTRecordView(buf)
         if not record.is_directory():
-            return []
-        ret  = {}
+            return
+        allocation = None
+        bitmap = None
+        block_size = bss.index_record_size
         for attribute in record.attributes():
             if attribute.type() == ATTR_TYPE.INDEX_ROOT:
-                for entry in INDEX_ROOT(attribute.value(), 0).index().entries():
-                    refNum = entry.header().mft_reference() & 0xfffffffff
-                    if refNum in ret:
-                        if "~" in ret[refNum]:
-                            ret[refNum] = entry.filename_information().filename()  
-                    else:
-                        ret[refNum] = entry.filename_information().filename()  
+                root = bytearray( attribute.value().tobytes() )
+                block_size, offset, end = root_node( root )
+                for child in index_children( root, offset, end ):
+                    yield child
             elif attribute.type() == ATTR_TYPE.ATTRIBUTE_LIST:
                 self.config['logger'].debug("ATTRIBUTE_LIST HAS BEEN FOUND 0x(%08x)!!!!" % index )
                 attr_list = Attribute_List(attribute.value(), 0, attribute.value_length(), self.config['logger'] )
@@ -552,41 +968,28 @@ class TScopy( object ):
                         self.config['logger'].debug(hex_dump(attribute.value()[:attribute.value_length()]))
 #                        raise Exception("Attribute_list failed to parse.")
                         continue
-                    rec_children = self. __getChildIndex( next_index )
-                    self.config['logger'].debug("ATTRIBUTE_LIST index(%d) children (%r) " % (next_index, rec_children) )
-                    ret.update( rec_children )
+                    self.config['logger'].debug("ATTRIBUTE_LIST index(%d) children" % next_index )
+                    for child in self.__iterChildIndex( next_index ):
+                        yield child
             elif attribute.type() == ATTR_TYPE.INDEX_ALLOCATION:
-                for cluster_offset, length  in attribute.runlist().runs():
-                    offset=cluster_offset*bpc
-                    buf = self.__read( fd, offset, length*bpc)
-                    for cnt in range(length):
-                        idx_buf = buf[cnt*bpc:(cnt+2)*bpc]
-                        ind = INDX( idx_buf, 0 )
-                        idx_buf = ind.update_seq_arr( idx_buf )
-                        entry_offset = ind.index_entries_offset()+0x18 
-                        i = 0 
-                        last_i = i
-                        while i < ind.index_entries_sz() :
-                            try:
-                                entry  = INDX_ENTRY( idx_buf, entry_offset )
-                                refNum = entry.mft_recordnum() & 0xfffffffff
-                                if refNum in ret:
-                                    if "~" in ret[refNum]:
-                                        ret[refNum] = entry.filename().replace('\x00','')
-                                else:
-                                    ret[refNum] = entry.filename().replace('\x00','')
-                            except   INDXException:
-                                break
-                            except:
-                                self.config['logger'].error(traceback.format_exc())
-                                self.config['logger'].debug( 'len(idx_buf (%03x) entry_offset(%03x)' % ( len(idx_buf), entry_offset))
-                                pass
-                            entry_offset += entry.entry_sz()
-
-                            i += entry.entry_sz()
-                            if entry.entry_sz() == 0:
-                                break
-        return ret
+                allocation = ( list( attribute.runlist().runs() ), attribute.data_size() )
+            elif attribute.type() == ATTR_TYPE.BITMAP and attribute.name() == u'$I30':
+                if attribute.non_resident() == 0:
+                    bitmap = bytearray( attribute.value().tobytes() )
+                else:
+                    bitmap = bytearray()
+                    for cluster_offset, length in attribute.runlist().runs():
+                        bitmap += self.__read( fd, cluster_offset * bpc, length * bpc )
+                    del bitmap[attribute.data_size():]
+
+        # The $BITMAP follows the $INDEX_ALLOCATION, so the blocks are read once both are known
+        if not allocation == None:
+            runs, data_size = allocation
+            read_fn = lambda offset, read_sz: self.__read( fd, offset, read_sz )
+            for block in iter_index_blocks( read_fn, runs, bpc, block_size, data_size, bitmap ):
+                offset, end = block_node( block )
+                for child in index_children( block, offset, end ):
+                    yield child
 
     ####################################################################################
     # __calcOffset: Calculates the offset into the drive to locat the specific data 
@@ -596,62 +999,21 @@ class TScopy( object ):
     def __calcOffset( self, target_seq_num ):
         fd = self.config['fd']
         bss = self.config['bss']
-        mft_vcn = self.config['mft_dataruns']
         image_offset = 0 # TODO: Change this when finished processing the image
         array = self.config['split_mft_rec']
 
         # Handle in the case that the object is split accross two dataruns
-        split = self.__isSplitMFT( array, target_seq_num )
-        if not split == None:
+        record = array.read( lambda offset, size: self.__read( fd, offset + image_offset, size ), target_seq_num )
+        if not record == None:
 #            self.config['logger'].debug( 'calcOffset: a split record was detected' )
-            item = array[split]
-            ind = item.index('?')
-            testRef = item[0:ind]   
-            if not int(testRef) == target_seq_num:
-#                self.config['logger'].debug("Error: The ref in the array did not match target ref.")
-                return None
-            
-            srecord3 = item[ind+1:]
-            srecordArr = srecord3.split('|')
-            if not len( srecordArr ) == 3:
-#                self.config['logger'].debug("Error: Array contained more elements than expected: %d" % len( srecordArr ))
-                return None
-
-            record = ""
-            for i in srecordArr:
-                if not ',' in i: 
-#                    self.config['logger'].debug('Split:: Could not find ","')
-                    continue
-                ind = i.index(',')
-                srOffset = i[:ind]
-                srSize   = i[ind+1:]
-#                win32file.SetFilePointer( fd, srOffset + image_offset, win32file.FILE_BEGIN)
-#                record += win32file.ReadFile( fd, srSize)[1]
-                record += self.__read( fd, srOffset + image_offset, srSize )
             return record
         else:
-            counter = 0
-            offset = 0
-            recordsdivisor = bss.mft_record_size/512
-            for indx in mft_vcn: 
-                current_cluster = mft_vcn[indx][1]
-                offset = mft_vcn[indx][0]
-                records_in_currentrun = (current_cluster * bss.sectors_per_cluster() ) / recordsdivisor 
-                counter += records_in_currentrun 
-                if counter > target_seq_num:
-                    break
-            tryat = counter - records_in_currentrun
-            records_per_cluster = bss.sectors_per_cluster() / recordsdivisor
-            final = 0
-            counter2 = 0
-            record_jmp = 0
-            while final < target_seq_num:
-                record_jmp += records_per_cluster
-                counter2 += 1
-                final = tryat + record_jmp
-            records_to_much = final - target_seq_num
-
-            mft_offset = image_offset + offset * bss.bytes_per_cluster + ( counter2 * bss.bytes_per_cluster ) - ( records_to_much * bss.mft_record_size )
+            mft_pos = target_seq_num * bss.mft_record_size
+            if mft_pos >= self.config['mft_size']:
+                return None
+            run_starts = self.config['mft_run_starts']
+            run = bisect_right( run_starts, mft_pos ) - 1
+            mft_offset = image_offset + self.config['mft_run_offsets'][run] + mft_pos - run_starts[run]
 #            win32file.SetFilePointer( fd, mft_offset, win32file.FILE_BEGIN)
 #            return win32file.ReadFile( fd, bss.mft_record_size )[1]
             if self.__useWin32 == False:
@@ -669,65 +1031,226 @@ class TScopy( object ):
         if self.__useWin32 == False:
             return
 
-        fd = self.config['fd']
-        bpc = self.config['bss'].bytes_per_cluster
-
         buf = self.__calcOffset( mft_file_object[0] )
 
         if buf == None:
             raise Exception("Failed to process mft_offset")
         try:
-            record = MFTRecord(buf, 0, None)
-            for attribute in record.attributes():
-                if attribute.type() == ATTR_TYPE.DATA:
-                    fullpath = self.config['outputbasedir'] + self.config['current_file']
-#                    self.config['logger'].debug( "GetFile:: fullpath %s" % fullpath )
-#                    self.config['logger'].debug( "GetFile:: attributes %s" % attribute.get_all_string())
-                    path = '\\'.join( fullpath.split('\\')[:-1])
-                    if not os.path.isdir( path ): 
-                        os.makedirs( path )
-                    fd2 = open( fullpath,'wb' )
-                    
-                    try:
-#                        self.config['logger'].debug("non_resident %r" % attribute.non_resident() ) 
-                        if attribute.non_resident() == 0:
-                            fd2.write( attribute.value()) 
-                        else:
-                            cnt = 0
-                            padd = False
-                            for cluster_offset, length in attribute.runlist().runs():
-#                                self.config['logger'].debug("GetFile:: cluster_offset( %08x ) lenght( %08x )  " % ( cluster_offset, length))
-                                read_sz = length * bpc 
-#                                self.config['logger'].debug("readsize %08x cnt %08x init_sz %08x" % ( read_sz, cnt, attribute.initialized_size()))
-                                if read_sz + cnt > attribute.initialized_size():
-                                    read_sz = attribute.initialized_size() - cnt
-                                    padd = True
-                                if (read_sz % 0x1000) > 0:
-                                    read_sz += 0x1000 - (read_sz%0x1000)
-                                offset=cluster_offset * bpc
-
-#                                self.config['logger'].debug("readsize %08x cnt %08x init_sz %08x" % ( read_sz, cnt, attribute.initialized_size()))
-                                buf = self.__read( fd, offset, read_sz )
-
-                                if attribute.data_size() < cnt + read_sz:
-                                    read_sz = attribute.data_size()-cnt
-                                cnt += read_sz
-                                        
-                                fd2.write(buf[:read_sz])
-                                if padd == True:
-                                    padd_sz  = attribute.data_size() - attribute.initialized_size() 
-                                    fd2.write( '\x00' * padd_sz )
-                                    cnt += padd_sz
-                                if cnt > attribute.initialized_size():
-#                                    self.config['logger'].debug("readsize %08x cnt %08x init_sz %08x" % ( read_sz, cnt, attribute.initialized_size()))
-                                    break
-                    except:
-#                        self.config['logger'].error('Failed to get file %s' % (mft_file_object[1] ) )
-                        self.config['logger'].error('Failed to get file %s\n%s' % (mft_file_object[1], traceback.format_exc() ))
-                    finally:
-                        fd2.close()
+            record = MFTRecordView(buf)
+            attributes = [ attribute for attribute in record.attributes() if attribute.type() == ATTR_TYPE.DATA ]
         except:
             self.config['logger'].error('Failed to get file %s\n%s' % (mft_file_object[1], traceback.format_exc() ))
+            return
+        fullpath = self.config['outputbasedir'] + self.config['current_file']
+        if self.config['disk_order'] == True:
+            self.__planFile( fullpath, attributes, mft_file_object[1] )
+            return
+        pool = self.__getCopyPool()
+        if pool == None:
+            self.__writeFile( self.config['fd'], fullpath, attributes, mft_file_object[1] )
+        else:
+            pool.submit( self.__writeFile, fullpath, attributes, mft_file_object[1] )
+
+    ####################################################################################
+    # __writeFile: Copies the $DATA attributes of a file to fullpath
+    #       fd: Handle of the volume to read the data with
+    #       name: Name of the file for the error messages
+    ####################################################################################
+    def __writeFile( self, fd, fullpath, attributes, name ):
+        for attribute in attributes:
+#            self.config['logger'].debug( "GetFile:: fullpath %s" % fullpath )
+            try:
+                fd2 = self.__createFile( fullpath )
+            except:
+                self.config['logger'].error('Failed to get file %s\n%s' % (name, traceback.format_exc() ))
+                continue
+
+            try:
+                if attribute.non_resident() == 0:
+                    fd2.write( attribute.value()) 
+                elif self.config['extent_jobs'] > 1 and attribute.data_size() > self.config['chunk_size']:
+                    fd2.truncate( attribute.data_size() )
+                    self.__copyExtents( fullpath, attribute )
+                else:
+                    self.__copyData( fd, fd2, attribute )
+            except:
+                self.config['logger'].error('Failed to get file %s\n%s' % (name, traceback.format_exc() ))
+            finally:
+                fd2.close()
+
+    ####################################################################################
+    # __planFile: Creates the files of the $DATA attributes of a file with their full size
+    #       and adds their extents to the ExtentPlan of the volume, to be read by close()
+    #       name: Name of the file for the error messages
+    ####################################################################################
+    def __planFile( self, fullpath, attributes, name ):
+        volume = self.config['volume']
+        if not volume in self.__plans:
+            self.__plans[volume] = ExtentPlan()
+        plan = self.__plans[volume]
+        for attribute in attributes:
+            try:
+                fd2 = self.__createFile( fullpath )
+            except:
+                self.config['logger'].error('Failed to get file %s\n%s' % (name, traceback.format_exc() ))
+                continue
+
+            try:
+                number = plan.add_file( fullpath )
+                if attribute.non_resident() == 0:
+                    fd2.write( attribute.value()) 
+                else:
+                    fd2.truncate( attribute.data_size() )
+                    for file_offset, offset, size in self.__dataExtents( attribute ):
+                        if not offset == None:
+                            plan.add_extent( number, file_offset, offset, size )
+            except:
+                self.config['logger'].error('Failed to get file %s\n%s' % (name, traceback.format_exc() ))
+            finally:
+                fd2.close()
+
+    ####################################################################################
+    # __copyPlan: Reads the extents of an ExtentPlan in disk order from volume and writes
+    #       each at its offset in its file. The data is read up to queue_depth chunks
+    #       ahead of the writes. A file that fails to be read or written is logged once
+    #       and its other extents are skipped.
+    ####################################################################################
+    def __copyPlan( self, volume, plan ):
+        self.config['logger'].debug( "Copying %d extents of %s in disk order" % ( len( plan ), volume ) )
+        failed = set()
+        fd = open_volume( volume )
+        files = OutputFiles()
+        chunks = self.__readPlan( fd, plan, failed )
+        if self.config['queue_depth'] > 0:
+            chunks = read_ahead( chunks, self.config['queue_depth'] )
+        try:
+            for number, file_offset, buf in chunks:
+                if number in failed:
+                    continue
+                try:
+                    files.write( plan.path( number ), file_offset, buf )
+                except:
+                    failed.add( number )
+                    self.config['logger'].error('Failed to get file %s\n%s' % (plan.path( number ), traceback.format_exc() ))
+        finally:
+            chunks.close()
+            files.close()
+            win32file.CloseHandle( fd )
+
+    ####################################################################################
+    # __readPlan: Yields ( file number, file offset, data ) for the extents of plan in 
+    #       disk order. Files in failed are skipped and a file that fails to be read is 
+    #       added to failed
+    ####################################################################################
+    def __readPlan( self, fd, plan, failed ):
+        for offset, number, file_offset, size in plan.extents():
+            if number in failed:
+                continue
+            try:
+                buf = self.__readExtent( fd, offset, size )
+            except:
+                failed.add( number )
+                self.config['logger'].error('Failed to get file %s\n%s' % (plan.path( number ), traceback.format_exc() ))
+                continue
+            yield number, file_offset, buf
+
+    ####################################################################################
+    # __createFile: Opens fullpath for writing, creating its directory when needed
+    ####################################################################################
+    def __createFile( self, fullpath ):
+        path = '\\'.join( fullpath.split('\\')[:-1])
+        if not os.path.isdir( path ): 
+            try:
+                os.makedirs( path )
+            except OSError:
+                # Created by another copy thread in the meantime
+                if not os.path.isdir( path ):
+                    raise
+        return open( fullpath,'wb' )
+
+    ####################################################################################
+    # __getCopyPool: Returns the CopyPool of the current volume, or None when jobs is 1
+    ####################################################################################
+    def __getCopyPool( self ):
+        if self.config['jobs'] <= 1:
+            return None
+        volume = self.config['volume']
+        if not volume in self.__copy_pools:
+            self.__copy_pools[volume] = CopyPool( lambda: open_volume( volume ), win32file.CloseHandle, self.config['jobs'] )
+        return self.__copy_pools[volume]
+
+    ####################################################################################
+    # __copyData: Copies the data of a non resident attribute from the volume handle fd to
+    #       the file fd2. The data is
+    #       read in a separate thread, up to queue_depth chunks ahead of the writes, so
+    #       the volume is read while the copy is written. A queue_depth of 0 reads and
+    #       writes in turn.
+    #   The reader is stopped before returning, also when a write fails, so that it no
+    #   longer uses fd once the caller reads from it again.
+    ####################################################################################
+    def __copyData( self, fd, fd2, attribute ):
+        chunks = self.__readData( fd, attribute )
+        if self.config['queue_depth'] > 0:
+            chunks = read_ahead( chunks, self.config['queue_depth'] )
+        try:
+            for chunk in chunks:
+                fd2.write( chunk )
+        finally:
+            chunks.close()
+
+    ####################################################################################
+    # __copyExtents: Copies the data of a non resident attribute to fullpath, which already
+    #       has the size of the data, with extent_jobs threads each reading and writing
+    #       chunks of the extents. The ranges that are zero are not written.
+    ####################################################################################
+    def __copyExtents( self, fullpath, attribute ):
+        volume = self.config['volume']
+        extents = [ extent for extent in self.__dataExtents( attribute ) if not extent[1] == None ]
+        copy_extents( extents, fullpath, lambda: open_volume( volume ), win32file.CloseHandle,
+                      self.__readExtent, self.config['extent_jobs'] )
+
+    ####################################################################################
+    # __readData: Yields the data of a non resident attribute chunk_size bytes at a time,
+    #       so that the memory used does not depend on the size of the file.
+    ####################################################################################
+    def __readData( self, fd, attribute ):
+        for file_offset, offset, size in self.__dataExtents( attribute ):
+            if offset == None:
+                for chunk in self.__zeros( size ):
+                    yield chunk
+            else:
+                yield self.__readExtent( fd, offset, size )
+
+    ####################################################################################
+    # __dataExtents: Yields ( file offset, volume offset, size ) for the data of a non
+    #       resident attribute, in pieces of at most chunk_size bytes. The volume offset
+    #       is None for sparse runs and the data past the initialized size, which are zero
+    ####################################################################################
+    def __dataExtents( self, attribute ):
+        return data_extents( attribute.runlist().extents(), self.config['bss'].bytes_per_cluster,
+                             attribute.data_size(), attribute.initialized_size(), self.config['chunk_size'] )
+
+    ####################################################################################
+    # __readExtent: Returns size bytes of the volume at offset
+    #   Reads are rounded up to 0x1000 bytes, the volume is read in whole sectors.
+    ####################################################################################
+    def __readExtent( self, fd, offset, size ):
+        read_sz = size
+        if (read_sz % 0x1000) > 0:
+            read_sz += 0x1000 - (read_sz%0x1000)
+        buf = self.__readDisk( fd, offset, read_sz )
+        if len( buf ) < size:
+            raise Exception( "TSCOPY", "Short read at offset(%08x) size(%08x)" % ( offset, read_sz ) )
+        return memoryview( buf )[:size]
+
+    ####################################################################################
+    # __zeros: Yields size zero bytes, at most chunk_size at a time
+    ####################################################################################
+    def __zeros( self, size ):
+        zeros = '\x00' * min( self.config['chunk_size'], max( size, 0 ) )
+        while size > 0:
+            yield zeros[:size]
+            size -= len( zeros )
 
     ####################################################################################
     # __open: Wrapper around win32file createfile. 
@@ -751,18 +1274,30 @@ class TScopy( object ):
         return fd
 
     ####################################################################################
-    # __read: Wrapper around win32file set file pointer and read contents. 
-    #       TODO remove test code.
+    # __read: Reads from the volume through the block cache when one is set up for fd.
+    #       Returns a bytearray, so the parsers can fix up records in place
+    #       without copying them again.
     ####################################################################################
     def __read( self, fd, offset, read_sz ):
-        buf = ""
+        cache = self.config['cache']
+        if not cache == None and fd is self.config['fd']:
+            return cache.read( offset, read_sz )
+        return self.__readDisk( fd, offset, read_sz )
+
+    ####################################################################################
+    # __readDisk: Wrapper around win32file set file pointer and read contents. 
+    #       TODO remove test code.
+    ####################################################################################
+    def __readDisk( self, fd, offset, read_sz ):
+        buf = bytearray()
         try:
             if self.__useWin32 == False:
                 fd.seek( offset, 0)
-                buf = fd.read( read_sz )
+                buf = bytearray( read_sz )
+                del buf[fd.readinto( buf ):]
             else:
                 win32file.SetFilePointer( fd, offset, win32file.FILE_BEGIN)
-                buf = win32file.ReadFile( fd, read_sz)[1]
+                buf = bytearray( win32file.ReadFile( fd, read_sz)[1] )
         except:
             self.config['logger'].error( traceback.format_exc())
             self.config['logger'].debug("offset(%08x), readsize (%08x) fd (%08x)" % ( offset, read_sz, fd))
@@ -775,7 +1310,7 @@ class TScopy( object ):
     ####################################################################################
     def __get_wildcard_children( self, path ):
         copy_list = []
-        table, x, seq_path = self.__get_file_mft_seqid( path[0] )
+        index, x, seq_path = self.__get_file_mft_seqid( path[0] )
         if seq_path == None:
             return copy_list
         # Test if the last value seq_path[-1] is the directory we are looking for
@@ -784,11 +1319,9 @@ class TScopy( object ):
                 copy_list.append( path[0] )
 
         # get children of found path and find all that match wildcard.
-        ret = self.__getChildIndex( seq_path[-1][0] )
-        for x in ret:
-            if path[1] == None:
-                    break
-            l_name = ret[x].lower()
+        if path[1] == None:
+            return copy_list
+        for record, l_name, flags in self.__iterChildren( seq_path[-1][0] ):
             l_reg = re.escape(path[1]).replace('\\*', '.*')
             if not l_reg[-1] == '*':
                 l_reg += '$'
@@ -798,26 +1331,26 @@ class TScopy( object ):
         return copy_list
 
     ####################################################################################
-    # __get_file_mft_seqid: Wrapper used to search for the file in the current memory mft 
-    #           metadata list then process the rest of the path from parsing the MFT
+    # __get_file_mft_seqid: Wrapper used to search for the file in the path index 
+    #           then process the rest of the path from parsing the MFT
     #       tmp_path: List of the source path
     ####################################################################################
     def __get_file_mft_seqid( self, tmp_path ):
         index = 5
         seq_path = [(index,None)]
-        table = self.__MFT_lookup_table[self.config['driveLetter']][index]
-        table, tmp_path, seq_path = self.__find_last_known_path( table, tmp_path, seq_path  )
-        table, tmp_path, seq_path = self.__search_mft( table, tmp_path, seq_path )
-        return table, tmp_path, seq_path
+        index, tmp_path, seq_path = self.__find_last_known_path( index, tmp_path, seq_path  )
+        if index == None:
+            return None, None, None
+        index, tmp_path, seq_path = self.__search_mft( index, tmp_path, seq_path )
+        return index, tmp_path, seq_path
 
     ####################################################################################
     # __process_wildcards: Called when a wildcard was detected in the source filename.
     #           Parses the wildcards and breaks up into sections then the paths are expanded
     #           and each matching record is copied.
     #       filename: Filename containing the wildcards
-    #       table: Pointer to the root of the mft Metadata table
     ####################################################################################
-    def  __process_wildcards( self, filename, table ):
+    def  __process_wildcards( self, filename ):
         filename = filename.lower()
         if not '*' in filename:
             return False
@@ -869,6 +1402,8 @@ class TScopy( object ):
     #                  Example: dest_filename = 'c:\test\' and copying "c:\windows\somefile" 
     #                           the output file will have the path of "c:\test\windows\somefile"
     #   bRecursive: Tells the copy to recursivly copy a directory. Only works with directories
+    #   With disk_order set the files are created with their size but hold no data until 
+    #   flush() or close() is called
     ####################################################################################
     def copy( self, src_filename, dest_filename, bRecursive=False ):
         self.__useWin32 = True
@@ -884,6 +1419,32 @@ class TScopy( object ):
         src_filename = [ src_filename ]
         for filename in src_filename: 
             self.__copyfile( filename, bRecursive=bRecursive )
+        if self.__plans:
+            self.config['logger'].info( "The data of the files found is written in disk order by flush() or close()" )
+
+    ####################################################################################
+    # flush: Writes the data of the files gathered by copy() with disk_order, reading 
+    #       each volume in disk order. Does nothing when disk_order is not set
+    ####################################################################################
+    def flush( self ):
+        while self.__plans:
+            volume, plan = self.__plans.popitem()
+            try:
+                self.__copyPlan( volume, plan )
+            except:
+                self.config['logger'].error( traceback.format_exc() )
+
+    ####################################################################################
+    # close: Writes the data of the files gathered with disk_order, compacts and closes 
+    #       the saved path indexes and stops the copy threads. Call once all copies are done
+    ####################################################################################
+    def close( self ):
+        self.flush()
+        for volume in self.__copy_pools:
+            self.__copy_pools[volume].close()
+        self.__copy_pools.clear()
+        for serial_number in self.__path_indexes:
+            self.__path_indexes[serial_number].close()
 
 
 
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+import struct
+import unittest
+
+from TScopy.BinaryParser import Block, Nestable, Layout, ParseException, OverrunBufferException, read_byte
+
+
+####################################################################################
+#  Item: A nested block of a word value
+####################################################################################
+class Item( Block, Nestable ):
+    FIELDS = ( ( "word", "value", 0x0 ), )
+
+    def __init__( self, buf, offset, parent ):
+        super( Item, self ).__init__( buf, offset )
+
+    @staticmethod
+    def structure_size( buf, offset, parent ):
+        return 2
+
+
+####################################################################################
+#  Header: A block with fields of every kind. The fields of a fixed offset and size
+#       are packed into the layout's struct, big, name, data and item are read one at
+#       a time
+####################################################################################
+class Header( Block ):
+    FIELDS = (
+        ( "dword", "magic", 0x0 ),
+        ( "word", "count" ),
+        ( "byte", "kind" ),
+        ( "int8", "delta" ),
+        ( "qword", "size" ),
+        ( "int32", "position" ),
+        ( "int16", "step" ),
+        ( "int64", "total" ),
+        ( "filetime", "created" ),
+        ( "binary", "tag", 0x28, 4 ),
+        ( "string", "label", 0x2c, 4 ),
+        ( "double", "ratio", 0x30 ),
+        ( "float", "scale", 0x38 ),
+        ( "dword_be", "big", 0x3c ),
+        ( "wstring", "name", 0x40, 4 ),
+        ( "word", "data_offset", 0x48 ),
+        ( "word", "data_length" ),
+        ( "view", "data", lambda self: self.data_offset(), lambda self: self.data_length() ),
+        ( Item, "item", lambda self: self.data_offset() ),
+    )
+
+    def __init__( self, buf, offset ):
+        super( Header, self ).__init__( buf, offset )
+
+
+####################################################################################
+#  Extended: Header with a field of its own and count moved
+####################################################################################
+class Extended( Header ):
+    FIELDS = (
+        ( "dword", "flags", 0x50 ),
+        ( "word", "count", 0x54 ),
+    )
+
+
+class Plain( Header ):
+    pass
+
+
+PACKED = [ "magic", "count", "kind", "delta", "size", "position", "step", "total", "created", "tag", "label",
+           "ratio", "scale", "data_offset", "data_length" ]
+
+
+####################################################################################
+#  header: Returns a Header buffer at offset of a longer buffer, with data at 0x60
+####################################################################################
+def header( offset=0 ):
+    buf = bytearray( offset + 0x68 )
+    struct.pack_into( "<IHBbQihqQ2x4s4sdf", buf, offset, 0x454c4946, 3, 0x80, -2, 1 << 40, -100, -7, -(1 << 50),
+                      130000000000000000, "TAG1", "lbl2", 0.25, 1.5 )
+    struct.pack_into( ">I", buf, offset + 0x3c, 0x01020304 )
+    buf[offset + 0x40:offset + 0x48] = u"name".encode( "utf-16le" )
+    struct.pack_into( "<HH4xIH", buf, offset + 0x48, 0x60, 6, 0x11, 0x22 )
+    struct.pack_into( "<HHH", buf, offset + 0x60, 0x1234, 0x5678, 0x9abc )
+    return str( buf )
+
+
+####################################################################################
+#  Layout and the accessors compiled from FIELDS
+####################################################################################
+class LayoutTest( unittest.TestCase ):
+    def test_packed_fields( self ):
+        self.assertEqual( sorted( Header._layout._packed ), sorted( PACKED ) )
+        self.assertEqual( Header._layout.struct.size, 0x4c )
+
+    def test_packed_fields_match_the_field_unpackers( self ):
+        for offset in ( 0, 0x10 ):
+            block = Header( header( offset ), offset )
+            for type_, name, field_offset, length in Header._layout.fields:
+                if not isinstance( field_offset, int ) or not isinstance( type_, str ):
+                    continue
+                if length == None:
+                    expected = getattr( block, "unpack_" + type_ )( field_offset )
+                else:
+                    expected = getattr( block, "unpack_" + type_ )( field_offset, length )
+                self.assertEqual( getattr( block, name )(), expected )
+
+    def test_values( self ):
+        block = Header( bytearray( header() ), 0 )
+        self.assertEqual( ( block.magic(), block.count(), block.kind(), block.delta() ), ( 0x454c4946, 3, 0x80, -2 ) )
+        self.assertEqual( ( block.size(), block.position(), block.step(), block.total() ), ( 1 << 40, -100, -7, -(1 << 50) ) )
+        self.assertEqual( block.created().year, 2012 )
+        self.assertEqual( ( block.tag(), block.label(), block.ratio(), block.scale() ), ( "TAG1", "lbl2", 0.25, 1.5 ) )
+        self.assertEqual( ( block.big(), block.name() ), ( 0x01020304, u"name" ) )
+
+    def test_fields_are_unpacked_once( self ):
+        block = Header( header(), 0 )
+        self.assertEqual( block._values, None )
+        block.count()
+        values = block._values
+        self.assertEqual( len( values ), len( PACKED ) )
+        block.magic()
+        self.assertTrue( block._values is values )
+
+    def test_dynamic_fields( self ):
+        buf = bytearray( header( 8 ) )
+        block = Header( buf, 8 )
+        self.assertTrue( isinstance( block.data(), memoryview ) )
+        self.assertEqual( block.data().tobytes(), struct.pack( "<HHH", 0x1234, 0x5678, 0x9abc ) )
+        self.assertEqual( block.item().value(), 0x1234 )
+        self.assertEqual( block.item().offset(), 8 + 0x60 )
+        # The view is over the buffer, not a copy
+        buf[8 + 0x60] = 0xff
+        self.assertEqual( block.data()[0], "\xff" )
+        self.assertEqual( Header._layout.offsets.get( "data" ), None )
+
+    def test_implicit_offset_after_a_dynamic_field( self ):
+        self.assertRaises( ParseException, Layout, [ ( "view", "data", lambda self: 0, lambda self: 2 ), ( "word", "next" ) ] )
+
+    def test_short_buffer( self ):
+        # Shorter than the packed fields, each field is read on its own
+        block = Header( header()[:0x20], 0 )
+        self.assertEqual( block.magic(), 0x454c4946 )
+        self.assertEqual( block.position(), -100 )
+        self.assertEqual( block._values, () )
+        self.assertRaises( OverrunBufferException, block.created )
+        self.assertRaises( OverrunBufferException, block.ratio )
+
+    def test_subclass_fields( self ):
+        buf = header()
+        block = Extended( buf, 0 )
+        self.assertEqual( block.magic(), 0x454c4946 )
+        self.assertEqual( block.flags(), 0x11 )
+        self.assertEqual( block.count(), 0x22 )
+        self.assertEqual( Header( buf, 0 ).count(), 3 )
+        self.assertFalse( hasattr( Header, "flags" ) )
+        self.assertEqual( ( Header._off_count, Extended._off_count, Extended._off_flags ), ( 0x4, 0x54, 0x50 ) )
+        self.assertEqual( Extended._layout.names().count( "count" ), 1 )
+        self.assertEqual( Extended( buf, 0 ).data().tobytes(), Header( buf, 0 ).data().tobytes() )
+
+    def test_subclass_without_fields( self ):
+        self.assertTrue( Plain._layout is Header._layout )
+        self.assertEqual( Plain( header(), 0 ).count(), 3 )
+
+    def test_compile_layout( self ):
+        # Blocks with variants pick one of several compiled layouts per instance
+        class Variant( Block ):
+            FIELDS = ( ( "byte", "kind", 0x0 ), )
+
+            def __init__( self, buf, offset ):
+                super( Variant, self ).__init__( buf, offset )
+                # Chosen before any field is read, the values are unpacked with it
+                if read_byte( buf, offset ) == 0:
+                    self._layout = Variant.small
+                else:
+                    self._layout = Variant.large
+        Variant.small = Variant.compile_layout( Variant.FIELDS + ( ( "word", "value", 0x2 ), ) )
+        Variant.large = Variant.compile_layout( Variant.FIELDS + ( ( "dword", "value", 0x4 ), ( "byte", "extra" ) ) )
+        buf = "\x00\x00\x01\x00\x02\x00\x00\x00\x03"
+        self.assertEqual( Variant( buf, 0 ).value(), 1 )
+        self.assertEqual( Variant( "\x01" + buf[1:], 0 ).value(), 2 )
+        self.assertEqual( Variant( "\x01" + buf[1:], 0 ).extra(), 3 )
+
+
+if __name__ == '__main__':
+    unittest.main()
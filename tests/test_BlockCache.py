@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import unittest
+
+from TScopy.BlockCache import BlockCache
+
+BLOCK_SIZE = 0x100
+
+
+####################################################################################
+#  Volume: A volume of distinct bytes that records the reads made from it
+####################################################################################
+class Volume( object ):
+    def __init__( self, size ):
+        self.data = bytearray( ( n * 7 + n / 251 ) & 0xff for n in range( size ) )
+        self.reads = []
+
+    def read( self, offset, size ):
+        self.reads.append( ( offset, size ) )
+        return self.data[offset:offset + size]
+
+
+####################################################################################
+#  BlockCache
+####################################################################################
+class BlockCacheTest( unittest.TestCase ):
+    def setUp( self ):
+        self.volume = Volume( 64 * BLOCK_SIZE )
+        self.cache = BlockCache( self.volume.read, BLOCK_SIZE, 16 * BLOCK_SIZE )
+
+    def test_unaligned_read( self ):
+        self.assertEqual( self.cache.read( 0x123, 0x180 ), self.volume.data[0x123:0x2a3] )
+        self.assertEqual( self.volume.reads, [ ( 0x100, 0x200 ) ] )
+        self.assertEqual( self.cache.read( 0x1ff, 2 ), self.volume.data[0x1ff:0x201] )
+        self.assertEqual( len( self.volume.reads ), 1 )
+        self.assertEqual( ( self.cache.hits, self.cache.misses ), ( 2, 2 ) )
+
+    def test_missing_blocks_are_read_together( self ):
+        self.cache.read( 2 * BLOCK_SIZE, 1 )
+        self.volume.reads = []
+        self.assertEqual( self.cache.read( 0, 4 * BLOCK_SIZE ), self.volume.data[:4 * BLOCK_SIZE] )
+        self.assertEqual( self.volume.reads, [ ( 0, 2 * BLOCK_SIZE ), ( 3 * BLOCK_SIZE, BLOCK_SIZE ) ] )
+
+    def test_least_recently_used_block_is_evicted( self ):
+        for block in range( 16 ):
+            self.cache.read( block * BLOCK_SIZE, 1 )
+        self.cache.read( 0, 1 )
+        self.cache.read( 16 * BLOCK_SIZE, 1 )
+        self.assertEqual( len( self.cache ), 16 )
+        self.volume.reads = []
+        self.cache.read( 0, 1 )
+        self.assertEqual( self.volume.reads, [] )
+        self.cache.read( BLOCK_SIZE, 1 )
+        self.assertEqual( self.volume.reads, [ ( BLOCK_SIZE, BLOCK_SIZE ) ] )
+
+    def test_large_reads_bypass_the_cache( self ):
+        self.assertEqual( self.cache.read( 0x10, 5 * BLOCK_SIZE ), self.volume.data[0x10:0x10 + 5 * BLOCK_SIZE] )
+        self.assertEqual( self.volume.reads, [ ( 0x10, 5 * BLOCK_SIZE ) ] )
+        self.assertEqual( len( self.cache ), 0 )
+
+    def test_result_is_a_copy( self ):
+        buf = self.cache.read( 0, 0x10 )
+        buf[0] ^= 0xff
+        self.assertEqual( self.cache.read( 0, 0x10 ), self.volume.data[:0x10] )
+
+    def test_short_read_at_end_of_volume( self ):
+        buf = self.cache.read( 63 * BLOCK_SIZE + 0x80, 2 * BLOCK_SIZE )
+        self.assertEqual( buf, self.volume.data[63 * BLOCK_SIZE + 0x80:] )
+
+    def test_empty_read( self ):
+        self.assertEqual( self.cache.read( 0x100, 0 ), bytearray() )
+        self.assertEqual( self.volume.reads, [] )
+
+
+if __name__ == '__main__':
+    unittest.main()
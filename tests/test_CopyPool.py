@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import logging
+import threading
+import unittest
+
+from TScopy.CopyPool import CopyPool
+
+
+####################################################################################
+#  Handles: Volume handles opened and closed by a CopyPool
+####################################################################################
+class Handles( object ):
+    def __init__( self ):
+        self.lock = threading.Lock()
+        self.opened = []
+        self.closed = []
+
+    def open( self ):
+        with self.lock:
+            handle = len( self.opened )
+            self.opened.append( threading.current_thread().ident )
+            return handle
+
+    def close( self, handle ):
+        with self.lock:
+            self.closed.append( handle )
+
+
+####################################################################################
+#  RecordErrors: Keeps the errors logged by the copy threads
+####################################################################################
+class RecordErrors( logging.Handler ):
+    def __init__( self ):
+        logging.Handler.__init__( self, logging.ERROR )
+        self.messages = []
+
+    def emit( self, record ):
+        self.messages.append( record.getMessage() )
+
+
+####################################################################################
+#  CopyPool
+####################################################################################
+class CopyPoolTest( unittest.TestCase ):
+    def setUp( self ):
+        self.handles = Handles()
+        self.errors = RecordErrors()
+        self.logger = logging.getLogger( "tscopy" )
+        self.logger.addHandler( self.errors )
+
+    def tearDown( self ):
+        self.logger.removeHandler( self.errors )
+
+    def test_copies_with_a_handle_per_thread( self ):
+        pool = CopyPool( self.handles.open, self.handles.close, 3 )
+        done = []
+        lock = threading.Lock()
+        def copy( handle, name ):
+            with lock:
+                done.append( ( name, handle, threading.current_thread().ident ) )
+        for n in range( 50 ):
+            pool.submit( copy, n )
+        pool.wait()
+        self.assertEqual( sorted( name for name, handle, thread in done ), range( 50 ) )
+        # Each thread opened one handle and used only that one
+        self.assertTrue( 1 <= len( self.handles.opened ) <= 3 )
+        self.assertEqual( len( set( self.handles.opened ) ), len( self.handles.opened ) )
+        for name, handle, thread in done:
+            self.assertEqual( self.handles.opened[handle], thread )
+        pool.close()
+        self.assertEqual( sorted( self.handles.closed ), range( len( self.handles.opened ) ) )
+
+    def test_errors_are_logged( self ):
+        pool = CopyPool( self.handles.open, self.handles.close, 2 )
+        def copy( handle, name ):
+            if name == 3:
+                raise IOError( "disk full" )
+        for n in range( 6 ):
+            pool.submit( copy, n )
+        pool.close()
+        self.assertEqual( len( self.errors.messages ), 1 )
+        self.assertTrue( "disk full" in self.errors.messages[0] )
+
+    def test_submit_waits_for_a_free_slot( self ):
+        pool = CopyPool( self.handles.open, self.handles.close, 1 )
+        release = threading.Event()
+        submitted = []
+        def copy( handle ):
+            release.wait()
+        def submit():
+            for n in range( 3 ):
+                pool.submit( copy )
+                submitted.append( n )
+        thread = threading.Thread( target=submit )
+        thread.start()
+        # One copy running and one waiting fill the 2 slots of a single thread
+        thread.join( 0.2 )
+        self.assertEqual( submitted, [ 0, 1 ] )
+        release.set()
+        thread.join()
+        self.assertEqual( submitted, [ 0, 1, 2 ] )
+        pool.close()
+
+    def test_wait_without_copies( self ):
+        pool = CopyPool( self.handles.open, self.handles.close, 2 )
+        pool.wait()
+        pool.close()
+        self.assertEqual( self.handles.opened, [] )
+
+
+if __name__ == '__main__':
+    unittest.main()
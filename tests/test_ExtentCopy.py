@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from TScopy.ExtentCopy import data_extents, copy_extents
+
+BPC = 0x1000
+
+
+####################################################################################
+#  data_extents
+####################################################################################
+class DataExtentsTest( unittest.TestCase ):
+    def check( self, extents, data_size ):
+        # The pieces follow each other and cover the data
+        position = 0
+        for file_offset, offset, size in extents:
+            self.assertEqual( file_offset, position )
+            self.assertTrue( size > 0 )
+            position += size
+        self.assertEqual( position, data_size )
+        return extents
+
+    def extents( self, runs, data_size, initialized_size=None, chunk_size=2 * BPC ):
+        if initialized_size == None:
+            initialized_size = data_size
+        return self.check( list( data_extents( runs, BPC, data_size, initialized_size, chunk_size ) ), data_size )
+
+    def test_chunks_of_runs( self ):
+        self.assertEqual( self.extents( [ ( 100, 3 ), ( 50, 2 ) ], 5 * BPC ),
+                          [ ( 0, 100 * BPC, 2 * BPC ), ( 2 * BPC, 102 * BPC, BPC ), ( 3 * BPC, 50 * BPC, 2 * BPC ) ] )
+
+    def test_chunk_size_in_whole_clusters( self ):
+        self.assertEqual( self.extents( [ ( 100, 3 ) ], 3 * BPC, chunk_size=0x100 ),
+                          [ ( 0, 100 * BPC, BPC ), ( BPC, 101 * BPC, BPC ), ( 2 * BPC, 102 * BPC, BPC ) ] )
+        self.assertEqual( self.extents( [ ( 100, 3 ) ], 3 * BPC, chunk_size=BPC + 0x800 ),
+                          [ ( 0, 100 * BPC, BPC ), ( BPC, 101 * BPC, BPC ), ( 2 * BPC, 102 * BPC, BPC ) ] )
+
+    def test_data_size_inside_the_last_cluster( self ):
+        self.assertEqual( self.extents( [ ( 100, 3 ) ], 2 * BPC + 0x10, chunk_size=16 * BPC ),
+                          [ ( 0, 100 * BPC, 2 * BPC + 0x10 ) ] )
+
+    def test_sparse_runs( self ):
+        self.assertEqual( self.extents( [ ( None, 2 ), ( 100, 1 ), ( None, 5 ), ( 50, 1 ) ], 9 * BPC ),
+                          [ ( 0, None, 2 * BPC ), ( 2 * BPC, 100 * BPC, BPC ), ( 3 * BPC, None, 5 * BPC ),
+                            ( 8 * BPC, 50 * BPC, BPC ) ] )
+
+    def test_data_past_the_initialized_size( self ):
+        self.assertEqual( self.extents( [ ( 100, 3 ), ( 50, 2 ) ], 5 * BPC - 0x100, 2 * BPC + 0x800 ),
+                          [ ( 0, 100 * BPC, 2 * BPC ), ( 2 * BPC, 102 * BPC, 0x800 ), ( 2 * BPC + 0x800, None, 3 * BPC - 0x900 ) ] )
+
+    def test_nothing_initialized( self ):
+        self.assertEqual( self.extents( [ ( 100, 3 ) ], 3 * BPC, 0 ), [ ( 0, None, 3 * BPC ) ] )
+
+    def test_initialized_size_past_the_data_size( self ):
+        self.assertEqual( self.extents( [ ( 100, 3 ) ], 0x1800, 3 * BPC, 16 * BPC ), [ ( 0, 100 * BPC, 0x1800 ) ] )
+
+    def test_runs_shorter_than_the_data( self ):
+        self.assertEqual( self.extents( [ ( 100, 1 ) ], 3 * BPC, 2 * BPC ), [ ( 0, 100 * BPC, BPC ), ( BPC, None, 2 * BPC ) ] )
+
+    def test_empty( self ):
+        self.assertEqual( self.extents( [], 0 ), [] )
+
+
+class ReadError( Exception ):
+    pass
+
+
+####################################################################################
+#  copy_extents
+####################################################################################
+class CopyExtentsTest( unittest.TestCase ):
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join( self.directory, 'copy' )
+        self.volume = bytearray( range( 0x100 ) ) * 0x400
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.closed = []
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def open( self ):
+        with self.lock:
+            self.opened += 1
+            return self.opened
+
+    def close( self, handle ):
+        with self.lock:
+            self.closed.append( handle )
+
+    def read( self, handle, offset, size ):
+        return self.volume[offset:offset + size]
+
+    def create( self, size ):
+        with open( self.path, 'wb' ) as fd:
+            fd.truncate( size )
+
+    def test_copy( self ):
+        # 64 extents of 0x400 bytes read from the volume in reverse order, with a hole
+        extents = [ ( n * 0x400, ( 63 - n ) * 0x400, 0x400 ) for n in range( 64 ) if not n == 10 ]
+        expected = bytearray( 64 * 0x400 )
+        for file_offset, offset, size in extents:
+            expected[file_offset:file_offset + size] = self.volume[offset:offset + size]
+        for jobs in ( 1, 4 ):
+            self.create( 64 * 0x400 )
+            copy_extents( extents, self.path, self.open, self.close, self.read, jobs )
+            self.assertEqual( open( self.path, 'rb' ).read(), expected )
+        self.assertEqual( self.opened, 5 )
+        self.assertEqual( sorted( self.closed ), range( 1, 6 ) )
+
+    def test_no_more_threads_than_extents( self ):
+        self.create( 0x800 )
+        copy_extents( [ ( 0, 0, 0x400 ), ( 0x400, 0x400, 0x400 ) ], self.path, self.open, self.close, self.read, 8 )
+        self.assertEqual( self.opened, 2 )
+        self.assertEqual( open( self.path, 'rb' ).read(), self.volume[:0x800] )
+
+    def test_error_is_raised_and_stops_the_copy( self ):
+        read_extents = []
+        def read( handle, offset, size ):
+            with self.lock:
+                read_extents.append( offset )
+            if offset == 5 * 0x400:
+                raise ReadError( "short read" )
+            return self.volume[offset:offset + size]
+        extents = [ ( n * 0x400, n * 0x400, 0x400 ) for n in range( 256 ) ]
+        for jobs in ( 1, 3 ):
+            del read_extents[:]
+            self.create( 256 * 0x400 )
+            self.assertRaises( ReadError, copy_extents, extents, self.path, self.open, self.close, read, jobs )
+            self.assertTrue( len( read_extents ) < 256 )
+        self.assertEqual( sorted( self.closed ), range( 1, self.opened + 1 ) )
+
+    def test_open_error( self ):
+        self.assertRaises( IOError, copy_extents, [ ( 0, 0, 0x400 ) ], self.path, self.open, self.close, self.read, 2 )
+        self.assertEqual( self.closed, [ 1 ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import TScopy.ExtentPlan
+from TScopy.ExtentPlan import ExtentPlan, OutputFiles
+
+
+####################################################################################
+#  ExtentPlan
+####################################################################################
+class ExtentPlanTest( unittest.TestCase ):
+    def test_extents_in_disk_order( self ):
+        plan = ExtentPlan()
+        a = plan.add_file( 'a' )
+        plan.add_extent( a, 0, 0x9000, 0x1000 )
+        plan.add_extent( a, 0x1000, 0x2000, 0x1000 )
+        b = plan.add_file( 'b' )
+        plan.add_extent( b, 0, 0x5000, 0x800 )
+        self.assertEqual( ( a, b ), ( 0, 1 ) )
+        self.assertEqual( plan.extents(), [ ( 0x2000, a, 0x1000, 0x1000 ), ( 0x5000, b, 0, 0x800 ), ( 0x9000, a, 0, 0x1000 ) ] )
+        self.assertEqual( ( plan.path( a ), plan.path( b ) ), ( 'a', 'b' ) )
+        self.assertEqual( len( plan ), 3 )
+
+    def test_file_added_again_replaces_its_extents( self ):
+        plan = ExtentPlan()
+        a = plan.add_file( 'a' )
+        plan.add_extent( a, 0, 0x1000, 0x1000 )
+        b = plan.add_file( 'b' )
+        plan.add_extent( b, 0, 0x2000, 0x1000 )
+        plan.add_extent( b, 0x1000, 0x3000, 0x1000 )
+        self.assertEqual( plan.add_file( 'b' ), b )
+        plan.add_extent( b, 0, 0x4000, 0x10 )
+        self.assertEqual( plan.extents(), [ ( 0x1000, a, 0, 0x1000 ), ( 0x4000, b, 0, 0x10 ) ] )
+
+    def test_resident_file_added_again_drops_its_extents( self ):
+        plan = ExtentPlan()
+        a = plan.add_file( 'a' )
+        plan.add_extent( a, 0, 0x1000, 0x1000 )
+        plan.add_file( 'a' )
+        self.assertEqual( plan.extents(), [] )
+
+    def test_file_added_later_is_a_new_file( self ):
+        plan = ExtentPlan()
+        a = plan.add_file( 'a' )
+        plan.add_extent( a, 0, 0x1000, 0x1000 )
+        b = plan.add_file( 'b' )
+        a2 = plan.add_file( 'a' )
+        plan.add_extent( a2, 0, 0x2000, 0x1000 )
+        self.assertEqual( ( a, b, a2 ), ( 0, 1, 2 ) )
+        self.assertEqual( plan.path( a2 ), 'a' )
+
+
+####################################################################################
+#  OutputFiles
+####################################################################################
+class OutputFilesTest( unittest.TestCase ):
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for n in range( 5 ):
+            path = os.path.join( self.directory, 'f%d' % n )
+            with open( path, 'wb' ) as fd:
+                fd.truncate( 0x10 )
+            self.paths.append( path )
+        self.opened = []
+        TScopy.ExtentPlan.open = self.record_open
+
+    def tearDown( self ):
+        del TScopy.ExtentPlan.open
+        shutil.rmtree( self.directory )
+
+    def record_open( self, path, mode ):
+        self.opened.append( path )
+        return open( path, mode )
+
+    def test_writes_at_offsets( self ):
+        files = OutputFiles()
+        files.write( self.paths[0], 0x8, "late" )
+        files.write( self.paths[1], 0, "other" )
+        files.write( self.paths[0], 0, "early" )
+        files.close()
+        self.assertEqual( open( self.paths[0], 'rb' ).read(), "early\0\0\0late\0\0\0\0" )
+        self.assertEqual( open( self.paths[1], 'rb' ).read(), "other" + "\0" * 11 )
+        self.assertEqual( self.opened, self.paths[:2] )
+
+    def test_least_recently_used_file_is_closed( self ):
+        files = OutputFiles( 2 )
+        for n in ( 0, 1, 0, 2, 0, 1 ):
+            files.write( self.paths[n], n, "x" )
+        files.close()
+        # f1 is closed to open f2, as f0 was written last, then f2 to open f1 again
+        self.assertEqual( self.opened, [ self.paths[0], self.paths[1], self.paths[2], self.paths[1] ] )
+        for n in range( 3 ):
+            self.assertEqual( open( self.paths[n], 'rb' ).read()[n], "x" )
+
+    def test_files_are_not_truncated( self ):
+        files = OutputFiles()
+        files.write( self.paths[3], 4, "x" )
+        files.close()
+        self.assertEqual( os.path.getsize( self.paths[3] ), 0x10 )
+
+
+if __name__ == '__main__':
+    unittest.main()
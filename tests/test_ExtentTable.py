@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import pickle
+import unittest
+
+from TScopy.ExtentTable import ExtentTable
+
+
+####################################################################################
+#  ExtentTable
+####################################################################################
+class ExtentTableTest( unittest.TestCase ):
+    def setUp( self ):
+        self.volume = bytearray( range( 0x100 ) ) * 0x1100
+        self.reads = []
+        # Records 15 and 4000 straddle two runs of the $MFT, 300 spans three
+        self.table = ExtentTable()
+        self.table.add( 15, [ ( 0x3c00, 0x400 - 0x100 ), ( 0x8000, 0x100 ) ] )
+        self.table.add( 300, [ ( 0x9f00, 0x100 ), ( 0xa000, 0x200 ), ( 0x5000, 0x100 ) ] )
+        self.table.add( 4000, [ ( 0xfff00, 0x200 ), ( 0x1000, 0x200 ) ] )
+
+    def read( self, offset, size ):
+        self.reads.append( ( offset, size ) )
+        return self.volume[offset:offset + size]
+
+    def test_get( self ):
+        self.assertEqual( self.table.get( 300 ), [ ( 0x9f00, 0x100 ), ( 0xa000, 0x200 ), ( 0x5000, 0x100 ) ] )
+        self.assertEqual( self.table.get( 4000 ), [ ( 0xfff00, 0x200 ), ( 0x1000, 0x200 ) ] )
+        for record in ( 0, 14, 16, 299, 301, 4001 ):
+            self.assertEqual( self.table.get( record ), None )
+            self.assertFalse( record in self.table )
+        self.assertTrue( 15 in self.table )
+        self.assertEqual( list( self.table ), [ 15, 300, 4000 ] )
+        self.assertEqual( len( self.table ), 3 )
+
+    def test_records_out_of_order( self ):
+        self.assertRaises( Exception, self.table.add, 300, [ ( 0, 0x400 ) ] )
+        self.assertRaises( Exception, self.table.add, 20, [ ( 0, 0x400 ) ] )
+
+    def test_read_near_fragments_at_once( self ):
+        self.assertEqual( self.table.read( self.read, 15 ), self.volume[0x3c00:0x3f00] + self.volume[0x8000:0x8100] )
+        self.assertEqual( self.reads, [ ( 0x3c00, 0x8100 - 0x3c00 ) ] )
+        self.reads = []
+        self.assertEqual( self.table.read( self.read, 300 ),
+                          self.volume[0x9f00:0xa200] + self.volume[0x5000:0x5100] )
+        self.assertEqual( len( self.reads ), 1 )
+
+    def test_read_far_fragments_each( self ):
+        self.assertEqual( self.table.read( self.read, 4000 ), self.volume[0xfff00:0x100100] + self.volume[0x1000:0x1200] )
+        self.assertEqual( self.reads, [ ( 0xfff00, 0x200 ), ( 0x1000, 0x200 ) ] )
+
+    def test_read_unsplit_record( self ):
+        self.assertEqual( self.table.read( self.read, 16 ), None )
+        self.assertEqual( self.reads, [] )
+
+    def test_pickle( self ):
+        table = pickle.loads( pickle.dumps( self.table, pickle.HIGHEST_PROTOCOL ) )
+        self.assertEqual( list( table ), [ 15, 300, 4000 ] )
+        for record in table:
+            self.assertEqual( table.get( record ), self.table.get( record ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+import struct
+import unittest
+
+from TScopy.MFT import INDEX_ENTRY_FLAGS
+from TScopy.IndexTree import UpCase, find_entry, read_index_block, iter_index_blocks, read_stream, block_node, root_node
+from TScopy.IndexTree import index_children, FILENAME_NAMESPACE_DOS, FILE_ATTR_HAS_INDX
+from TScopy.IndexTree import ROOT_HEADER, NODE_HEADER, INDX_HEADER, ENTRY_HEADER, QWORD, FILENAME_FLAGS
+
+BLOCK_SIZE = 0x1000
+USA_OFFSET = 0x28
+ENTRIES_OFFSET = 0x40
+
+
+####################################################################################
+#  upcase_table: Returns an $UpCase table that upper cases ASCII letters
+####################################################################################
+def upcase_table():
+    table = range( 0x10000 )
+    for unit in range( ord( 'a' ), ord( 'z' ) + 1 ):
+        table[unit] = unit - 0x20
+    return struct.pack( "<65536H", *table )
+
+
+def reference( record, seq=1 ):
+    return ( seq << 48 ) | record
+
+
+####################################################################################
+#  entry: Returns an $I30 index entry for name. subnode is the VCN of the node of the
+#       names before it. name None returns the end entry
+####################################################################################
+def entry( record, name, subnode=None, attributes=0, namespace=1 ):
+    flags = 0
+    key = ""
+    if name == None:
+        flags |= INDEX_ENTRY_FLAGS.INDEX_ENTRY_END
+    else:
+        key = bytearray( FILENAME_FLAGS + 10 )
+        struct.pack_into( "<Q", key, 0, reference( 5, 5 ) )
+        struct.pack_into( "<IIBB", key, FILENAME_FLAGS, attributes, 0, len( name ), namespace )
+        key = str( key ) + name.encode( "utf-16le" )
+    length = ( ENTRY_HEADER.size + len( key ) + 7 ) / 8 * 8
+    if not subnode == None:
+        flags |= INDEX_ENTRY_FLAGS.INDEX_ENTRY_NODE
+        length += 8
+    buf = bytearray( length )
+    ENTRY_HEADER.pack_into( buf, 0, reference( record ) if not name == None else 0, length, len( key ), flags )
+    buf[ENTRY_HEADER.size:ENTRY_HEADER.size + len( key )] = key
+    if not subnode == None:
+        QWORD.pack_into( buf, length - 8, subnode )
+    return buf
+
+
+####################################################################################
+#  root: Returns the value of an $INDEX_ROOT with entries
+####################################################################################
+def root( entries, block_size=BLOCK_SIZE ):
+    entries = "".join( str( e ) for e in entries )
+    length = NODE_HEADER.size + len( entries )
+    return bytearray( ROOT_HEADER.pack( 0x30, 1, block_size, 1 ) + NODE_HEADER.pack( NODE_HEADER.size, length, length, 1 ) + entries )
+
+
+####################################################################################
+#  indx_block: Returns an INDX block with entries, protected by the update sequence
+#       array as it is on the disk
+####################################################################################
+def indx_block( entries, vcn, block_size=BLOCK_SIZE, usn=0x1234 ):
+    entries = "".join( str( e ) for e in entries )
+    count = block_size / 512 + 1
+    block = bytearray( block_size )
+    INDX_HEADER.pack_into( block, 0, "INDX", USA_OFFSET, count, 0, vcn )
+    NODE_HEADER.pack_into( block, INDX_HEADER.size, ENTRIES_OFFSET - INDX_HEADER.size,
+                           ENTRIES_OFFSET - INDX_HEADER.size + len( entries ), block_size - INDX_HEADER.size, 0 )
+    block[ENTRIES_OFFSET:ENTRIES_OFFSET + len( entries )] = entries
+    struct.pack_into( "<H", block, USA_OFFSET, usn )
+    for i in range( count - 1 ):
+        end = 512 * ( i + 1 ) - 2
+        block[USA_OFFSET + 2 + 2 * i:USA_OFFSET + 4 + 2 * i] = block[end:end + 2]
+        struct.pack_into( "<H", block, end, usn )
+    return block
+
+
+####################################################################################
+#  block_vcn: Returns the VCN of block n. VCNs count clusters, or 512 byte blocks when
+#       the index record is smaller than a cluster
+####################################################################################
+def block_vcn( n, bpc, block_size=BLOCK_SIZE ):
+    if block_size >= bpc:
+        return n * block_size / bpc
+    return n * block_size / 512
+
+
+####################################################################################
+#  Volume: The blocks of an $INDEX_ALLOCATION laid out in two runs on a volume
+####################################################################################
+class Volume( object ):
+    def __init__( self, blocks, bpc, block_size=BLOCK_SIZE ):
+        self.bpc = bpc
+        self.block_size = block_size
+        allocation = "".join( str( block ) for block in blocks )
+        clusters = ( len( allocation ) + bpc - 1 ) / bpc
+        half = clusters / 2
+        # The second half of the allocation is stored before the first one
+        self.runs = [ ( half + 10, half ), ( 4, clusters - half ) ]
+        self.data = bytearray( ( 2 * half + 10 ) * bpc )
+        self.data[( half + 10 ) * bpc:( 2 * half + 10 ) * bpc] = allocation[:half * bpc]
+        rest = allocation[half * bpc:]
+        self.data[4 * bpc:4 * bpc + len( rest )] = rest
+        self.reads = []
+
+    def read( self, offset, size ):
+        self.reads.append( ( offset, size ) )
+        return self.data[offset:offset + size]
+
+    def read_block( self, vcn ):
+        return read_index_block( self.read, self.runs, self.bpc, self.block_size, vcn )
+
+
+####################################################################################
+#  UpCase
+####################################################################################
+class UpCaseTest( unittest.TestCase ):
+    def test_key( self ):
+        upcase = UpCase( upcase_table() )
+        self.assertEqual( upcase.key( u"aB_".encode( "utf-16le" ) ), [ 0x41, 0x42, 0x5f ] )
+        self.assertEqual( upcase.key( u"\xe9".encode( "utf-16le" ) ), [ 0xe9 ] )
+
+
+####################################################################################
+#  find_entry: A tree of an $INDEX_ROOT, an INDX node and three INDX leaves
+####################################################################################
+class FindEntryTest( unittest.TestCase ):
+    def setUp( self ):
+        self.upcase = UpCase( upcase_table() )
+        names = [ u"file%03d" % n for n in range( 0, 120, 2 ) ] + [ u"ABC", u"abd", u"_x", u"Zed", u"a" ]
+        names.sort( key=lambda name: self.upcase.key( name.encode( "utf-16le" ) ) )
+        self.records = dict( ( name, 100 + n ) for n, name in enumerate( names ) )
+        self.names = names
+
+    def build( self, bpc, block_size=BLOCK_SIZE, loop=False ):
+        names = self.names
+        leaves = [ names[0:20], names[21:40], names[41:] ]
+        separators = [ names[20], names[40] ]
+        vcn = lambda n: block_vcn( n, bpc, block_size )
+        blocks = []
+        for n, leaf in enumerate( leaves ):
+            entries = [ entry( self.records[name], name ) for name in leaf ] + [ entry( 0, None ) ]
+            blocks.append( indx_block( entries, vcn( n ), block_size ) )
+        node = [ entry( self.records[name], name, vcn( n ) ) for n, name in enumerate( separators ) ]
+        node.append( entry( 0, None, vcn( 3 if loop else 2 ) ) )
+        blocks.append( indx_block( node, vcn( 3 ), block_size ) )
+        return root( [ entry( 0, None, vcn( 3 ) ) ], block_size ), Volume( blocks, bpc, block_size )
+
+    def test_every_name( self ):
+        for bpc, block_size in ( ( 0x1000, 0x1000 ), ( 0x200, 0x1000 ), ( 0x2000, 0x1000 ) ):
+            index_root, volume = self.build( bpc, block_size )
+            for name in self.names:
+                for lookup in ( name, name.lower(), name.upper() ):
+                    self.assertEqual( find_entry( index_root, self.upcase, lookup, volume.read_block ),
+                                      reference( self.records[name] ) )
+
+    def test_collation( self ):
+        # NTFS compares upper cased units, so "a" sorts before "_x" and "Zed"
+        self.assertEqual( self.names[:5], [ u"a", u"ABC", u"abd", u"file000", u"file002" ] )
+        self.assertEqual( self.names[-2:], [ u"Zed", u"_x" ] )
+
+    def test_reads_only_the_path( self ):
+        index_root, volume = self.build( 0x1000 )
+        self.assertEqual( find_entry( index_root, self.upcase, u"_x", volume.read_block ), reference( self.records[u"_x"] ) )
+        self.assertEqual( len( volume.reads ), 2 )
+        volume.reads = []
+        self.assertEqual( find_entry( index_root, self.upcase, self.names[20], volume.read_block ),
+                          reference( self.records[self.names[20]] ) )
+        self.assertEqual( len( volume.reads ), 1 )
+
+    def test_missing_names( self ):
+        index_root, volume = self.build( 0x1000 )
+        for name in ( u"", u"0", u"file001", u"file0", u"file1000", u"zz", u"~" ):
+            self.assertEqual( find_entry( index_root, self.upcase, name, volume.read_block ), None )
+
+    def test_resident_root_only( self ):
+        entries = [ entry( self.records[name], name ) for name in self.names[:5] ] + [ entry( 0, None ) ]
+        read_block = lambda vcn: self.fail( "no index block to read" )
+        self.assertEqual( find_entry( root( entries ), self.upcase, u"ABD", read_block ), reference( self.records[u"abd"] ) )
+        self.assertEqual( find_entry( root( entries ), self.upcase, u"abe", read_block ), None )
+
+    def test_loop_in_the_tree( self ):
+        index_root, volume = self.build( 0x1000, loop=True )
+        self.assertEqual( find_entry( index_root, self.upcase, u"_x", volume.read_block ), None )
+
+    def test_bad_block( self ):
+        index_root, volume = self.build( 0x1000 )
+        volume.data[:] = bytearray( len( volume.data ) )
+        self.assertEqual( find_entry( index_root, self.upcase, u"_x", volume.read_block ), None )
+
+
+####################################################################################
+#  read_stream
+####################################################################################
+class ReadStreamTest( unittest.TestCase ):
+    def test_across_runs( self ):
+        volume = Volume( [ bytearray( [ n ] ) * BLOCK_SIZE for n in range( 1, 7 ) ], 0x1000 )
+        allocation = "".join( chr( n ) * BLOCK_SIZE for n in range( 1, 7 ) )
+        for pos, size in ( ( 0, 6 * BLOCK_SIZE ), ( 0x2ff0, 0x20 ), ( 0x5000, 0x1000 ), ( 0x10, 1 ) ):
+            self.assertEqual( read_stream( volume.read, volume.runs, 0x1000, pos, size ), allocation[pos:pos + size] )
+
+    def test_short_at_the_end_of_the_runs( self ):
+        volume = Volume( [ bytearray( BLOCK_SIZE ) ] * 2, 0x1000 )
+        self.assertEqual( len( read_stream( volume.read, volume.runs, 0x1000, 0x1800, 0x1000 ) ), 0x800 )
+        self.assertEqual( len( read_stream( volume.read, volume.runs, 0x1000, 0x3000, 0x1000 ) ), 0 )
+
+
+####################################################################################
+#  iter_index_blocks
+####################################################################################
+class IterIndexBlocksTest( unittest.TestCase ):
+    def setUp( self ):
+        # Block n holds one entry for record 100 + n
+        self.count = 16
+        blocks = [ indx_block( [ entry( 100 + n, u"f%02d" % n ), entry( 0, None ) ], n ) for n in range( self.count ) ]
+        self.volume = Volume( blocks, 0x1000 )
+
+    def records( self, bitmap=None, chunk_size=4 * BLOCK_SIZE, data_size=None ):
+        if data_size == None:
+            data_size = self.count * BLOCK_SIZE
+        records = []
+        for block in iter_index_blocks( self.volume.read, self.volume.runs, 0x1000, BLOCK_SIZE, data_size, bitmap, chunk_size ):
+            self.assertEqual( len( block ), BLOCK_SIZE )
+            offset, end = block_node( block )
+            records.append( ENTRY_HEADER.unpack_from( block, offset )[0] & 0xffff )
+        return records
+
+    def test_every_block( self ):
+        for chunk_size in ( 1, BLOCK_SIZE, 3 * BLOCK_SIZE, 1024 * 1024 ):
+            self.assertEqual( self.records( chunk_size=chunk_size ), range( 100, 100 + self.count ) )
+
+    def test_bitmap( self ):
+        # Blocks 1, 2, 9 and 15 are in use, the chunk of blocks 4 to 7 is not read and
+        # the other chunks are trimmed to their blocks in use
+        bitmap = bytearray( [ 0x06, 0x82 ] )
+        self.assertEqual( self.records( bitmap ), [ 101, 102, 109, 115 ] )
+        self.assertEqual( sum( size for offset, size in self.volume.reads ), 4 * BLOCK_SIZE )
+
+    def test_short_bitmap( self ):
+        self.assertEqual( self.records( bytearray( [ 0xff ] ) ), range( 100, 108 ) )
+
+    def test_blocks_past_the_data_size( self ):
+        self.assertEqual( self.records( data_size=5 * BLOCK_SIZE + 100 ), range( 100, 105 ) )
+
+    def test_blocks_that_are_not_indx( self ):
+        start = self.volume.runs[1][0] * 0x1000
+        self.volume.data[start:start + 4] = "FILE"
+        records = self.records()
+        self.assertEqual( len( records ), self.count - 1 )
+        self.assertFalse( 100 + self.count / 2 in records )
+
+    def test_fixups_are_applied( self ):
+        # The sector ends of the entries only hold the right bytes once fixed up
+        block = indx_block( [ entry( 7, u"x" * 250 ), entry( 0, None ) ], 0 )
+        volume = Volume( [ block ], 0x1000 )
+        fixed = list( iter_index_blocks( volume.read, volume.runs, 0x1000, BLOCK_SIZE, BLOCK_SIZE ) )[0]
+        offset, end = block_node( fixed )
+        name = fixed[offset + 0x52:offset + 0x52 + 500].tobytes().decode( "utf-16le" )
+        self.assertEqual( name, u"x" * 250 )
+
+    def test_root_node( self ):
+        entries = [ entry( 7, u"abc" ), entry( 0, None ) ]
+        self.assertEqual( root_node( root( entries, 0x800 ) ),
+                          ( 0x800, ROOT_HEADER.size + NODE_HEADER.size, ROOT_HEADER.size + NODE_HEADER.size + sum( len( e ) for e in entries ) ) )
+
+
+####################################################################################
+#  index_children
+####################################################################################
+class IndexChildrenTest( unittest.TestCase ):
+    def test_dos_names_are_skipped( self ):
+        entries = [ entry( 30, u"PROGRA~1", attributes=FILE_ATTR_HAS_INDX, namespace=FILENAME_NAMESPACE_DOS ),
+                    entry( 31, u"a.txt", attributes=0x20, namespace=3 ),
+                    entry( 30, u"Program Files", attributes=FILE_ATTR_HAS_INDX, namespace=1 ),
+                    entry( 32, u"posix", namespace=0 ),
+                    entry( 0, None ) ]
+        index_root = root( entries )
+        block_size, offset, end = root_node( index_root )
+        self.assertEqual( list( index_children( index_root, offset, end ) ),
+                          [ ( reference( 31 ), u"a.txt", 0x20 ),
+                            ( reference( 30 ), u"Program Files", FILE_ATTR_HAS_INDX ),
+                            ( reference( 32 ), u"posix", 0 ) ] )
+
+    def test_stops_at_the_end_entry( self ):
+        entries = [ entry( 31, u"a" ), entry( 0, None, 4 ), entry( 32, u"b" ) ]
+        index_root = root( entries )
+        block_size, offset, end = root_node( index_root )
+        self.assertEqual( [ name for ref, name, flags in index_children( index_root, offset, end ) ], [ u"a" ] )
+
+    def test_truncated_node( self ):
+        entries = [ entry( 31, u"a" ), entry( 32, u"b" ), entry( 0, None ) ]
+        index_root = root( entries )
+        block_size, offset, end = root_node( index_root )
+        end = offset + len( entries[0] ) + 0x20
+        self.assertEqual( [ name for ref, name, flags in index_children( index_root, offset, end ) ], [ u"a" ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
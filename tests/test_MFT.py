@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+import random
+import struct
+import logging
+import unittest
+
+from TScopy.MFT import MFTRecord, MFTRecordView, INDEX_BLOCK, ATTR_TYPE, MFT_RECORD_FLAGS, apply_fixups
+from TScopy.BinaryParser import OverrunBufferException
+from TScopy.IndexTree import fixup_block
+from test_MFTScan import protect, mft_record, attribute, filename, reference, USA_OFFSET
+
+INDX_USA_OFFSET = 0x28
+#   type, size, non_resident, name_length, name_offset, flags, instance, lowest_vcn,
+#   highest_vcn, runlist_offset, compression_unit, allocated_size, data_size,
+#   initialized_size
+NONRESIDENT_HEADER = struct.Struct("<IIBBHHHQQHH4xQQQ")
+
+
+####################################################################################
+#  Warnings: Collects the messages logged while it is installed
+####################################################################################
+class Warnings( logging.Handler ):
+    def __init__( self ):
+        logging.Handler.__init__( self )
+        self.messages = []
+
+    def emit( self, record ):
+        self.messages.append( record.getMessage() )
+
+
+####################################################################################
+#  indx_block: Returns an INDX block of random content protected by the update
+#       sequence array, and the block as it is once fixed up
+####################################################################################
+def indx_block( size=0x1000, usn=0x4321 ):
+    rand = random.Random( size )
+    block = bytearray( rand.randrange( 256 ) for i in range( size ) )
+    struct.pack_into( "<4sHHQQ", block, 0, "INDX", INDX_USA_OFFSET, size / 512 + 1, 0, 0 )
+    original = bytearray( block )
+    protect( block, INDX_USA_OFFSET, usn )
+    # The update sequence array itself is left as it is on the disk
+    usa_end = INDX_USA_OFFSET + 2 * ( size / 512 + 1 )
+    original[INDX_USA_OFFSET:usa_end] = block[INDX_USA_OFFSET:usa_end]
+    return block, original
+
+
+####################################################################################
+#  nonresident_attribute: Returns a non resident attribute of the encoded runlist
+####################################################################################
+def nonresident_attribute( attr_type, runlist, data_size, name=u'', lowest_vcn=0, highest_vcn=0 ):
+    name = name.encode( "utf-16le" )
+    runlist_offset = ( NONRESIDENT_HEADER.size + len( name ) + 7 ) / 8 * 8
+    size = ( runlist_offset + len( runlist ) + 7 ) / 8 * 8
+    buf = bytearray( size )
+    allocated = ( data_size + 0xfff ) / 0x1000 * 0x1000
+    NONRESIDENT_HEADER.pack_into( buf, 0, attr_type, size, 1, len( name ) / 2, NONRESIDENT_HEADER.size, 0, 0,
+                                  lowest_vcn, highest_vcn, runlist_offset, 0, allocated, data_size, data_size - 1 )
+    buf[NONRESIDENT_HEADER.size:NONRESIDENT_HEADER.size + len( name )] = name
+    buf[runlist_offset:runlist_offset + len( runlist )] = runlist
+    return buf
+
+
+####################################################################################
+#  update_seq_arr: The fixups of a 4 KB index block as they were applied before
+#       apply_fixups, by concatenating the sectors and the update sequence array
+####################################################################################
+def update_seq_arr( idx_buf ):
+    seq_arr = idx_buf[INDX_USA_OFFSET + 2:INDX_USA_OFFSET + 2 + 8 * 2]
+    ret = ""
+    for i in range( 8 ):
+        ret += idx_buf[i * 0x200:i * 0x200 + 0x1fe] + seq_arr[i * 2:i * 2 + 2]
+    return ret + idx_buf[0x1000:]
+
+
+####################################################################################
+#  apply_fixups, FixupBlock and MFTRecordView fixups
+####################################################################################
+class FixupTest( unittest.TestCase ):
+    def setUp( self ):
+        self.original = mft_record( [ filename( reference( 5, 5 ), u'file.txt' ) ], usn=0 )
+        # The sector ends hold data the update sequence array has to restore
+        struct.pack_into( "<H", self.original, 510, 0x1111 )
+        struct.pack_into( "<H", self.original, 1022, 0x2222 )
+        self.record = protect( bytearray( self.original ), USA_OFFSET, 0x55 )
+        self.warnings = Warnings()
+        logging.getLogger().addHandler( self.warnings )
+
+    def tearDown( self ):
+        logging.getLogger().removeHandler( self.warnings )
+
+    def test_apply_fixups( self ):
+        apply_fixups( self.record, 0, 3, USA_OFFSET )
+        self.assertEqual( self.record[:USA_OFFSET], self.original[:USA_OFFSET] )
+        self.assertEqual( self.record[USA_OFFSET + 6:], self.original[USA_OFFSET + 6:] )
+        self.assertEqual( self.warnings.messages, [] )
+
+    def test_bytearray_is_patched_in_place( self ):
+        record = MFTRecord( self.record, 0, None )
+        self.assertTrue( record._buf is self.record )
+        self.assertEqual( struct.unpack_from( "<H", self.record, 510 )[0], 0x1111 )
+        self.assertEqual( struct.unpack_from( "<H", self.record, 1022 )[0], 0x2222 )
+
+    def test_record_view_patches_in_place( self ):
+        view = MFTRecordView( self.record )
+        self.assertTrue( view._buf is self.record )
+        self.assertEqual( struct.unpack_from( "<H", self.record, 1022 )[0], 0x2222 )
+        # A record inside a larger buffer is patched through a view of it
+        buf = bytearray( 1024 ) + protect( bytearray( self.original ), USA_OFFSET, 0x55 )
+        view = MFTRecordView( buf, 1024 )
+        self.assertTrue( isinstance( view._buf, memoryview ) )
+        self.assertEqual( struct.unpack_from( "<H", buf, 2046 )[0], 0x2222 )
+        self.assertEqual( view.sequence_number(), 1 )
+
+    def test_string_is_copied_once( self ):
+        protected = str( self.record )
+        buf = "\x00" * 16 + protected
+        record = MFTRecord( buf, 16, None )
+        self.assertTrue( isinstance( record._buf, bytearray ) )
+        self.assertEqual( ( record._offset, len( record._buf ) ), ( 0, 1024 ) )
+        self.assertEqual( struct.unpack_from( "<H", record._buf, 1022 )[0], 0x2222 )
+        self.assertEqual( buf[16:], protected )
+        self.assertEqual( record.filename_information().filename(), u'file.txt' )
+        view = MFTRecordView( buf, 16 )
+        self.assertTrue( isinstance( view._buf, bytearray ) )
+        self.assertEqual( len( view._buf ), 1024 )
+        self.assertEqual( buf[16:], protected )
+
+    def test_sector_end_mismatch( self ):
+        # The second sector was not written with the first one
+        struct.pack_into( "<H", self.record, 1022, 0x66 )
+        apply_fixups( self.record, 0, 3, USA_OFFSET )
+        self.assertEqual( self.warnings.messages, [ "Bad fixup at 0x3fe" ] )
+        self.assertEqual( struct.unpack_from( "<H", self.record, 510 )[0], 0x1111 )
+        self.assertEqual( struct.unpack_from( "<H", self.record, 1022 )[0], 0x66 )
+
+    def test_short_buffer( self ):
+        self.assertRaises( OverrunBufferException, apply_fixups, self.record[:1000], 0, 3, USA_OFFSET )
+        self.assertRaises( OverrunBufferException, MFTRecord, str( self.record[:1000] ), 0, None )
+
+    def test_index_block( self ):
+        block, original = indx_block()
+        expected = update_seq_arr( str( block ) )
+        self.assertEqual( expected, str( original ) )
+        self.assertTrue( fixup_block( block ) )
+        self.assertEqual( str( block ), expected )
+        protected = str( indx_block()[0] )
+        self.assertEqual( str( INDEX_BLOCK( protected, 0 )._buf ), expected )
+        self.assertEqual( self.warnings.messages, [] )
+
+    def test_not_an_index_block( self ):
+        block, original = indx_block()
+        self.assertFalse( fixup_block( block[:0x800] ) )
+        block[0:4] = "FILE"
+        self.assertFalse( fixup_block( block ) )
+
+
+
+####################################################################################
+#  MFTRecordView against MFTRecord
+####################################################################################
+class MFTRecordViewTest( unittest.TestCase ):
+    def setUp( self ):
+        # Runs of 0x10 clusters at 0x100 and 8 clusters at 0x80, then a sparse run
+        runlist = "\x21\x10\x00\x01" + "\x21\x08\x80\xff" + "\x01\x04" + "\x00"
+        self.directory = mft_record( [ attribute( ATTR_TYPE.STANDARD_INFORMATION, bytearray( 0x48 ) ),
+                                       filename( reference( 5, 5 ), u'Windows', flags=0x10000000 ),
+                                       attribute( ATTR_TYPE.INDEX_ROOT, bytearray( range( 0x30 ) ), name=u'$I30' ),
+                                       nonresident_attribute( ATTR_TYPE.INDEX_ALLOCATION, runlist, 0x1c000, name=u'$I30',
+                                                              highest_vcn=0x1b ) ],
+                                     seq=9, lsn=0x123456789, number=30,
+                                     flags=MFT_RECORD_FLAGS.MFT_RECORD_IN_USE | MFT_RECORD_FLAGS.MFT_RECORD_IS_DIRECTORY )
+        self.file = mft_record( [ attribute( ATTR_TYPE.STANDARD_INFORMATION, bytearray( 0x48 ) ),
+                                  filename( reference( 30, 9 ), u'data.bin' ),
+                                  attribute( ATTR_TYPE.DATA, "stream", name=u'ads' ),
+                                  nonresident_attribute( ATTR_TYPE.DATA, runlist, 0x18000, highest_vcn=0x1b ) ],
+                                seq=2, lsn=77, number=31, base=0 )
+        self.extension = mft_record( [ attribute( ATTR_TYPE.DATA, "small" ) ], seq=1, lsn=5, number=40,
+                                     base=reference( 31, 2 ), flags=MFT_RECORD_FLAGS.MFT_RECORD_IN_USE )
+
+    def assertSameRecord( self, buf, offset=0 ):
+        # Each parser fixes up its own copy
+        view = MFTRecordView( bytearray( buf ), offset )
+        record = MFTRecord( bytearray( buf ), offset, None )
+        for name in [ "magic", "lsn", "sequence_number", "attrs_offset", "flags", "bytes_in_use", "base_mft_record",
+                      "mft_record_number", "is_directory", "is_active" ]:
+            self.assertEqual( getattr( view, name )(), getattr( record, name )(), name )
+        view_attributes = list( view.attributes() )
+        attributes = list( record.attributes() )
+        self.assertEqual( len( view_attributes ), len( attributes ) )
+        for view_attribute, attribute in zip( view_attributes, attributes ):
+            names = [ "type", "size", "non_resident", "name_length", "name_offset", "flags", "name" ]
+            if attribute.non_resident():
+                names += [ "lowest_vcn", "highest_vcn", "runlist_offset", "allocated_size", "data_size",
+                           "initialized_size" ]
+                self.assertEqual( list( view_attribute.runlist().runs() ), list( attribute.runlist().runs() ) )
+                self.assertEqual( list( view_attribute.runlist().extents() ), list( attribute.runlist().extents() ) )
+            else:
+                names += [ "value_length", "value_offset" ]
+                self.assertEqual( view_attribute.value().tobytes(), attribute.value().tobytes() )
+            for name in names:
+                self.assertEqual( getattr( view_attribute, name )(), getattr( attribute, name )(), name )
+        return view, record
+
+    def test_directory( self ):
+        view, record = self.assertSameRecord( self.directory )
+        self.assertTrue( view.is_directory() )
+        self.assertEqual( ( view.sequence_number(), view.lsn(), view.mft_record_number() ), ( 9, 0x123456789, 30 ) )
+        self.assertEqual( [ a.type() for a in view.attributes() ],
+                          [ ATTR_TYPE.STANDARD_INFORMATION, ATTR_TYPE.FILENAME_INFORMATION, ATTR_TYPE.INDEX_ROOT,
+                            ATTR_TYPE.INDEX_ALLOCATION ] )
+        self.assertEqual( view.attribute( ATTR_TYPE.INDEX_ROOT ).value().tobytes(), str( bytearray( range( 0x30 ) ) ) )
+        self.assertEqual( list( view.attribute( ATTR_TYPE.INDEX_ALLOCATION ).runlist().runs() ),
+                          [ ( 0x100, 0x10 ), ( 0x80, 8 ) ] )
+        self.assertEqual( view.data_attribute(), None )
+        self.assertEqual( record.data_attribute(), None )
+
+    def test_file( self ):
+        view, record = self.assertSameRecord( self.file )
+        self.assertFalse( view.is_directory() )
+        self.assertEqual( view.attribute( ATTR_TYPE.DATA ).name(), u'ads' )
+        self.assertEqual( view.attribute( ATTR_TYPE.DATA ).value().tobytes(), "stream" )
+        data = view.data_attribute()
+        self.assertEqual( ( data.non_resident(), data.data_size() ), ( 1, 0x18000 ) )
+        self.assertEqual( data.data_size(), record.data_attribute().data_size() )
+        self.assertEqual( list( data.runlist().extents() ), [ ( 0x100, 0x10 ), ( 0x80, 8 ), ( None, 4 ) ] )
+
+    def test_extension_record( self ):
+        view, record = self.assertSameRecord( self.extension )
+        self.assertEqual( view.base_mft_record(), reference( 31, 2 ) )
+        self.assertEqual( view.data_attribute().value().tobytes(), "small" )
+
+    def test_record_inside_a_buffer( self ):
+        buf = self.extension + self.file + self.directory
+        self.assertSameRecord( buf, 1024 )
+        view, record = self.assertSameRecord( buf, 2048 )
+        self.assertEqual( view.mft_record_number(), 30 )
+
+
+if __name__ == '__main__':
+    unittest.main()
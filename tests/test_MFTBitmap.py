@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+from TScopy.MFTScan import MFTBitmap
+
+
+####################################################################################
+#  bitmap: Returns the $MFT bitmap with the bits of records set
+####################################################################################
+def bitmap( records, record_count ):
+    buf = bytearray( ( record_count + 7 ) / 8 )
+    for record in records:
+        buf[record / 8] |= 1 << ( record % 8 )
+    return str( buf )
+
+
+####################################################################################
+#  MFTBitmap
+####################################################################################
+class MFTBitmapTest( unittest.TestCase ):
+    def setUp( self ):
+        self.allocated = set( range( 0, 16 ) + [ 20 ] + range( 200, 211 ) + [ 1000 ] )
+        self.bitmap = MFTBitmap( bitmap( self.allocated, 1024 ), 1024 )
+
+    def test_is_allocated( self ):
+        for record in range( 1100 ):
+            self.assertEqual( self.bitmap.is_allocated( record ), record in self.allocated )
+        self.assertEqual( len( self.bitmap ), 1024 )
+
+    def test_ranges_join_close_records( self ):
+        self.assertEqual( list( self.bitmap.ranges() ), [ ( 0, 21 ), ( 200, 211 ), ( 1000, 1001 ) ] )
+
+    def test_ranges_with_a_larger_gap( self ):
+        self.assertEqual( list( self.bitmap.ranges( gap=200 ) ), [ ( 0, 211 ), ( 1000, 1001 ) ] )
+
+    def test_ranges_keep_free_records_of_used_bytes( self ):
+        # Records 16 to 19 are free, but no byte of the bitmap between them is zero
+        self.assertEqual( list( self.bitmap.ranges( gap=1 ) ), [ ( 0, 21 ), ( 200, 211 ), ( 1000, 1001 ) ] )
+        self.assertEqual( list( MFTBitmap( bitmap( [ 2, 20 ], 64 ), 64 ).ranges( gap=1 ) ), [ ( 2, 3 ), ( 20, 21 ) ] )
+
+    def test_ranges_split_to_max_records( self ):
+        self.assertEqual( list( self.bitmap.ranges( 5 ) ),
+                          [ ( 0, 5 ), ( 5, 10 ), ( 10, 15 ), ( 15, 20 ), ( 20, 21 ),
+                            ( 200, 205 ), ( 205, 210 ), ( 210, 211 ), ( 1000, 1001 ) ] )
+
+    def test_bits_past_the_record_count( self ):
+        mft_bitmap = MFTBitmap( bitmap( [ 3, 1024, 1030 ], 1040 ), 1025 )
+        self.assertEqual( list( mft_bitmap.ranges() ), [ ( 3, 4 ), ( 1024, 1025 ) ] )
+        self.assertFalse( mft_bitmap.is_allocated( 1030 ) )
+
+    def test_empty( self ):
+        self.assertEqual( list( MFTBitmap( bitmap( [], 1024 ), 1024 ).ranges() ), [] )
+
+    def test_ranges_cover_every_allocated_record( self ):
+        rand = random.Random( 10 )
+        for gap in ( 1, 8, 64 ):
+            allocated = set( rand.sample( xrange( 5000 ), 300 ) )
+            ranges = list( MFTBitmap( bitmap( allocated, 5000 ), 5000 ).ranges( 100, gap ) )
+            covered = set()
+            for first, last in ranges:
+                self.assertTrue( 0 < last - first <= 100 )
+                covered.update( range( first, last ) )
+            self.assertTrue( allocated <= covered )
+            self.assertEqual( ranges, sorted( ranges ) )
+            self.assertTrue( all( a[1] <= b[0] for a, b in zip( ranges, ranges[1:] ) ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
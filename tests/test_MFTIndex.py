@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import unittest
+
+from TScopy.MFTScan import MFTIndex
+
+
+def reference( record, seq ):
+    return ( seq << 48 ) | record
+
+
+####################################################################################
+#  MFTIndex
+####################################################################################
+class MFTIndexTest( unittest.TestCase ):
+    def setUp( self ):
+        index = MFTIndex()
+        index.add( 5, 5, [ ( reference( 5, 5 ), u'.' ) ] )
+        index.add( 30, 1, [ ( reference( 5, 5 ), u'Windows' ) ] )
+        index.add( 31, 2, [ ( reference( 5, 5 ), u'pagefile.sys' ) ] )
+        # Win32 name first, then the DOS name of the same record
+        index.add( 32, 1, [ ( reference( 5, 5 ), u'Program Files' ), ( reference( 5, 5 ), u'PROGRA~1' ) ] )
+        # A hard link in two directories
+        index.add( 40, 3, [ ( reference( 30, 1 ), u'notepad.exe' ), ( reference( 32, 1 ), u'notepad.exe' ) ] )
+        # The parent of record 41 was reused since, its sequence number no longer matches
+        index.add( 41, 1, [ ( reference( 30, 7 ), u'stale.txt' ) ] )
+        # The parent of record 42 is not in use
+        index.add( 42, 1, [ ( reference( 50, 1 ), u'orphan.txt' ) ] )
+        # An extension record adds a name to record 43
+        index.add( 43, 4, [] )
+        index.add( 44, None, [ ( reference( 30, 1 ), u'Extended.dat' ) ] )
+        for n in range( 100 ):
+            index.add( 200 + n, 1, [ ( reference( 30, 1 ), u'File%03d' % ( 99 - n ) ) ] )
+        index.finish()
+        self.index = index
+
+    def test_children( self ):
+        self.assertEqual( self.index.children( 5 ), { reference( 5, 5 ): u'.',
+                                                      reference( 30, 1 ): u'Windows',
+                                                      reference( 31, 2 ): u'pagefile.sys',
+                                                      reference( 32, 1 ): u'Program Files' } )
+        self.assertEqual( self.index.children( 32 ), { reference( 40, 3 ): u'notepad.exe' } )
+        children = self.index.children( 30 )
+        self.assertEqual( len( children ), 102 )
+        self.assertEqual( children[reference( 40, 3 )], u'notepad.exe' )
+        self.assertEqual( children[44], u'Extended.dat' )
+        self.assertEqual( self.index.children( 31 ), {} )
+        self.assertEqual( self.index.children( 50 ), {} )
+
+    def test_find( self ):
+        self.assertEqual( self.index.find( 5, u'windows' ), reference( 30, 1 ) )
+        self.assertEqual( self.index.find( 30, u'notepad.exe' ), reference( 40, 3 ) )
+        for n in range( 100 ):
+            self.assertEqual( self.index.find( 30, u'file%03d' % n ), reference( 299 - n, 1 ) )
+        self.assertEqual( self.index.find( 30, u'File001' ), None )
+        self.assertEqual( self.index.find( 5, u'progra~1' ), None )
+        self.assertEqual( self.index.find( 30, u'stale.txt' ), None )
+        self.assertEqual( self.index.find( 50, u'orphan.txt' ), None )
+        self.assertEqual( self.index.find( 30, u'zzz' ), None )
+        self.assertEqual( self.index.find( 1000, u'a' ), None )
+
+    def test_lookup( self ):
+        self.assertEqual( self.index.lookup( 30 ), ( 5, u'Windows' ) )
+        self.assertEqual( self.index.lookup( 250 ), ( 30, u'File049' ) )
+        self.assertEqual( self.index.lookup( 41 ), None )
+        self.assertEqual( self.index.lookup( 10000 ), None )
+        self.assertTrue( self.index.lookup( 40 ) in [ ( 30, u'notepad.exe' ), ( 32, u'notepad.exe' ) ] )
+
+    def test_records_in_use( self ):
+        self.assertTrue( 43 in self.index )
+        self.assertFalse( 44 in self.index )
+        self.assertFalse( 50 in self.index )
+        self.assertFalse( 10000 in self.index )
+        self.assertEqual( len( self.index ), 108 )
+
+    def test_results_are_int( self ):
+        self.assertEqual( type( self.index.find( 5, u'windows' ) ), int )
+        self.assertEqual( type( self.index.lookup( 30 )[0] ), int )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+import struct
+import logging
+import unittest
+
+from TScopy.MFT import ATTR_TYPE, MFT_RECORD_FLAGS
+from TScopy.MFTScan import parse_records, parse_records_batch, numpy
+from TScopy.MFTScan import scan_mft, scan_mft_parallel, MFTBitmap, MFTIndex
+from test_MFTBitmap import bitmap
+
+RECORD_SIZE = 1024
+USA_OFFSET = 0x30
+ATTRS_OFFSET = 0x38
+#   magic, usa_offset, usa_count, lsn, sequence_number, link_count, attrs_offset, flags,
+#   bytes_in_use, bytes_allocated, base_mft_record, next_attr_instance, reserved,
+#   mft_record_number
+RECORD_HEADER = struct.Struct("<4sHHQHHHHIIQHHI")
+#   type, size, non_resident, name_length, name_offset, flags, instance, value_length,
+#   value_offset, value_flags, reserved
+RESIDENT_HEADER = struct.Struct("<IIBBHHHIHBB")
+IN_USE = MFT_RECORD_FLAGS.MFT_RECORD_IN_USE
+
+logging.getLogger().addHandler( logging.NullHandler() )
+
+
+def reference( record, seq ):
+    return ( seq << 48 ) | record
+
+
+####################################################################################
+#  protect: Moves the last word of every sector of buf to the update sequence array at
+#       usa_offset and replaces it with usn, as the structure is stored on the disk
+####################################################################################
+def protect( buf, usa_offset, usn ):
+    struct.pack_into( "<H", buf, usa_offset, usn )
+    for i in range( len( buf ) / 512 ):
+        end = 512 * ( i + 1 ) - 2
+        buf[usa_offset + 2 + 2 * i:usa_offset + 4 + 2 * i] = buf[end:end + 2]
+        struct.pack_into( "<H", buf, end, usn )
+    return buf
+
+
+####################################################################################
+#  attribute: Returns a resident attribute holding value
+####################################################################################
+def attribute( attr_type, value, name=u'' ):
+    name = name.encode( "utf-16le" )
+    value_offset = ( RESIDENT_HEADER.size + len( name ) + 7 ) / 8 * 8
+    size = ( value_offset + len( value ) + 7 ) / 8 * 8
+    buf = bytearray( size )
+    RESIDENT_HEADER.pack_into( buf, 0, attr_type, size, 0, len( name ) / 2, RESIDENT_HEADER.size, 0, 0,
+                               len( value ), value_offset, 0, 0 )
+    buf[RESIDENT_HEADER.size:RESIDENT_HEADER.size + len( name )] = name
+    buf[value_offset:value_offset + len( value )] = value
+    return buf
+
+
+####################################################################################
+#  filename: Returns a $FILE_NAME attribute of name in the directory parent
+####################################################################################
+def filename( parent, name, namespace=1, flags=0 ):
+    value = bytearray( 0x42 )
+    struct.pack_into( "<Q", value, 0, parent )
+    struct.pack_into( "<IIBB", value, 0x38, flags, 0, len( name ), namespace )
+    return attribute( ATTR_TYPE.FILENAME_INFORMATION, value + name.encode( "utf-16le" ) )
+
+
+####################################################################################
+#  mft_record: Returns a FILE record holding attributes, protected by the update
+#       sequence array as it is on the disk
+####################################################################################
+def mft_record( attributes, seq=1, flags=IN_USE, base=0, lsn=0, number=0, size=RECORD_SIZE, usn=0x55 ):
+    body = "".join( str( a ) for a in attributes ) + struct.pack( "<II", 0xFFFFFFFF, 0 )
+    buf = bytearray( size )
+    RECORD_HEADER.pack_into( buf, 0, "FILE", USA_OFFSET, size / 512 + 1, lsn, seq, 1, ATTRS_OFFSET, flags,
+                             ATTRS_OFFSET + len( body ), size, base, 0, 0, number )
+    buf[ATTRS_OFFSET:ATTRS_OFFSET + len( body )] = body
+    return protect( buf, USA_OFFSET, usn )
+
+
+####################################################################################
+#  parse_records and parse_records_batch
+####################################################################################
+@unittest.skipIf( numpy == None, "numpy is not installed" )
+class ParseRecordsBatchTest( unittest.TestCase ):
+    def parse( self, parse, buf, first=100 ):
+        # The names of a record are in no particular order
+        return [ ( record, seq, sorted( names ) ) for record, seq, names in parse( bytearray( buf ), first, RECORD_SIZE ) ]
+
+    def assertSameRecords( self, buf, expected ):
+        self.assertEqual( self.parse( parse_records, buf ), expected )
+        self.assertEqual( self.parse( parse_records_batch, buf ), expected )
+
+    def test_records( self ):
+        data = attribute( ATTR_TYPE.DATA, "data" )
+        buf = mft_record( [ attribute( ATTR_TYPE.STANDARD_INFORMATION, bytearray( 0x48 ) ),
+                            filename( reference( 5, 5 ), u'file.txt' ), data ], seq=3 ) + \
+              mft_record( [ filename( reference( 5, 5 ), u'Windows', flags=0x10000000 ) ], seq=1,
+                          flags=IN_USE | MFT_RECORD_FLAGS.MFT_RECORD_IS_DIRECTORY ) + \
+              mft_record( [ data ], seq=2 )
+        self.assertSameRecords( buf, [ ( 100, 3, [ ( reference( 5, 5 ), u'file.txt' ) ] ),
+                                       ( 101, 1, [ ( reference( 5, 5 ), u'Windows' ) ] ),
+                                       ( 102, 2, [] ) ] )
+
+    def test_several_names( self ):
+        # The DOS name comes first, the Win32 name replaces it. A hard link in another
+        # directory keeps its POSIX name
+        buf = mft_record( [ filename( reference( 5, 5 ), u'PROGRA~1', namespace=2 ),
+                            filename( reference( 5, 5 ), u'Program Files', namespace=1 ),
+                            filename( reference( 30, 1 ), u'programs', namespace=0 ),
+                            attribute( ATTR_TYPE.DATA, "" ) ], seq=7 )
+        self.assertSameRecords( buf, [ ( 100, 7, [ ( reference( 30, 1 ), u'programs' ),
+                                                   ( reference( 5, 5 ), u'Program Files' ) ] ) ] )
+
+    def test_free_and_empty_slots( self ):
+        buf = mft_record( [ filename( reference( 5, 5 ), u'deleted.txt' ) ], flags=0 ) + \
+              bytearray( RECORD_SIZE ) + \
+              mft_record( [ filename( reference( 5, 5 ), u'kept.txt' ) ] )
+        self.assertSameRecords( buf, [ ( 102, 1, [ ( reference( 5, 5 ), u'kept.txt' ) ] ) ] )
+
+    def test_extension_record( self ):
+        buf = mft_record( [ filename( reference( 30, 1 ), u'Extended.dat' ) ], base=reference( 43, 4 ) )
+        self.assertSameRecords( buf, [ ( 43, None, [ ( reference( 30, 1 ), u'Extended.dat' ) ] ) ] )
+
+    def test_bad_fixup( self ):
+        # The end of the second sector was not written, the record is still parsed
+        buf = mft_record( [ filename( reference( 5, 5 ), u'torn.txt' ) ] )
+        struct.pack_into( "<H", buf, 1022, 0x66 )
+        self.assertSameRecords( buf, [ ( 100, 1, [ ( reference( 5, 5 ), u'torn.txt' ) ] ) ] )
+
+    def test_bad_update_sequence_array( self ):
+        records = [ mft_record( [ filename( reference( 5, 5 ), u'file%d' % n ) ] ) for n in range( 4 ) ]
+        # Too many entries, an entry past the first sector and an odd offset
+        struct.pack_into( "<H", records[0], 0x6, 5 )
+        struct.pack_into( "<H", records[1], 0x4, 0x1fc )
+        struct.pack_into( "<H", records[2], 0x4, 0x31 )
+        buf = "".join( str( r ) for r in records )
+        self.assertSameRecords( buf, [ ( 103, 1, [ ( reference( 5, 5 ), u'file3' ) ] ) ] )
+
+    def test_short_final_chunk( self ):
+        buf = mft_record( [ filename( reference( 5, 5 ), u'first' ) ] ) + \
+              mft_record( [ filename( reference( 5, 5 ), u'cut' ) ] )
+        self.assertSameRecords( buf[:-100], [ ( 100, 1, [ ( reference( 5, 5 ), u'first' ) ] ) ] )
+        self.assertSameRecords( buf[:100], [] )
+
+
+
+####################################################################################
+#  open_volume and read_volume: The volume of a Volume held in memory, module level
+#       so that scan_mft_parallel can hand them to its workers
+####################################################################################
+def open_volume( volume ):
+    return volume
+
+
+def read_volume( handle, offset, size ):
+    return bytearray( handle[offset:offset + size] )
+
+
+####################################################################################
+#  Volume: A $MFT of RECORD_COUNT records stored in three runs out of order. Records
+#       in FREE are not in use, 5 is the root, every tenth record is a directory of
+#       the root and the others are files in the directory before them. Record 17 is
+#       an extension record of record 16
+####################################################################################
+class Volume( object ):
+    RECORD_COUNT = 48
+    FREE = [ 3, 12, 13 ] + range( 32, 40 ) + [ 41 ]
+    # ( byte offset in the $MFT, byte offset on the volume )
+    RUNS = [ ( 0x0, 0x19000 ), ( 0x4000, 0x5000 ), ( 0xa000, 0xf000 ) ]
+
+    def __init__( self ):
+        mft = bytearray()
+        for n in range( Volume.RECORD_COUNT ):
+            mft += self.record( n )
+        self.mft_size = len( mft )
+        self.data = bytearray( 0x1d000 )
+        ends = [ start for start, offset in Volume.RUNS[1:] ] + [ self.mft_size ]
+        for ( start, offset ), end in zip( Volume.RUNS, ends ):
+            self.data[offset:offset + end - start] = mft[start:end]
+        self.data = str( self.data )
+        self.run_starts = [ start for start, offset in Volume.RUNS ]
+        self.run_offsets = [ offset for start, offset in Volume.RUNS ]
+        allocated = [ n for n in range( Volume.RECORD_COUNT ) if not n in Volume.FREE ]
+        self.bitmap = MFTBitmap( bitmap( allocated, Volume.RECORD_COUNT ), Volume.RECORD_COUNT )
+
+    def record( self, n ):
+        directory = IN_USE | MFT_RECORD_FLAGS.MFT_RECORD_IS_DIRECTORY
+        parent = reference( n / 10 * 10 or 5, 5 if n < 10 else 1 )
+        if n in Volume.FREE:
+            return mft_record( [ filename( parent, u'deleted%d' % n ) ], flags=0, number=n )
+        if n == 5:
+            return mft_record( [ filename( reference( 5, 5 ), u'.' ) ], seq=5, flags=directory, number=n )
+        if n % 10 == 0:
+            return mft_record( [ filename( reference( 5, 5 ), u'dir%d' % n ) ], flags=directory, number=n )
+        if n == 17:
+            return mft_record( [ filename( reference( 30, 1 ), u'hard link of file16' ) ], base=reference( 16, 1 ), number=n )
+        return mft_record( [ filename( parent, u'FILE%d~1' % n, namespace=2 ), filename( parent, u'file%d' % n ) ], number=n )
+
+    def read( self, offset, size ):
+        return read_volume( self.data, offset, size )
+
+
+####################################################################################
+#  scan_mft and scan_mft_parallel
+####################################################################################
+class ScanMftTest( unittest.TestCase ):
+    def setUp( self ):
+        self.volume = Volume()
+
+    def scan( self, chunk_size=4 * RECORD_SIZE, ranges=None ):
+        v = self.volume
+        return list( scan_mft( v.read, v.run_starts, v.run_offsets, v.mft_size, RECORD_SIZE, chunk_size=chunk_size,
+                               ranges=ranges ) )
+
+    def scan_parallel( self, chunk_size=4 * RECORD_SIZE, ranges=None ):
+        v = self.volume
+        return list( scan_mft_parallel( open_volume, read_volume, v.data, v.run_starts, v.run_offsets, v.mft_size,
+                                        RECORD_SIZE, 2, chunk_size=chunk_size, ranges=ranges ) )
+
+    def index( self, entries ):
+        index = MFTIndex()
+        for entry in entries:
+            index.add( *entry )
+        index.finish()
+        return index
+
+    def assertSameIndex( self, entries, expected ):
+        index = self.index( entries )
+        expected = self.index( expected )
+        self.assertEqual( len( index ), len( expected ) )
+        for n in range( Volume.RECORD_COUNT ):
+            self.assertEqual( n in index, n in expected )
+            self.assertEqual( index.lookup( n ), expected.lookup( n ) )
+            self.assertEqual( index.children( n ), expected.children( n ) )
+
+    def test_scan( self ):
+        entries = self.scan()
+        self.assertEqual( len( entries ), Volume.RECORD_COUNT - len( Volume.FREE ) )
+        self.assertEqual( entries[0][:2], ( 0, 1 ) )
+        self.assertTrue( ( 16, None, [ ( reference( 30, 1 ), u'hard link of file16' ) ] ) in entries )
+        # The chunks do not line up with the runs, the whole $MFT is read in one go too
+        self.assertEqual( self.scan( chunk_size=3 * RECORD_SIZE ), entries )
+        self.assertEqual( self.scan( chunk_size=1024 * RECORD_SIZE ), entries )
+        index = self.index( entries )
+        self.assertEqual( index.children( 10 ), dict( ( reference( n, 1 ), u'file%d' % n ) for n in [ 11, 14, 15, 16, 18, 19 ] ) )
+        self.assertEqual( index.find( 30, u'hard link of file16' ), reference( 16, 1 ) )
+        self.assertEqual( index.lookup( 12 ), None )
+
+    def test_parallel_scan( self ):
+        entries = self.scan()
+        self.assertEqual( self.scan_parallel(), entries )
+        self.assertEqual( self.scan_parallel( chunk_size=5 * RECORD_SIZE ), entries )
+        self.assertSameIndex( self.scan_parallel(), entries )
+
+    def test_bitmap_ranges( self ):
+        entries = self.scan()
+        ranges = list( self.volume.bitmap.ranges( max_records=4, gap=2 ) )
+        self.assertEqual( ranges[:3], [ ( 0, 4 ), ( 4, 8 ), ( 8, 12 ) ] )
+        # The records of a whole free byte of the bitmap are not read
+        self.assertEqual( ranges[-3:], [ ( 28, 32 ), ( 40, 44 ), ( 44, 48 ) ] )
+        self.assertSameIndex( self.scan( ranges=ranges ), entries )
+        self.assertEqual( self.scan_parallel( ranges=ranges ), self.scan( ranges=ranges ) )
+        self.assertSameIndex( self.scan_parallel( ranges=ranges ), entries )
+
+
+if __name__ == '__main__':
+    unittest.main()
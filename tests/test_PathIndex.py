@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import unittest
+
+from TScopy.PathIndex import PathIndex
+from TScopy.IndexTree import FILE_ATTR_HAS_INDX
+
+
+####################################################################################
+#  PathIndex.saveChildren and children
+####################################################################################
+class SaveChildrenTest( unittest.TestCase ):
+    def setUp( self ):
+        self.index = PathIndex( ':memory:' )
+        self.children = [ ( u'Windows', 30, 1, FILE_ATTR_HAS_INDX ), ( u'pagefile.sys', 31, 2, 0x26 ),
+                          ( u'Users', 32, 1, FILE_ATTR_HAS_INDX ) ]
+
+    def test_yields_children_unchanged( self ):
+        self.assertEqual( list( self.index.saveChildren( 5, self.children, 100 ) ), self.children )
+        self.assertEqual( list( self.index.children( 5 ) ), [ ( 'pagefile.sys', 31, 0x26 ), ( 'users', 32, FILE_ATTR_HAS_INDX ),
+                                                              ( 'windows', 30, FILE_ATTR_HAS_INDX ) ] )
+        self.assertEqual( self.index.lookup( 5, 'WINDOWS' ), ( 30, 1 ) )
+        self.assertEqual( self.index.listed( 5 ), 100 )
+
+    def test_listing_not_read_to_the_end( self ):
+        saving = self.index.saveChildren( 5, self.children, 100 )
+        next( saving )
+        next( saving )
+        self.assertEqual( self.index.children( 5 ), None )
+        saving.close()
+        self.assertEqual( self.index.children( 5 ), None )
+        self.assertFalse( self.index.isMissing( 5, 'other' ) )
+
+    def test_replaces_the_children( self ):
+        list( self.index.saveChildren( 5, self.children, 100 ) )
+        list( self.index.saveChildren( 5, [ ( u'new', 40, 1 ) ], 200 ) )
+        self.assertEqual( list( self.index.children( 5 ) ), [ ( 'new', 40, None ) ] )
+        self.assertEqual( self.index.lookup( 5, 'windows' ), None )
+        self.assertEqual( self.index.listed( 5 ), 200 )
+
+    def test_empty_directory( self ):
+        list( self.index.saveChildren( 5, [], 100 ) )
+        self.assertEqual( list( self.index.children( 5 ) ), [] )
+
+    def test_children_are_paged( self ):
+        children = [ ( u'file%05d' % n, 100 + n, 1 ) for n in range( 2 * PathIndex.PAGE_SIZE + 10 ) ]
+        list( self.index.saveChildren( 5, reversed( children ), 100 ) )
+        self.assertEqual( list( self.index.children( 5 ) ), [ ( name, record, None ) for name, record, seq in children ] )
+
+    def test_unlisted_directory( self ):
+        self.assertEqual( self.index.children( 5 ), None )
+        self.index.addLookup( 5, u'Windows', 30, 1, 100 )
+        self.assertEqual( self.index.children( 5 ), None )
+
+
+####################################################################################
+#  PathIndex.isMissing, addMissing and invalidate
+####################################################################################
+class MissingTest( unittest.TestCase ):
+    def setUp( self ):
+        self.index = PathIndex( ':memory:' )
+
+    def test_unknown_directory( self ):
+        self.assertFalse( self.index.isMissing( 5, 'windows' ) )
+
+    def test_missing_lookup( self ):
+        self.index.addMissing( 5, u'NoSuchFile', 100 )
+        self.assertTrue( self.index.isMissing( 5, 'nosuchfile' ) )
+        self.assertFalse( self.index.isMissing( 5, 'other' ) )
+        self.assertEqual( self.index.listed( 5 ), 100 )
+        self.assertEqual( self.index.children( 5 ), None )
+
+    def test_absent_from_a_complete_listing( self ):
+        list( self.index.saveChildren( 5, [ ( u'Windows', 30, 1 ) ], 100 ) )
+        self.assertTrue( self.index.isMissing( 5, 'nosuchfile' ) )
+        self.assertFalse( self.index.isMissing( 5, 'WINDOWS' ) )
+
+    def test_lookups_at_the_same_lsn_are_kept( self ):
+        self.index.addLookup( 5, u'Windows', 30, 1, 100 )
+        self.index.addMissing( 5, u'x', 100 )
+        self.index.addLookup( 5, u'Users', 32, 1, 100 )
+        self.assertEqual( self.index.lookup( 5, 'windows' ), ( 30, 1 ) )
+        self.assertTrue( self.index.isMissing( 5, 'x' ) )
+
+    def test_another_lsn_drops_the_directory( self ):
+        self.index.addLookup( 5, u'Windows', 30, 1, 100 )
+        self.index.addMissing( 5, u'x', 100 )
+        self.index.addMissing( 5, u'y', 200 )
+        self.assertFalse( self.index.isMissing( 5, 'x' ) )
+        self.assertTrue( self.index.isMissing( 5, 'y' ) )
+        self.assertEqual( self.index.lookup( 5, 'windows' ), None )
+        self.assertEqual( self.index.listed( 5 ), 200 )
+
+    def test_added_entry_is_no_longer_missing( self ):
+        self.index.addMissing( 5, u'new.txt', 100 )
+        self.index.addEntry( 5, u'New.txt', 40, 1 )
+        self.assertFalse( self.index.isMissing( 5, 'new.txt' ) )
+        self.assertEqual( self.index.lookup( 5, 'new.txt' ), ( 40, 1 ) )
+
+    def test_added_entry_keeps_its_attributes( self ):
+        list( self.index.saveChildren( 5, [ ( u'Windows', 30, 1, FILE_ATTR_HAS_INDX ) ], 100 ) )
+        self.index.addEntry( 5, u'Users', 32, 1, FILE_ATTR_HAS_INDX )
+        self.index.addEntry( 5, u'new.txt', 40, 1 )
+        self.assertEqual( list( self.index.children( 5 ) ), [ ( 'new.txt', 40, None ), ( 'users', 32, FILE_ATTR_HAS_INDX ),
+                                                              ( 'windows', 30, FILE_ATTR_HAS_INDX ) ] )
+
+    def test_invalidate( self ):
+        list( self.index.saveChildren( 5, [ ( u'Windows', 30, 1 ) ], 100 ) )
+        self.index.addMissing( 5, u'x', 100 )
+        list( self.index.saveChildren( 30, [ ( u'System32', 31, 1 ) ], 100 ) )
+        self.index.invalidate( 5 )
+        self.assertEqual( self.index.listed( 5 ), None )
+        self.assertEqual( self.index.children( 5 ), None )
+        self.assertEqual( self.index.lookup( 5, 'windows' ), None )
+        self.assertFalse( self.index.isMissing( 5, 'x' ) )
+        self.assertFalse( self.index.isMissing( 5, 'other' ) )
+        self.assertEqual( list( self.index.children( 30 ) ), [ ( 'system32', 31, None ) ] )
+
+    def test_entries_of_unlisted_directories_are_not_added( self ):
+        self.index.addEntry( 5, u'new.txt', 40, 1 )
+        self.assertEqual( self.index.lookup( 5, 'new.txt' ), None )
+
+    def test_remove_entry_of_another_record( self ):
+        list( self.index.saveChildren( 5, [ ( u'Windows', 30, 1 ) ], 100 ) )
+        self.index.removeEntry( 5, u'windows', 31 )
+        self.assertEqual( self.index.lookup( 5, 'windows' ), ( 30, 1 ) )
+        self.index.removeEntry( 5, u'Windows', 30 )
+        self.assertEqual( self.index.lookup( 5, 'windows' ), None )
+        self.assertTrue( self.index.isMissing( 5, 'windows' ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import time
+import threading
+import unittest
+
+from TScopy.ReadAhead import read_ahead
+
+
+class ReadError( Exception ):
+    pass
+
+
+####################################################################################
+#  read_ahead
+####################################################################################
+class ReadAheadTest( unittest.TestCase ):
+    def test_items_in_order( self ):
+        for depth in ( 1, 2, 10 ):
+            self.assertEqual( list( read_ahead( iter( range( 100 ) ), depth ) ), range( 100 ) )
+
+    def test_exception_is_raised_in_caller( self ):
+        def items():
+            yield 1
+            yield 2
+            raise ReadError( "short read" )
+        found = []
+        with self.assertRaises( ReadError ):
+            for item in read_ahead( items(), 2 ):
+                found.append( item )
+        self.assertEqual( found, [ 1, 2 ] )
+
+    def test_close_stops_reader( self ):
+        produced = []
+        def items():
+            for n in range( 1000 ):
+                produced.append( n )
+                yield n
+        chunks = read_ahead( items(), 2 )
+        self.assertEqual( next( chunks ), 0 )
+        chunks.close()
+        # The reader has stopped once close returns, it produces no more items
+        count = len( produced )
+        self.assertTrue( count < 1000 )
+        self.assertFalse( [ t for t in threading.enumerate() if t.name == "tscopy-read-ahead" ] )
+        self.assertEqual( len( produced ), count )
+
+    def test_depth_bounds_the_items_read_ahead( self ):
+        produced = []
+        def items():
+            for n in range( 100 ):
+                produced.append( n )
+                yield n
+        chunks = read_ahead( items(), 3 )
+        next( chunks )
+        # One item taken, depth queued and one waiting to be queued
+        for retry in range( 100 ):
+            time.sleep( 0.01 )
+            if len( produced ) >= 5:
+                break
+        self.assertEqual( len( produced ), 5 )
+        chunks.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+import struct
+import logging
+import unittest
+
+from TScopy.PathIndex import PathIndex
+from TScopy.IndexTree import FILE_ATTR_HAS_INDX
+from TScopy.UsnJournal import USN_REASON, USN_RECORD_V2, USN_RECORD_V3, PAGE_SIZE, FILE_ATTRIBUTE_DIRECTORY
+from TScopy.UsnJournal import parse_usn_records, UsnReader, read_usn_journal, usn_resume, apply_usn_records
+
+USN_CLOSE = 0x80000000
+
+logging.getLogger("tscopy").addHandler( logging.NullHandler() )
+
+
+def reference( record, seq ):
+    return ( seq << 48 ) | record
+
+
+####################################################################################
+#  usn_record: Returns a USN_RECORD_V2 or V3 padded to 8 bytes
+####################################################################################
+def usn_record( usn, record, parent, reason, name, attributes=0, major=2 ):
+    name = name.encode( "utf-16le" )
+    if major == 2:
+        header = USN_RECORD_V2.size + 8
+        body = USN_RECORD_V2.pack( record, parent, usn, 0, reason, 0, 0, attributes, len( name ), header )
+    else:
+        header = USN_RECORD_V3.size + 8
+        body = USN_RECORD_V3.pack( record, 0, parent, 0, usn, 0, reason, 0, 0, attributes, len( name ), header )
+    length = ( header + len( name ) + 7 ) / 8 * 8
+    buf = struct.pack( "<IHH", length, major, 0 ) + body + name
+    return buf + '\x00' * ( length - len( buf ) )
+
+
+####################################################################################
+#  journal: Returns ( $J data from first, records ) for count records named file<n>.
+#       Records are not split across pages, the end of a page is zero filled
+####################################################################################
+def journal( first, count, major=2 ):
+    buf = bytearray()
+    records = []
+    for n in range( count ):
+        name = u'file%03d' % n
+        length = len( usn_record( 0, 0, 0, 0, name, major=major ) )
+        if ( first + len( buf ) ) / PAGE_SIZE < ( first + len( buf ) + length - 1 ) / PAGE_SIZE:
+            buf += '\x00' * ( PAGE_SIZE - ( first + len( buf ) ) % PAGE_SIZE )
+        usn = first + len( buf )
+        buf += usn_record( usn, reference( 100 + n, 1 ), reference( 5, 5 ), USN_REASON.FILE_CREATE, name, major=major )
+        records.append( ( usn, reference( 100 + n, 1 ), reference( 5, 5 ), USN_REASON.FILE_CREATE, 0, name ) )
+    return buf, records
+
+
+####################################################################################
+#  parse_usn_records
+####################################################################################
+class ParseUsnRecordsTest( unittest.TestCase ):
+    def test_versions( self ):
+        for major in ( 2, 3 ):
+            buf, records = journal( 0x2000, 3, major )
+            self.assertEqual( parse_usn_records( buf, 0x2000 ), ( records, len( buf ) ) )
+
+    def test_page_padding( self ):
+        buf, records = journal( 0, 80 )
+        self.assertTrue( records[-1][0] > PAGE_SIZE )
+        self.assertEqual( parse_usn_records( buf, 0 ), ( records, len( buf ) ) )
+
+    def test_cut_off_record( self ):
+        buf, records = journal( 0, 3 )
+        cut = records[2][0] + 10
+        self.assertEqual( parse_usn_records( buf[:cut], 0 ), ( records[:2], records[2][0] ) )
+
+    def test_invalid_length( self ):
+        buf, records = journal( 0, 3 )
+        buf[records[1][0]:records[1][0] + 4] = struct.pack( "<I", 13 )
+        self.assertEqual( parse_usn_records( buf, 0 ), ( records[:1], len( buf ) ) )
+
+
+####################################################################################
+#  UsnReader
+####################################################################################
+class UsnReaderTest( unittest.TestCase ):
+    def test_straddling_chunks( self ):
+        buf, records = journal( 0, 80 )
+        for size in ( 1, 7, 100, 4096 ):
+            reader = UsnReader()
+            found = []
+            for pos in range( 0, len( buf ), size ):
+                found.extend( reader.feed( buf[pos:pos + size], pos ) )
+            self.assertEqual( found, records )
+            self.assertEqual( reader.next_usn, len( buf ) )
+
+    def test_gap_drops_pending( self ):
+        buf, records = journal( 0, 80 )
+        reader = UsnReader()
+        self.assertEqual( reader.feed( buf[:records[1][0] + 10], 0 ), records[:1] )
+        self.assertEqual( reader.feed( buf[records[2][0]:], records[2][0] ), records[2:] )
+
+
+####################################################################################
+#  read_usn_journal
+####################################################################################
+class ReadUsnJournalTest( unittest.TestCase ):
+    def setUp( self ):
+        # $J starts with a sparse run of 4 clusters, followed by 6 clusters at cluster 10
+        self.bpc = 0x800
+        self.data, self.records = journal( 4 * self.bpc, 60 )
+        self.volume = bytearray( 10 * self.bpc ) + self.data + bytearray( 16 * self.bpc )
+        self.extents = [ ( None, 4 ), ( 10, 6 ) ]
+        self.end = 4 * self.bpc + len( self.data )
+        self.reads = []
+
+    def read( self, offset, size ):
+        self.reads.append( ( offset, size ) )
+        return self.volume[offset:offset + size]
+
+    def records_from( self, start, chunk_size ):
+        found = []
+        for records in read_usn_journal( self.read, self.extents, self.bpc, start, self.end, chunk_size ):
+            found.extend( records )
+        return found
+
+    def test_sparse_leading_run( self ):
+        for chunk_size in ( self.bpc, 3 * self.bpc, 1024 * 1024 ):
+            self.assertEqual( self.records_from( 0, chunk_size ), self.records )
+        self.assertTrue( all( offset >= 10 * self.bpc and size % self.bpc == 0 for offset, size in self.reads ) )
+
+    def test_start_inside_a_cluster( self ):
+        start = self.records[30][0]
+        self.assertTrue( start % self.bpc > 0 )
+        self.assertEqual( self.records_from( start, self.bpc ), self.records[30:] )
+
+
+####################################################################################
+#  usn_resume
+####################################################################################
+class UsnResumeTest( unittest.TestCase ):
+    def test_resume( self ):
+        self.assertEqual( usn_resume( ( 7, 0x5000 ), 7, 0x1000, 0x8000 ), 0x5000 )
+        self.assertEqual( usn_resume( ( 7, 0x8000 ), 7, 0x1000, 0x8000 ), 0x8000 )
+
+    def test_journal_id_reset( self ):
+        self.assertEqual( usn_resume( ( 7, 0x5000 ), 8, 0x1000, 0x8000 ), None )
+
+    def test_wrapped( self ):
+        self.assertEqual( usn_resume( ( 7, 0x800 ), 7, 0x1000, 0x8000 ), None )
+        self.assertEqual( usn_resume( ( 7, 0x9000 ), 7, 0x1000, 0x8000 ), None )
+
+
+####################################################################################
+#  apply_usn_records
+####################################################################################
+class ApplyUsnRecordsTest( unittest.TestCase ):
+    def setUp( self ):
+        self.index = PathIndex( ':memory:' )
+        children = [ ( 'f077', 109, 3 ), ( 'a001', 110, 1 ) ]
+        list( self.index.saveChildren( 30, children, 1000 ) )
+
+    def apply( self, *records ):
+        # ( record, sequence number, reason, name [, file attributes] ) in the directory 30
+        usn_records = []
+        for usn, entry in enumerate( records ):
+            record, seq, reason, name = entry[:4]
+            attributes = entry[4] if len( entry ) > 4 else 0
+            usn_records.append( ( usn, reference( record, seq ), reference( 30, 1 ), reason, attributes, name ) )
+        return apply_usn_records( self.index, usn_records )
+
+    def test_create( self ):
+        self.apply( ( 111, 2, USN_REASON.FILE_CREATE, u'New.txt' ),
+                    ( 111, 2, USN_REASON.FILE_CREATE | USN_CLOSE, u'New.txt' ) )
+        self.assertEqual( self.index.lookup( 30, 'new.txt' ), ( 111, 2 ) )
+
+    def test_created_entries_keep_their_attributes( self ):
+        self.apply( ( 111, 2, USN_REASON.FILE_CREATE, u'new.txt', 0x20 ),
+                    ( 112, 1, USN_REASON.FILE_CREATE, u'newdir', FILE_ATTRIBUTE_DIRECTORY | 0x2 ) )
+        children = dict( ( name, flags ) for name, record, flags in self.index.children( 30 ) )
+        self.assertEqual( children['new.txt'], 0x20 )
+        self.assertEqual( children['newdir'], FILE_ATTR_HAS_INDX | 0x2 )
+
+    def test_create_in_unlisted_directory( self ):
+        records = [ ( 0, reference( 111, 2 ), reference( 31, 1 ), USN_REASON.FILE_CREATE, 0, u'new.txt' ) ]
+        apply_usn_records( self.index, records )
+        self.assertEqual( self.index.lookup( 31, 'new.txt' ), None )
+        self.assertEqual( self.index.listed( 31 ), None )
+
+    def test_create_and_rename( self ):
+        self.apply( ( 111, 2, USN_REASON.FILE_CREATE, u'tmp' ),
+                    ( 111, 2, USN_REASON.FILE_CREATE | USN_REASON.RENAME_OLD_NAME, u'tmp' ),
+                    ( 111, 2, USN_REASON.FILE_CREATE | USN_REASON.RENAME_NEW_NAME, u'final' ) )
+        self.assertEqual( self.index.lookup( 30, 'tmp' ), None )
+        self.assertEqual( self.index.lookup( 30, 'final' ), ( 111, 2 ) )
+
+    def test_rename( self ):
+        self.apply( ( 109, 3, USN_REASON.RENAME_OLD_NAME, u'f077' ),
+                    ( 109, 3, USN_REASON.RENAME_NEW_NAME, u'g077' ) )
+        self.assertEqual( self.index.lookup( 30, 'f077' ), None )
+        self.assertEqual( self.index.lookup( 30, 'g077' ), ( 109, 3 ) )
+
+    def test_delete( self ):
+        self.apply( ( 109, 3, USN_REASON.FILE_DELETE | USN_CLOSE, u'f077' ) )
+        self.assertEqual( self.index.lookup( 30, 'f077' ), None )
+        self.assertEqual( self.index.lookup( 30, 'a001' ), ( 110, 1 ) )
+
+    def test_delete_other_record( self ):
+        # A delete only removes the name while it still refers to the deleted record
+        self.apply( ( 120, 1, USN_REASON.FILE_DELETE | USN_CLOSE, u'f077' ) )
+        self.assertEqual( self.index.lookup( 30, 'f077' ), ( 109, 3 ) )
+
+    def test_create_and_delete( self ):
+        self.apply( ( 111, 2, USN_REASON.FILE_CREATE, u'tmp' ),
+                    ( 111, 2, USN_REASON.FILE_CREATE | USN_REASON.FILE_DELETE | USN_CLOSE, u'tmp' ) )
+        self.assertEqual( self.index.lookup( 30, 'tmp' ), None )
+
+    def test_delete_directory( self ):
+        list( self.index.saveChildren( 110, [ ( 'x', 200, 1 ) ], 2000 ) )
+        self.apply( ( 110, 1, USN_REASON.FILE_DELETE | USN_CLOSE, u'a001', FILE_ATTRIBUTE_DIRECTORY ) )
+        self.assertEqual( self.index.lookup( 30, 'a001' ), None )
+        self.assertEqual( self.index.listed( 110 ), None )
+        self.assertEqual( self.index.lookup( 110, 'x' ), None )
+
+    def test_hard_link_change( self ):
+        self.apply( ( 109, 3, USN_REASON.HARD_LINK_CHANGE | USN_REASON.FILE_CREATE, u'link' ) )
+        self.assertEqual( self.index.listed( 30 ), None )
+        self.assertEqual( self.index.lookup( 30, 'f077' ), None )
+
+    def test_rename_twice_in_one_handle( self ):
+        # The old name record of the second rename also carries RENAME_NEW_NAME
+        self.apply( ( 109, 3, USN_REASON.RENAME_OLD_NAME, u'f077' ),
+                    ( 109, 3, USN_REASON.RENAME_NEW_NAME, u'h077' ),
+                    ( 109, 3, USN_REASON.RENAME_OLD_NAME | USN_REASON.RENAME_NEW_NAME, u'h077' ),
+                    ( 109, 3, USN_REASON.RENAME_NEW_NAME, u'g077' ),
+                    ( 109, 3, USN_REASON.RENAME_NEW_NAME | USN_CLOSE, u'g077' ) )
+        self.assertEqual( self.index.lookup( 30, 'f077' ), None )
+        self.assertEqual( self.index.lookup( 30, 'h077' ), None )
+        self.assertEqual( self.index.lookup( 30, 'g077' ), ( 109, 3 ) )
+        self.assertTrue( self.index.isMissing( 30, 'h077' ) )
+
+    def test_touched( self ):
+        touched = self.apply( ( 110, 1, USN_REASON.RENAME_OLD_NAME, u'a001' ) )
+        self.assertEqual( touched, set( [ 30, 110 ] ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
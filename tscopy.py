@@ -13,6 +13,7 @@ import os
 import argparse
 import traceback
 import time
+import multiprocessing
 
 from TScopy.tscopy import TScopy
 
@@ -40,6 +41,14 @@ def parseArgs():
     parser.add_argument('-o', '--outputdir', help="Directory to copy files too. Copy will keep paths" )   
     parser.add_argument('-i', '--ignore_saved_ref_nums', action='store_true', help="Script stores the Reference numbers and path info to speed up internal run. This option will ignore and not save the stored MFT reference numbers and path")
     parser.add_argument('-r', '--recursive', action='store_true', help="Recursively copies directory. Note this only works with directories.")
+    parser.add_argument('-c', '--cache_size', type=int, default=16, help="Megabytes of raw disk reads to cache in memory while parsing the MFT. 0 disables the cache. Default 16")
+    parser.add_argument('-s', '--scan_mft', action='store_true', help="Reads the entire MFT once to locate files instead of walking each directory. Faster when copying many files or directories.")
+    parser.add_argument('-p', '--scan_processes', type=int, default=1, help="Number of processes used to parse the MFT with --scan_mft. 0 uses one per CPU. Default 1")
+    parser.add_argument('-b', '--chunk_size', type=int, default=4, help="Megabytes of file data read and written at a time while copying a file. Default 4")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of threads copying the files of a directory. 0 uses one per CPU. Default 1")
+    parser.add_argument('-e', '--extent_jobs', type=int, default=1, help="Number of threads copying the extents of each file larger than --chunk_size. 0 uses one per CPU. Default 1")
+    parser.add_argument('-d', '--disk_order', action='store_true', help="Finds every file first, then reads their data in the order it is on the disk. Faster on hard disks when copying many files.")
+    parser.add_argument('-q', '--queue_depth', type=int, default=2, help="Chunks of file data read ahead while the previous ones are written. 0 reads and writes in turn. Default 2")
     parser.add_argument('--debug', action='store_true', help=argparse.SUPPRESS)
     
     args = parser.parse_args()
@@ -55,6 +64,36 @@ def parseArgs():
         parser.print_help()
         sys.exit(1)
 
+    if args.scan_processes < 0:
+        log.error("\nError invalid number of processes (%d)\n\n" % args.scan_processes )
+        parser.print_help()
+        sys.exit(1)
+
+    if args.cache_size < 0:
+        log.error("\nError invalid cache size (%d)\n\n" % args.cache_size )
+        parser.print_help()
+        sys.exit(1)
+
+    if args.chunk_size <= 0:
+        log.error("\nError invalid chunk size (%d)\n\n" % args.chunk_size )
+        parser.print_help()
+        sys.exit(1)
+
+    if args.jobs < 0:
+        log.error("\nError invalid number of jobs (%d)\n\n" % args.jobs )
+        parser.print_help()
+        sys.exit(1)
+
+    if args.extent_jobs < 0:
+        log.error("\nError invalid number of extent jobs (%d)\n\n" % args.extent_jobs )
+        parser.print_help()
+        sys.exit(1)
+
+    if args.queue_depth < 0:
+        log.error("\nError invalid queue depth (%d)\n\n" % args.queue_depth )
+        parser.print_help()
+        sys.exit(1)
+
     if args.outputdir:
         tmp_dir = args.outputdir
         if tmp_dir[-1] == os.sep:
@@ -69,10 +108,20 @@ def parseArgs():
                'outputbasedir': args.outputdir,
                'debug': args.debug,
                'recursive': args.recursive,
-               'ignore_table': args.ignore_saved_ref_nums
+               'ignore_table': args.ignore_saved_ref_nums,
+               'cache_size': args.cache_size,
+               'scan_mft': args.scan_mft,
+               'scan_processes': args.scan_processes,
+               'chunk_size': args.chunk_size,
+               'queue_depth': args.queue_depth,
+               'jobs': args.jobs,
+               'extent_jobs': args.extent_jobs,
+               'disk_order': args.disk_order
              }
 
 if __name__ == '__main__':
+    # Required for the MFT scan worker processes in the PyInstaller executable
+    multiprocessing.freeze_support()
     start = time.time()    
     args = parseArgs()
 
@@ -80,7 +129,15 @@ if __name__ == '__main__':
                'pickledir': args['outputbasedir'],
                'debug': args['debug'],
                'logger': log,
-               'ignore_table': args['ignore_table']}
+               'ignore_table': args['ignore_table'],
+               'cache_size': args['cache_size']*1024*1024,
+               'mft_scan': args['scan_mft'],
+               'mft_scan_processes': args['scan_processes'],
+               'chunk_size': args['chunk_size']*1024*1024,
+               'queue_depth': args['queue_depth'],
+               'jobs': args['jobs'],
+               'extent_jobs': args['extent_jobs'],
+               'disk_order': args['disk_order']}
                                                                                 
     try:                                                                        
         tscopy = TScopy()
@@ -91,6 +148,7 @@ if __name__ == '__main__':
                 tscopy.copy( src, dst_path, bRecursive=args['recursive'])
             except:
                 log.error( traceback.format_exc() ) 
+        tscopy.close()
     except:
         log.error( traceback.format_exc() ) 
 